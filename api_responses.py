@@ -0,0 +1,219 @@
+import json
+import zlib
+import logging
+from datetime import date, datetime
+from pathlib import PurePath
+
+import anyio
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse
+
+from static_assets import accepted_encodings
+
+logger = logging.getLogger("api_responses")
+
+# orjson、brotli、zstandard 均为可选依赖，未安装时分别回退到标准库 json 和 gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 小于该大小的响应不压缩
+MIN_COMPRESS_SIZE = 1024
+# 超过该大小的响应体在线程中压缩，不阻塞事件循环
+THREAD_COMPRESS_SIZE = 256 * 1024
+
+# 各编码的压缩级别（兼顾压缩率和 CPU 开销）
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+# 会被压缩的响应类型（text/event-stream 需要逐条推送，不压缩）
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+    "text/xml",
+}
+
+
+def _default(obj):
+    """标准 JSON 不支持的类型"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, PurePath):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", "replace")
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    raise TypeError(f"无法序列化为 JSON: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    """把接口返回的字典/列表序列化为 UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    使用 orjson 序列化的 JSON 响应
+
+    接口直接返回该响应时，FastAPI 不再对内容执行 jsonable_encoder，
+    适合文件列表等由接口自行构建好的大字典。
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def _gzip_compressor():
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return (lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH),
+            lambda: compressor.flush(zlib.Z_FINISH))
+
+
+def _brotli_compressor():
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return (lambda data: compressor.process(data) + compressor.flush(), compressor.finish)
+
+
+def _zstd_compressor():
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return (lambda data: compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush)
+
+
+# 按优先级排列的可用编码
+COMPRESSORS = [
+    (name, factory) for name, factory, available in (
+        ("br", _brotli_compressor, brotli is not None),
+        ("zstd", _zstd_compressor, zstandard is not None),
+        ("gzip", _gzip_compressor, True),
+    ) if available
+]
+
+
+def choose_encoding(accept_encoding):
+    """根据 Accept-Encoding 选择压缩编码，客户端都不接受时返回 (None, None)"""
+    accepted = accepted_encodings(accept_encoding)
+    for name, factory in COMPRESSORS:
+        if name in accepted:
+            return name, factory
+    return None, None
+
+
+class CompressionMiddleware:
+    """
+    按 Accept-Encoding 压缩接口和页面响应（br / zstd / gzip）
+
+    只处理文本类响应；文件下载、媒体流和静态资源带有 Accept-Ranges 或
+    Content-Encoding，原样透传。分块发送的响应逐块压缩并立即刷新，不等待整个响应体。
+    """
+
+    def __init__(self, app, minimum_size=MIN_COMPRESS_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = {k: v for k, v in scope["headers"] if k == b"accept-encoding"}
+        encoding, factory = choose_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compress = finish = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compress, finish, passthrough
+
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+                passthrough = (
+                    message["status"] < 200 or message["status"] in (204, 206, 304)
+                    or media_type not in COMPRESSIBLE_TYPES
+                    or "content-encoding" in headers
+                    or "accept-ranges" in headers
+                    or "content-range" in headers
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    # 等第一块响应体到达后再决定是否压缩
+                    start_message = message
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "etag" in headers and not headers["etag"].startswith("W/"):
+                    # 压缩后的内容与原始内容不同，使用弱 ETag
+                    headers["ETag"] = "W/" + headers["etag"]
+                del headers["Content-Length"]
+                compress, finish = factory()
+
+                if not more_body:
+                    compressed = await self._compress_all(compress, finish, body)
+                    headers["Content-Length"] = str(len(compressed))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                await send(start_message)
+                start_message = None
+
+            if len(body) >= THREAD_COMPRESS_SIZE:
+                data = await anyio.to_thread.run_sync(compress, body)
+            else:
+                data = compress(body) if body else b""
+            if not more_body:
+                data += finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    async def _compress_all(compress, finish, body):
+        def run():
+            return compress(body) + finish()
+        if len(body) >= THREAD_COMPRESS_SIZE:
+            return await anyio.to_thread.run_sync(run)
+        return run()
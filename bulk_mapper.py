@@ -0,0 +1,297 @@
+import os
+import errno
+import shutil
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger("bulk_mapper")
+
+# 映射清单数据库路径（与 users.db 放在同一目录）
+BASE_DIR = os.environ.get("ZAY_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
+MAPPING_MANIFEST_DB = os.path.join(BASE_DIR, "mapping_manifest.db")
+
+# 并行扫描目录和创建链接的线程数（网络存储上 stat 延迟较高，多线程可以重叠等待）
+MAP_WORKERS = 8
+# 每批写入清单的记录数
+MANIFEST_BATCH_SIZE = 2000
+
+
+class MapResult:
+    """一次批量映射的统计"""
+
+    __slots__ = ("mapped", "updated", "unchanged", "skipped", "failed", "scanned", "elapsed", "stopped")
+
+    def __init__(self):
+        self.mapped = 0      # 新建的链接/副本
+        self.updated = 0     # 源文件变化后重新映射
+        self.unchanged = 0   # 与上次映射一致，未做任何操作
+        self.skipped = 0     # 目标位置已有其他文件
+        self.failed = 0
+        self.scanned = 0
+        self.elapsed = 0.0
+        self.stopped = False  # 被中途停止，结果不完整
+
+    def add(self, other):
+        for name in ("mapped", "updated", "unchanged", "skipped", "failed", "scanned"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class BulkMapper:
+    """
+    并行、增量的目录批量映射
+
+    源目录用 os.scandir 分目录并行扫描，每个目录在线程池中完成 stat 和链接/复制。
+    每对 (源目录, 目标目录) 在 SQLite 中保存一份清单，记录已映射文件的
+    (相对路径, 大小, 修改时间, inode)；再次映射时只处理新增或变化的文件，
+    目标目录中已存在且与清单一致的文件不做任何操作。
+    """
+
+    def __init__(self, db_path=MAPPING_MANIFEST_DB, workers=MAP_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+        self._init_schema()
+
+    # ---------------- 数据库 ----------------
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS mapped_entries (
+                    source TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    rel_path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    PRIMARY KEY (source, target, rel_path)
+                )
+            """)
+
+    def _load_manifest(self, source, target):
+        rows = self._connect().execute(
+            "SELECT rel_path, size, mtime_ns, inode FROM mapped_entries WHERE source = ? AND target = ?",
+            (source, target)
+        )
+        return {rel_path: (size, mtime_ns, inode) for rel_path, size, mtime_ns, inode in rows}
+
+    def _save_entries(self, source, target, records):
+        if not records:
+            return
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO mapped_entries (source, target, rel_path, size, mtime_ns, inode) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(source, target, *record) for record in records]
+            )
+
+    def _remove_entries(self, source, target, rel_paths):
+        conn = self._connect()
+        rel_paths = list(rel_paths)
+        with self._write_lock, conn:
+            for i in range(0, len(rel_paths), 500):
+                batch = rel_paths[i:i + 500]
+                conn.execute(
+                    f"DELETE FROM mapped_entries WHERE source = ? AND target = ? "
+                    f"AND rel_path IN ({','.join('?' * len(batch))})",
+                    (source, target, *batch)
+                )
+
+    def forget(self, source, target=None):
+        """删除映射清单（下次映射时重新检查全部文件）"""
+        conn = self._connect()
+        with self._write_lock, conn:
+            if target is None:
+                conn.execute("DELETE FROM mapped_entries WHERE source = ?", (str(source),))
+            else:
+                conn.execute("DELETE FROM mapped_entries WHERE source = ? AND target = ?",
+                             (str(source), str(target)))
+
+    # ---------------- 链接/复制 ----------------
+
+    def _link_or_copy(self, src, dest, state):
+        """优先创建硬链接；跨文件系统时复制（同一次映射中不再重复尝试链接）"""
+        if state["link"]:
+            try:
+                os.link(src, dest)
+                return
+            except OSError as e:
+                if e.errno == errno.EXDEV:
+                    state["link"] = False
+                elif e.errno not in (errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                    raise
+        shutil.copy2(src, dest)
+
+    def _replace(self, src, dest, state):
+        """源文件变化后重新映射：先在临时文件名创建，再原子替换"""
+        tmp_path = f"{dest}.{os.getpid()}.{threading.get_ident()}.mapping"
+        try:
+            self._link_or_copy(src, tmp_path, state)
+            os.replace(tmp_path, dest)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    # ---------------- 扫描 ----------------
+
+    def _scan_directory(self, src_dir, dest_dir, rel_dir, manifest, state):
+        """
+        处理一个源目录中的文件（在线程池中执行）
+
+        Returns:
+            (子目录列表, 清单记录, 已处理的相对路径, 统计)
+        """
+        result = MapResult()
+        subdirs, records, seen = [], [], []
+        try:
+            # 一次列出目标目录，代替逐个文件检查是否存在
+            existing = set(os.listdir(dest_dir))
+        except FileNotFoundError:
+            existing = None
+
+        try:
+            entries = list(os.scandir(src_dir))
+        except OSError as e:
+            logger.error(f"读取源目录失败: {src_dir} - {str(e)}")
+            result.failed += 1
+            return subdirs, records, seen, result
+
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_dir():
+                    if state["recursive"] and os.path.realpath(entry.path) != state["target_real"]:
+                        subdirs.append((entry.path, os.path.join(dest_dir, entry.name), rel_path))
+                    continue
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                result.failed += 1
+                continue
+
+            result.scanned += 1
+            seen.append(rel_path)
+            current = (st.st_size, st.st_mtime_ns, st.st_ino)
+            previous = manifest.get(rel_path)
+            dest = os.path.join(dest_dir, entry.name)
+            dest_exists = existing is not None and entry.name in existing
+
+            if previous == current and dest_exists:
+                result.unchanged += 1
+                continue
+
+            try:
+                if dest_exists:
+                    dest_st = os.stat(dest)
+                    if dest_st.st_ino == st.st_ino and dest_st.st_dev == st.st_dev:
+                        # 已经是指向源文件的硬链接
+                        result.unchanged += 1
+                    elif previous is not None:
+                        self._replace(entry.path, dest, state)
+                        result.updated += 1
+                    elif (dest_st.st_size, dest_st.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                        # 之前复制过的文件（copy2 保留了修改时间），纳入清单
+                        result.unchanged += 1
+                    else:
+                        # 目标位置是其他文件，不覆盖
+                        result.skipped += 1
+                        continue
+                else:
+                    if existing is None:
+                        os.makedirs(dest_dir, exist_ok=True)
+                        existing = set()
+                    self._link_or_copy(entry.path, dest, state)
+                    existing.add(entry.name)
+                    result.mapped += 1
+            except OSError as e:
+                logger.error(f"映射文件失败: {str(e)}, 源: {entry.path}, 目标: {dest}")
+                result.failed += 1
+                continue
+            records.append((rel_path, *current))
+
+        return subdirs, records, seen, result
+
+    def map_tree(self, source, target, recursive=True, progress=None, should_stop=None):
+        """
+        把源目录下的内容映射到目标目录
+
+        Args:
+            source: 源目录
+            target: 目标目录（存储目录下）
+            recursive: 是否包含子目录
+            progress: 每处理完一个目录调用 progress(当前统计)
+            should_stop: 返回 True 时不再扫描新的目录，已提交的目录处理完后返回
+
+        Returns:
+            MapResult
+        """
+        started = time.monotonic()
+        source = os.path.abspath(str(source))
+        target = os.path.abspath(str(target))
+        manifest = self._load_manifest(source, target)
+        state = {
+            "link": True,
+            "recursive": recursive,
+            # 目标目录位于源目录内时不要扫描到自己
+            "target_real": os.path.realpath(target),
+        }
+
+        total = MapResult()
+        seen = set()
+        pending_records = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bulk-map") as pool:
+            futures = {pool.submit(self._scan_directory, source, target, "", manifest, state)}
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                if not total.stopped and should_stop is not None and should_stop():
+                    total.stopped = True
+                    for future in futures:
+                        future.cancel()
+                for future in done:
+                    subdirs, records, seen_paths, result = future.result()
+                    if not total.stopped:
+                        for src_dir, dest_dir, rel_dir in subdirs:
+                            futures.add(pool.submit(self._scan_directory, src_dir, dest_dir, rel_dir, manifest, state))
+                    total.add(result)
+                    seen.update(seen_paths)
+                    pending_records.extend(records)
+                futures = {future for future in futures if not future.cancelled()}
+                if progress is not None:
+                    progress(total)
+                if len(pending_records) >= MANIFEST_BATCH_SIZE:
+                    self._save_entries(source, target, pending_records)
+                    pending_records = []
+        self._save_entries(source, target, pending_records)
+
+        # 源目录中已删除的文件从清单中移除（目标目录中的文件保留）
+        removed = manifest.keys() - seen
+        if removed and not total.stopped:
+            self._remove_entries(source, target, removed)
+
+        total.elapsed = round(time.monotonic() - started, 3)
+        logger.info(f"批量映射完成: {source} -> {target} {total.to_dict()}")
+        return total
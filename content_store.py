@@ -0,0 +1,368 @@
+import os
+import shutil
+import sqlite3
+import hashlib
+import threading
+import time
+import uuid
+import logging
+from pathlib import Path
+
+logger = logging.getLogger("content_store")
+
+# 内容寻址存储数据库路径（与 users.db 放在同一目录）
+BASE_DIR = os.environ.get("ZAY_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
+CONTENT_STORE_DB = os.path.join(BASE_DIR, "content_store.db")
+
+# 存储根目录下存放去重数据块的目录名（需与存储目录在同一文件系统，才能建立链接）
+CAS_DIR_NAME = ".cas"
+
+# 小于该大小的文件不参与去重，链接带来的元数据开销不值得
+MIN_DEDUP_SIZE = 64 * 1024
+
+# 计算哈希时每次读取的块大小
+HASH_READ_SIZE = 1024 * 1024
+
+# Linux FICLONE ioctl：在支持的文件系统（btrfs、xfs 等）上创建写时复制的副本
+FICLONE = 0x40049409
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def hash_file(path):
+    """流式计算文件的 SHA-256"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(HASH_READ_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def reflink_file(src, dst):
+    """
+    用 reflink 创建与 src 共享数据的新文件 dst（写时复制，各副本修改互不影响）
+
+    不使用硬链接：硬链接的副本共享同一个 inode，原地写入其中一个会同时改写全部副本。
+
+    Returns:
+        是否创建成功；文件系统不支持 reflink 时返回 False，且不会留下 dst
+    """
+    if fcntl is None:
+        return False
+    src, dst = str(src), str(dst)
+    dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        with open(src, "rb") as f:
+            fcntl.ioctl(dst_fd, FICLONE, f.fileno())
+        return True
+    except OSError:
+        os.close(dst_fd)
+        dst_fd = None
+        os.unlink(dst)
+        return False
+    finally:
+        if dst_fd is not None:
+            os.close(dst_fd)
+
+
+def _break_link(path):
+    """把与其他文件共享 inode 的文件替换为独立的副本（保留修改时间）"""
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.unlink")
+    try:
+        shutil.copy2(path, tmp)
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class ContentStore:
+    """
+    存储目录的内容寻址去重
+
+    入库的文件按 SHA-256 在 <存储目录>/.cas 下保留一份只读数据块，内容相同的文件
+    通过 reflink 共享同一份数据。只在支持 reflink 的文件系统（btrfs、xfs 等）上去重，
+    其他文件系统上文件保持原样；旧版本用硬链接去重的副本在垃圾回收时拆分为独立文件。
+    """
+
+    def __init__(self, root, db_path=CONTENT_STORE_DB, enabled=False):
+        self.root = Path(root).resolve()
+        self.cas_dir = self.root / CAS_DIR_NAME
+        self.db_path = db_path
+        self.enabled = enabled
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._blob_lock = threading.Lock()
+
+        self._init_schema()
+
+    # ---------------- 数据库 ----------------
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS refs (
+                    path TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    method TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_refs_digest ON refs (digest)")
+
+    # ---------------- 路径工具 ----------------
+
+    def blob_path(self, digest):
+        return self.cas_dir / digest[:2] / digest[2:4] / digest
+
+    def _relative(self, path):
+        try:
+            return Path(path).resolve().relative_to(self.root).as_posix()
+        except ValueError:
+            return None
+
+    def _record_ref(self, rel_path, digest, method, st):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO refs (path, digest, size, method, mtime_ns) VALUES (?, ?, ?, ?, ?)",
+                (rel_path, digest, st.st_size, method, st.st_mtime_ns)
+            )
+
+    def _blob_valid(self, digest, size):
+        """数据块存在、大小一致、未被原地修改，且没有与其他文件共享 inode"""
+        row = self._connect().execute(
+            "SELECT size, mtime_ns FROM blobs WHERE digest = ?", (digest,)
+        ).fetchone()
+        if row is None or row[0] != size:
+            return False
+        try:
+            st = self.blob_path(digest).stat()
+        except OSError:
+            return False
+        return st.st_size == size and st.st_mtime_ns == row[1] and st.st_nlink == 1
+
+    # ---------------- 入库 ----------------
+
+    def ingest(self, path, digest=None):
+        """
+        把存储目录中的文件加入去重存储
+
+        已有相同内容的数据块时，用数据块的 reflink 副本替换该文件；否则以该文件的 reflink
+        副本创建新的数据块。文件系统不支持 reflink 时不做任何处理。
+
+        Args:
+            path: 存储目录中的文件
+            digest: 已知的 SHA-256（例如上传时增量计算的结果），None 时读取文件计算
+
+        Returns:
+            {"digest", "method", "deduplicated"}；未启用、文件不参与去重或不支持 reflink 时返回 None
+        """
+        if not self.enabled:
+            return None
+        path = Path(path)
+        rel_path = self._relative(path)
+        if rel_path is None or rel_path.split("/", 1)[0] == CAS_DIR_NAME:
+            return None
+
+        st = path.stat()
+        if st.st_size < MIN_DEDUP_SIZE or not path.is_file():
+            return None
+        digest = digest or hash_file(path)
+        blob = self.blob_path(digest)
+
+        with self._blob_lock:
+            if self._blob_valid(digest, st.st_size):
+                # 先在同目录创建副本再原子替换，避免替换过程中文件短暂消失
+                tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.dedup")
+                if not reflink_file(blob, tmp):
+                    return None
+                try:
+                    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+                    os.replace(tmp, path)
+                except OSError:
+                    tmp.unlink(missing_ok=True)
+                    raise
+                method, deduplicated = "reflink", True
+            else:
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                tmp = blob.with_name(f"{digest}.{uuid.uuid4().hex[:8]}.tmp")
+                if not reflink_file(path, tmp):
+                    return None
+                os.chmod(tmp, 0o444)
+                os.replace(tmp, blob)
+                blob_st = blob.stat()
+                conn = self._connect()
+                with self._write_lock, conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO blobs (digest, size, mtime_ns, created) VALUES (?, ?, ?, ?)",
+                        (digest, blob_st.st_size, blob_st.st_mtime_ns, time.time())
+                    )
+                method, deduplicated = "origin", False
+
+        self._record_ref(rel_path, digest, method, path.stat())
+        if deduplicated:
+            logger.info(f"去重: {rel_path} -> {digest} ({method}), 节省 {st.st_size} 字节")
+        return {"digest": digest, "method": method, "deduplicated": deduplicated}
+
+    def link_existing(self, digest, size, target):
+        """
+        已存在相同内容的数据块时，直接在 target 创建指向它的文件（秒传）
+
+        Returns:
+            是否创建成功
+        """
+        if not self.enabled or size < MIN_DEDUP_SIZE:
+            return False
+        rel_path = self._relative(target)
+        if rel_path is None:
+            return False
+        target = Path(target)
+        with self._blob_lock:
+            if not self._blob_valid(digest, size):
+                return False
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if not reflink_file(self.blob_path(digest), target):
+                return False
+        self._record_ref(rel_path, digest, "reflink", target.stat())
+        logger.info(f"秒传: {rel_path} -> {digest}")
+        return True
+
+    def forget(self, path):
+        """文件或目录被删除后移除对应的引用记录，数据块由垃圾回收清理"""
+        rel_path = self._relative(path)
+        if not rel_path:
+            return
+        escaped = rel_path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute(
+                "DELETE FROM refs WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                (rel_path, escaped + "/%")
+            )
+
+    # ---------------- 维护与统计 ----------------
+
+    def collect_garbage(self):
+        """
+        清理失效的引用和不再被引用的数据块
+
+        引用对应的文件已删除或已被修改时移除该引用；数据块被原地修改或仍与其他文件共享
+        inode 时整块丢弃，避免之后的文件链接到错误的内容。
+
+        Returns:
+            删除的数据块数量
+        """
+        conn = self._connect()
+        self._break_legacy_links(conn)
+        stale_refs = []
+        for rel_path, size, mtime_ns in conn.execute("SELECT path, size, mtime_ns FROM refs").fetchall():
+            try:
+                st = (self.root / rel_path).stat()
+            except OSError:
+                stale_refs.append(rel_path)
+                continue
+            if st.st_size != size or st.st_mtime_ns != mtime_ns:
+                stale_refs.append(rel_path)
+
+        removed = 0
+        with self._blob_lock:
+            if stale_refs:
+                with self._write_lock, conn:
+                    conn.executemany("DELETE FROM refs WHERE path = ?", [(p,) for p in stale_refs])
+
+            for digest, size in conn.execute("SELECT digest, size FROM blobs").fetchall():
+                referenced = conn.execute("SELECT 1 FROM refs WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+                if referenced and self._blob_valid(digest, size):
+                    continue
+                try:
+                    self.blob_path(digest).unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"删除数据块失败: {digest} - {str(e)}")
+                    continue
+                with self._write_lock, conn:
+                    conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                    conn.execute("DELETE FROM refs WHERE digest = ?", (digest,))
+                removed += 1
+
+        if removed or stale_refs:
+            logger.info(f"去重存储清理: 移除 {len(stale_refs)} 个失效引用, {removed} 个数据块")
+        return removed
+
+    def _break_legacy_links(self, conn):
+        """旧版本用硬链接去重的文件拆分为独立副本，之后写入其中一个不会再影响其他副本"""
+        for (rel_path,) in conn.execute("SELECT path FROM refs WHERE method = 'hardlink'").fetchall():
+            path = self.root / rel_path
+            try:
+                if path.stat().st_nlink > 1:
+                    _break_link(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"拆分硬链接失败: {rel_path} - {str(e)}")
+                continue
+            with self._write_lock, conn:
+                conn.execute("DELETE FROM refs WHERE path = ?", (rel_path,))
+
+    def report(self, top=20):
+        """去重统计：逻辑大小、实际占用和节省的空间，以及副本最多的内容"""
+        conn = self._connect()
+        blobs, physical = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        refs, logical = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM refs").fetchone()
+        by_method = {
+            method: count
+            for method, count in conn.execute("SELECT method, COUNT(*) FROM refs GROUP BY method")
+        }
+        duplicates = []
+        for digest, size, count in conn.execute(
+            "SELECT digest, size, COUNT(*) AS copies FROM refs GROUP BY digest "
+            "HAVING copies > 1 ORDER BY size * (copies - 1) DESC LIMIT ?", (top,)
+        ).fetchall():
+            paths = [row[0] for row in conn.execute(
+                "SELECT path FROM refs WHERE digest = ? ORDER BY path LIMIT 10", (digest,)
+            )]
+            duplicates.append({
+                "digest": digest,
+                "size": size,
+                "copies": count,
+                "saved_bytes": size * (count - 1),
+                "paths": paths,
+            })
+        return {
+            "enabled": self.enabled,
+            "blobs": blobs,
+            "references": refs,
+            "logical_bytes": logical,
+            "physical_bytes": physical,
+            "saved_bytes": max(logical - physical, 0),
+            "by_method": by_method,
+            "top_duplicates": duplicates,
+        }
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import socket
+import secrets
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger("coordination")
+
+# 协调数据库路径（与 users.db 放在同一目录）
+BASE_DIR = os.environ.get("ZAY_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
+COORDINATION_DB = os.path.join(BASE_DIR, "coordination.db")
+
+# 主进程租约有效期（秒），每 1/3 周期续约一次
+LEASE_TTL = 15
+
+LEADER_LEASE = "leader"
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class Coordinator:
+    """
+    多工作进程之间的协调器
+
+    使用 --workers N 启动时，各进程通过同一个 SQLite（WAL）数据库竞争主进程租约：
+    只有主进程运行 WebDAV 服务器、目录监听和定期清理等单例任务，
+    主进程退出或失去响应后，其他进程在租约过期时接管。
+    数据库同时提供一个小型键值存储，用于在进程之间共享状态和通知。
+    """
+
+    def __init__(self, db_path=COORDINATION_DB, lease_ttl=LEASE_TTL):
+        self.db_path = db_path
+        self.lease_ttl = lease_ttl
+        self.hostname = socket.gethostname()
+        self.worker_id = f"{self.hostname}:{os.getpid()}:{secrets.token_hex(4)}"
+
+        self._local = threading.local()
+        self._leader = False
+        self._on_elected = []
+        self._on_demoted = []
+        self._watches = {}  # key -> [上次看到的更新时间, 回调]
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self._init_schema()
+
+    # ---------------- 数据库 ----------------
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    # ---------------- 租约 ----------------
+
+    def _owner_gone(self, owner):
+        """同一台机器上的持有者进程已经退出（例如被强制结束），无需等待租约过期"""
+        host, _, rest = owner.partition(":")
+        pid = rest.partition(":")[0]
+        return host == self.hostname and pid.isdigit() and not process_alive(int(pid))
+
+    def try_acquire(self, name=LEADER_LEASE):
+        """
+        获取或续约租约
+
+        Returns:
+            当前进程是否持有该租约
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is None or row[0] == self.worker_id or row[1] < now or self._owner_gone(row[0]):
+                conn.execute(
+                    "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                    (name, self.worker_id, now + self.lease_ttl)
+                )
+                acquired = True
+            else:
+                acquired = False
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return acquired
+
+    def release(self, name=LEADER_LEASE):
+        self._connect().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.worker_id))
+
+    @property
+    def is_leader(self):
+        return self._leader
+
+    def on_elected(self, callback):
+        """注册成为主进程时的回调（在协调线程中调用）"""
+        self._on_elected.append(callback)
+
+    def on_demoted(self, callback):
+        """注册失去主进程身份时的回调"""
+        self._on_demoted.append(callback)
+
+    def _set_leader(self, leader):
+        if leader == self._leader:
+            return
+        self._leader = leader
+        if leader:
+            logger.info(f"当前进程成为主进程: {self.worker_id}")
+        else:
+            logger.warning(f"当前进程不再是主进程: {self.worker_id}")
+        for callback in (self._on_elected if leader else self._on_demoted):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"主进程切换回调失败: {str(e)}")
+
+    # ---------------- 共享状态 ----------------
+
+    def set_state(self, key, value):
+        updated_at = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO state (key, value, updated_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), updated_at)
+        )
+        # 本进程写入的变化不需要再通知自己
+        watch = self._watches.get(key)
+        if watch is not None:
+            watch[0] = updated_at
+
+    def update_state(self, key, update, default=None):
+        """
+        在一个事务中读取、修改并写回共享状态，多个进程同时修改同一个键时不会丢失更新
+
+        Args:
+            update: 接收当前值（不存在时为 default）并返回新值的函数
+
+        Returns:
+            新值
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+            value = update(json.loads(row[0]) if row and row[0] is not None else default)
+            updated_at = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), updated_at)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        watch = self._watches.get(key)
+        if watch is not None:
+            watch[0] = updated_at
+        return value
+
+    def get_state(self, key, default=None):
+        row = self._connect().execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else default
+
+    def notify(self, key):
+        """通知其他进程（watch 了该键的回调会在下一次心跳时执行）"""
+        self.set_state(key, time.time())
+
+    def watch(self, key, callback):
+        """键被其他进程更新后调用 callback()"""
+        row = self._connect().execute("SELECT updated_at FROM state WHERE key = ?", (key,)).fetchone()
+        self._watches[key] = [row[0] if row else 0, callback]
+
+    def _check_watches(self):
+        if not self._watches:
+            return
+        conn = self._connect()
+        for key, watch in self._watches.items():
+            row = conn.execute("SELECT updated_at FROM state WHERE key = ?", (key,)).fetchone()
+            updated_at = row[0] if row else 0
+            if updated_at != watch[0]:
+                watch[0] = updated_at
+                try:
+                    watch[1]()
+                except Exception as e:
+                    logger.error(f"处理共享状态变化失败: {key} - {str(e)}")
+
+    # ---------------- 后台线程 ----------------
+
+    def _heartbeat(self):
+        while not self._stop_event.wait(self.lease_ttl / 3):
+            try:
+                self._set_leader(self.try_acquire())
+                self._check_watches()
+            except Exception as e:
+                logger.error(f"主进程租约续约失败: {str(e)}")
+                self._set_leader(False)
+
+    def start(self):
+        """立即参与一次选举，然后在后台定期续约"""
+        self._stop_event.clear()
+        try:
+            self._set_leader(self.try_acquire())
+        except Exception as e:
+            logger.error(f"主进程选举失败: {str(e)}")
+        self._thread = threading.Thread(target=self._heartbeat, name="coordinator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._leader:
+            self._set_leader(False)
+            try:
+                self.release()
+            except Exception as e:
+                logger.error(f"释放主进程租约失败: {str(e)}")
@@ -0,0 +1,94 @@
+import time
+import asyncio
+import threading
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("credentials")
+
+# 密码哈希线程数（bcrypt 计算时释放 GIL，少量线程即可，避免占满 CPU 影响媒体传输）
+HASH_WORKERS = 2
+# 排队中的哈希任务上限，超出后直接拒绝请求
+HASH_MAX_PENDING = 32
+
+# 每个 IP 在时间窗口内允许的登录/注册尝试次数
+LOGIN_MAX_ATTEMPTS = 10
+LOGIN_WINDOW_SECONDS = 60
+# 记录的 IP 数量上限
+THROTTLE_MAX_KEYS = 10000
+
+
+class HasherBusy(Exception):
+    """密码哈希队列已满"""
+
+
+class CredentialHasher:
+    """
+    在专用线程池中执行密码哈希和校验
+
+    bcrypt 每次计算需要数百毫秒，直接在 async 接口中调用会阻塞事件循环，
+    使同一进程中的视频流和上传全部停顿。线程池大小和排队数量都有上限，
+    登录请求过多时快速失败，而不是无限排队。
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="credential-hash")
+        self._pending = 0  # 只在事件循环中修改
+
+    async def run(self, func, *args):
+        """
+        在哈希线程池中执行函数
+
+        Raises:
+            HasherBusy: 排队任务已达上限
+        """
+        if self._pending >= self.max_pending:
+            raise HasherBusy()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LoginThrottle:
+    """按 IP 限制登录/注册尝试次数（滑动时间窗口）"""
+
+    def __init__(self, max_attempts=LOGIN_MAX_ATTEMPTS, window=LOGIN_WINDOW_SECONDS, max_keys=THROTTLE_MAX_KEYS):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        self._attempts = OrderedDict()  # key -> deque[时间戳]
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """
+        记录一次尝试
+
+        Returns:
+            0 表示允许；否则为需要等待的秒数
+        """
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is None:
+                attempts = self._attempts[key] = deque()
+            self._attempts.move_to_end(key)
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) >= self.max_attempts:
+                return max(1, int(attempts[0] + self.window - now) + 1)
+            attempts.append(now)
+            while len(self._attempts) > self.max_keys:
+                self._attempts.popitem(last=False)
+            return 0
+
+    def reset(self, key):
+        """登录成功后清除该 IP 的失败记录"""
+        with self._lock:
+            self._attempts.pop(key, None)
@@ -5,8 +5,9 @@ from sqlalchemy.orm import declarative_base, sessionmaker
 import datetime
 import os
 
-# 创建 SQLite 数据库文件路径
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 创建 SQLite 数据库文件路径（默认在程序目录，可用 ZAY_DATA_DIR 环境变量指定其他目录，
+# 其他模块的数据库也放在同一目录）
+BASE_DIR = os.environ.get("ZAY_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, 'users.db')}"
 
 # 创建引擎
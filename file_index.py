@@ -0,0 +1,631 @@
+import os
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+
+logger = logging.getLogger("file_index")
+
+# 文件索引数据库路径（与 users.db 放在同一目录）
+BASE_DIR = os.environ.get("ZAY_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
+FILE_INDEX_DB = os.path.join(BASE_DIR, "file_index.db")
+
+# watchdog 为可选依赖，未安装时仅依靠定期全量校对保持索引新鲜
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+# 列表分页支持的排序字段
+SORT_COLUMNS = {
+    "name": "name",
+    "size": "size",
+    "mtime": "mtime",
+}
+
+# 搜索时每种候选来源最多参与排序的记录数
+SEARCH_CANDIDATES = 5000
+
+
+def _escape_like(value):
+    """转义 LIKE 语句中的通配符"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _parent_of(rel_path):
+    return rel_path.rsplit("/", 1)[0] if "/" in rel_path else ""
+
+
+class _IndexEventHandler(FileSystemEventHandler):
+    """
+    把文件系统事件转换为索引的待刷新路径
+
+    只有新建或移入的目录需要递归扫描；目录的修改事件（其中有文件增删时产生）只重新扫描
+    该目录的直接子项，避免每增加一个文件都遍历整个子树。读取文件产生的打开/关闭事件直接忽略。
+    """
+
+    IGNORED_EVENTS = {"opened", "closed", "closed_no_write"}
+
+    def __init__(self, index):
+        self.index = index
+
+    def on_any_event(self, event):
+        if event.event_type in self.IGNORED_EVENTS:
+            return
+        if event.src_path:
+            self.index.mark_dirty(event.src_path, recursive=event.is_directory and event.event_type == "created")
+        dest_path = getattr(event, "dest_path", None)
+        if dest_path:
+            self.index.mark_dirty(dest_path, recursive=event.is_directory)
+
+
+class FileIndex:
+    """
+    存储目录的持久化元数据索引（路径、大小、修改时间、媒体类型）
+
+    索引保存在 SQLite 中，由文件系统监听器（watchdog）实时更新，
+    并通过定期全量校对兜底，保证列表接口无需再递归遍历磁盘。
+    """
+
+    def __init__(self, root, db_path=FILE_INDEX_DB, media_type_func=None,
+                 reconcile_interval=600, flush_interval=1.0, exclude=()):
+        self.root = Path(root).resolve()
+        # 不纳入索引的顶层目录名（例如去重存储目录）
+        self.exclude = set(exclude)
+        self.db_path = db_path
+        self.media_type_func = media_type_func or (lambda name: "other")
+        self.reconcile_interval = reconcile_interval
+        self.flush_interval = flush_interval
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._pending = {}  # 路径 -> 是否需要递归扫描
+        self._pending_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._watch_stop = threading.Event()
+        self._ready = threading.Event()
+        self._threads = []
+        self._observer = None
+        self._reconcile_thread = None
+
+        self._init_schema()
+
+    # ---------------- 数据库 ----------------
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    path TEXT PRIMARY KEY,
+                    parent TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    is_dir INTEGER NOT NULL,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    mtime REAL NOT NULL DEFAULT 0,
+                    media_type TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_parent ON entries (parent, is_dir, name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_name ON entries (name COLLATE NOCASE)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._fts = self._init_search(conn)
+
+            # 存储根目录变化时，旧索引全部作废
+            row = conn.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()
+            if row is None or row[0] != str(self.root):
+                conn.execute("DELETE FROM entries")
+                conn.execute("DELETE FROM meta")
+                conn.execute("INSERT INTO meta (key, value) VALUES ('root', ?)", (str(self.root),))
+
+            # 之前完成过全量扫描的索引在重启后可直接使用
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'last_full_scan'").fetchone():
+                self._ready.set()
+
+    def _init_search(self, conn):
+        """
+        创建名称/路径的三元组全文索引，由触发器随 entries 表同步更新
+
+        Returns:
+            SQLite 是否支持 FTS5 trigram（3.34+），不支持时搜索退回 LIKE 查询
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries_fts'"
+        ).fetchone()
+        if not exists:
+            try:
+                conn.execute(
+                    "CREATE VIRTUAL TABLE entries_fts USING fts5("
+                    "name, path, content='entries', content_rowid='rowid', tokenize='trigram')"
+                )
+            except sqlite3.OperationalError as e:
+                logger.warning(f"SQLite 不支持 FTS5 trigram，文件搜索将使用 LIKE 查询: {str(e)}")
+                return False
+            # 已有索引数据时一次性建立全文索引
+            conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('rebuild')")
+
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS entries_fts_insert AFTER INSERT ON entries BEGIN
+                INSERT INTO entries_fts (rowid, name, path) VALUES (new.rowid, new.name, new.path);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS entries_fts_delete AFTER DELETE ON entries BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, name, path) VALUES ('delete', old.rowid, old.name, old.path);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS entries_fts_update AFTER UPDATE OF name, path ON entries BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, name, path) VALUES ('delete', old.rowid, old.name, old.path);
+                INSERT INTO entries_fts (rowid, name, path) VALUES (new.rowid, new.name, new.path);
+            END
+        """)
+        return True
+
+    def is_ready(self):
+        """索引是否已完成过至少一次全量扫描（可能由其他进程完成）"""
+        if not self._ready.is_set():
+            if self._connect().execute("SELECT 1 FROM meta WHERE key = 'last_full_scan'").fetchone():
+                self._ready.set()
+        return self._ready.is_set()
+
+    # ---------------- 路径工具 ----------------
+
+    def to_relative(self, path):
+        """将绝对路径或存储相对路径转换为索引使用的 '/' 分隔相对路径"""
+        path = Path(path)
+        if path.is_absolute():
+            try:
+                path = path.resolve().relative_to(self.root)
+            except ValueError:
+                return None
+        else:
+            try:
+                path = (Path.cwd() / path).resolve().relative_to(self.root)
+            except ValueError:
+                return None
+        rel = path.as_posix()
+        return "" if rel == "." else rel
+
+    def is_excluded(self, rel_path):
+        return bool(rel_path) and rel_path.split("/", 1)[0] in self.exclude
+
+    def _row_for(self, rel_path, st, is_dir):
+        name = rel_path.rsplit("/", 1)[-1]
+        return (
+            rel_path,
+            _parent_of(rel_path),
+            name,
+            1 if is_dir else 0,
+            0 if is_dir else st.st_size,
+            st.st_mtime,
+            None if is_dir else self.media_type_func(name),
+        )
+
+    def _upsert_rows(self, conn, rows):
+        conn.executemany("""
+            INSERT INTO entries (path, parent, name, is_dir, size, mtime, media_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                is_dir = excluded.is_dir,
+                size = excluded.size,
+                mtime = excluded.mtime,
+                media_type = excluded.media_type
+        """, rows)
+
+    def _delete_subtree(self, conn, rel_path):
+        if rel_path == "":
+            conn.execute("DELETE FROM entries")
+            return
+        conn.execute(
+            "DELETE FROM entries WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+            (rel_path, _escape_like(rel_path) + "/%")
+        )
+
+    # ---------------- 扫描与增量更新 ----------------
+
+    def scan_directory(self, rel_path="", recursive=True):
+        """
+        扫描目录并把差异写入索引
+
+        Args:
+            rel_path: 相对存储根目录的路径
+            recursive: 是否递归扫描子目录
+
+        Returns:
+            扫描的目录数量
+        """
+        conn = self._connect()
+        pending_dirs = [rel_path]
+        scanned = 0
+
+        while pending_dirs and not self._stop_event.is_set():
+            current = pending_dirs.pop()
+            abs_dir = self.root / current if current else self.root
+
+            try:
+                with os.scandir(abs_dir) as it:
+                    disk_entries = {}
+                    for entry in it:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                            disk_entries[entry.name] = (is_dir, entry.stat(follow_symlinks=False))
+                        except OSError:
+                            continue
+            except (FileNotFoundError, NotADirectoryError):
+                with self._write_lock, conn:
+                    self._delete_subtree(conn, current)
+                continue
+            except OSError as e:
+                logger.warning(f"扫描目录失败: {abs_dir} - {str(e)}")
+                continue
+
+            scanned += 1
+            indexed = {
+                row[0]: row[1:]
+                for row in conn.execute(
+                    "SELECT name, is_dir, size, mtime FROM entries WHERE parent = ?", (current,)
+                )
+            }
+
+            changed_rows = []
+            for name, (is_dir, st) in disk_entries.items():
+                child_rel = f"{current}/{name}" if current else name
+                if self.is_excluded(child_rel):
+                    continue
+                row = self._row_for(child_rel, st, is_dir)
+                old = indexed.get(name)
+                if old is None or tuple(old) != (row[3], row[4], row[5]):
+                    changed_rows.append(row)
+                # 新出现的目录（例如整个移入的目录）即使不递归也要扫描其内容
+                if is_dir and (recursive or old is None):
+                    pending_dirs.append(child_rel)
+
+            removed = [
+                name for name in indexed
+                if name not in disk_entries or self.is_excluded(f"{current}/{name}" if current else name)
+            ]
+
+            if changed_rows or removed:
+                with self._write_lock, conn:
+                    for name in removed:
+                        self._delete_subtree(conn, f"{current}/{name}" if current else name)
+                    self._upsert_rows(conn, changed_rows)
+
+        return scanned
+
+    def reconcile(self):
+        """全量校对：以磁盘为准修正整个索引"""
+        started = time.time()
+        scanned = self.scan_directory("", recursive=True)
+        if self._stop_event.is_set():
+            return
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_full_scan', ?)",
+                (str(time.time()),)
+            )
+        self._ready.set()
+        logger.info(f"文件索引校对完成: {scanned} 个目录, 耗时 {time.time() - started:.2f} 秒")
+
+    def update_path(self, path, recursive=True):
+        """
+        根据磁盘当前状态刷新单个路径（文件或目录）
+
+        Args:
+            recursive: 路径是目录时是否递归扫描整个子树，False 时只扫描直接子项
+        """
+        rel_path = self.to_relative(path)
+        if rel_path is None or self.is_excluded(rel_path):
+            return
+        if rel_path == "":
+            self.scan_directory("", recursive=False)
+            return
+
+        abs_path = self.root / rel_path
+        try:
+            st = abs_path.lstat()
+        except FileNotFoundError:
+            self.remove_path(abs_path)
+            return
+        except OSError:
+            return
+
+        is_dir = abs_path.is_dir() and not abs_path.is_symlink()
+        rows = [self._row_for(rel_path, st, is_dir)]
+
+        # 确保所有上级目录都在索引中
+        parent = _parent_of(rel_path)
+        while parent:
+            try:
+                rows.append(self._row_for(parent, (self.root / parent).stat(), True))
+            except OSError:
+                break
+            parent = _parent_of(parent)
+
+        conn = self._connect()
+        with self._write_lock, conn:
+            self._upsert_rows(conn, rows)
+
+        if is_dir:
+            self.scan_directory(rel_path, recursive=recursive)
+
+    def remove_path(self, path):
+        """从索引中移除路径及其所有子项"""
+        rel_path = self.to_relative(path)
+        if not rel_path:
+            return
+        conn = self._connect()
+        with self._write_lock, conn:
+            self._delete_subtree(conn, rel_path)
+
+    def mark_dirty(self, path, recursive=False):
+        """记录待刷新的路径，由后台线程合并后批量处理"""
+        path = str(path)
+        with self._pending_lock:
+            self._pending[path] = self._pending.get(path, False) or recursive
+
+    def _flush_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for path in sorted(pending):
+            try:
+                self.update_path(path, recursive=pending[path])
+            except Exception as e:
+                logger.error(f"刷新索引路径失败: {path} - {str(e)}")
+
+    # ---------------- 查询 ----------------
+
+    def list_children(self, rel_path=""):
+        """列出目录的直接子项"""
+        conn = self._connect()
+        cursor = conn.execute(
+            "SELECT path, name, is_dir, size, mtime, media_type FROM entries "
+            "WHERE parent = ? ORDER BY is_dir DESC, name",
+            (rel_path,)
+        )
+        return cursor.fetchall()
+
+    def list_page(self, rel_path="", sort="name", order="asc", media_type=None,
+                  limit=500, after=None):
+        """
+        分页列出目录的直接子项（文件夹始终排在文件前面）
+
+        Args:
+            rel_path: 目录相对路径
+            sort: 排序字段 name/size/mtime
+            order: asc 或 desc
+            media_type: 只返回指定媒体类型的文件，"folder" 表示只返回文件夹
+            limit: 每页数量
+            after: 上一页最后一项的 (is_dir, 排序值, path)，用于游标分页
+
+        Returns:
+            (记录列表, 符合条件的总数)
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        column = SORT_COLUMNS[sort]
+        direction = "DESC" if order == "desc" else "ASC"
+        compare = "<" if order == "desc" else ">"
+
+        where = ["parent = ?"]
+        params = [rel_path]
+        if media_type == "folder":
+            where.append("is_dir = 1")
+        elif media_type:
+            where.append("is_dir = 0 AND media_type = ?")
+            params.append(media_type)
+
+        conn = self._connect()
+        total = conn.execute(
+            f"SELECT COUNT(*) FROM entries WHERE {' AND '.join(where)}", params
+        ).fetchone()[0]
+
+        if after is not None:
+            is_dir, key, path = after
+            where.append(f"(is_dir < ? OR (is_dir = ? AND ({column}, path) {compare} (?, ?)))")
+            params.extend([is_dir, is_dir, key, path])
+
+        cursor = conn.execute(
+            f"SELECT path, name, is_dir, size, mtime, media_type FROM entries "
+            f"WHERE {' AND '.join(where)} "
+            f"ORDER BY is_dir DESC, {column} {direction}, path {direction} LIMIT ?",
+            params + [limit]
+        )
+        return cursor.fetchall(), total
+
+    def search(self, query, media_type=None, min_size=None, max_size=None,
+               modified_after=None, modified_before=None, path_prefix=None, limit=50, offset=0):
+        """
+        按名称和路径搜索整个存储目录
+
+        查询按空白拆分为多个关键词，全部命中才返回（不区分大小写的子串匹配；
+        查询只包含 3 个字符以下的短关键词时，第一个关键词按名称前缀匹配）。
+        结果排序：名称完全相同 > 名称前缀匹配 > 名称包含关键词 > 仅路径包含关键词，
+        同级按名称长度排序。为保证常见关键词也能快速返回，每种候选来源最多取
+        SEARCH_CANDIDATES 条参与排序。
+
+        Args:
+            query: 搜索关键词
+            media_type: 只返回指定媒体类型的文件，"folder" 表示只返回文件夹
+            min_size / max_size: 文件大小范围（字节）
+            modified_after / modified_before: 修改时间范围（时间戳）
+            path_prefix: 只在该目录下搜索
+            limit / offset: 分页
+
+        Returns:
+            记录列表 (path, name, is_dir, size, mtime, media_type)
+        """
+        terms = [t for t in query.split() if t]
+        if not terms:
+            return []
+
+        filters, filter_params = [], []
+        if media_type == "folder":
+            filters.append("e.is_dir = 1")
+        elif media_type:
+            filters.append("e.is_dir = 0 AND e.media_type = ?")
+            filter_params.append(media_type)
+        if min_size is not None:
+            filters.append("e.is_dir = 0 AND e.size >= ?")
+            filter_params.append(min_size)
+        if max_size is not None:
+            filters.append("e.is_dir = 0 AND e.size <= ?")
+            filter_params.append(max_size)
+        if modified_after is not None:
+            filters.append("e.mtime >= ?")
+            filter_params.append(modified_after)
+        if modified_before is not None:
+            filters.append("e.mtime <= ?")
+            filter_params.append(modified_before)
+        if path_prefix:
+            filters.append("e.path LIKE ? ESCAPE '\\'")
+            filter_params.append(_escape_like(path_prefix) + "/%")
+
+        def contains(term_list):
+            conditions, params = [], []
+            for term in term_list:
+                pattern = "%" + _escape_like(term) + "%"
+                conditions.append("(e.name LIKE ? ESCAPE '\\' OR e.path LIKE ? ESCAPE '\\')")
+                params.extend([pattern, pattern])
+            return conditions, params
+
+        first = terms[0]
+        # 三元组索引只能匹配 3 个字符以上的关键词
+        long_terms = [t for t in terms if len(t) >= 3]
+
+        # 候选一：名称以第一个关键词开头（走名称索引），其余关键词用 LIKE 过滤
+        conditions, params = contains(terms[1:])
+        candidates = [(
+            "SELECT e.rowid FROM entries e WHERE e.name LIKE ? ESCAPE '\\' "
+            + "".join(" AND " + c for c in conditions + filters) + " LIMIT ?",
+            [_escape_like(first) + "%"] + params + filter_params + [SEARCH_CANDIDATES]
+        )]
+
+        # 候选二：名称或路径包含全部关键词
+        if long_terms and self._fts:
+            match = " AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms)
+            conditions, params = contains([t for t in terms if t not in long_terms])
+            candidates.append((
+                "SELECT e.rowid FROM entries_fts f JOIN entries e ON e.rowid = f.rowid "
+                "WHERE entries_fts MATCH ?" + "".join(" AND " + c for c in conditions + filters) + " LIMIT ?",
+                [match] + params + filter_params + [SEARCH_CANDIDATES]
+            ))
+        elif long_terms:
+            conditions, params = contains(terms)
+            candidates.append((
+                "SELECT e.rowid FROM entries e WHERE " + " AND ".join(conditions + filters) + " LIMIT ?",
+                params + filter_params + [SEARCH_CANDIDATES]
+            ))
+
+        sql = (
+            "SELECT path, name, is_dir, size, mtime, media_type FROM entries WHERE rowid IN ("
+            + " UNION ".join(f"SELECT rowid FROM ({c})" for c, _ in candidates)
+            + ") ORDER BY (name = ? COLLATE NOCASE) DESC, (name LIKE ? ESCAPE '\\') DESC, "
+            "(name LIKE ? ESCAPE '\\') DESC, length(name), path LIMIT ? OFFSET ?"
+        )
+        params = [p for _, c_params in candidates for p in c_params]
+        params += [first, _escape_like(first) + "%", "%" + _escape_like(first) + "%", limit, offset]
+        return self._connect().execute(sql, params).fetchall()
+
+    def list_subtree(self, rel_path=""):
+        """列出目录下的所有子孙项（按路径排序）"""
+        conn = self._connect()
+        if rel_path == "":
+            cursor = conn.execute(
+                "SELECT path, name, is_dir, size, mtime, media_type FROM entries ORDER BY path"
+            )
+        else:
+            cursor = conn.execute(
+                "SELECT path, name, is_dir, size, mtime, media_type FROM entries "
+                "WHERE path LIKE ? ESCAPE '\\' ORDER BY path",
+                (_escape_like(rel_path) + "/%",)
+            )
+        return cursor.fetchall()
+
+    # ---------------- 后台服务 ----------------
+
+    def start(self, watch=True):
+        """
+        启动增量刷新线程
+
+        Args:
+            watch: 同时启动监听器和定期校对（多进程部署时只在主进程中启动，见 start_watching）
+        """
+        self._stop_event.clear()
+
+        def flush_worker():
+            while not self._stop_event.wait(self.flush_interval):
+                self._flush_pending()
+
+        thread = threading.Thread(target=flush_worker, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        if watch:
+            self.start_watching()
+
+    def start_watching(self):
+        """启动文件系统监听器和定期全量校对"""
+        if self._reconcile_thread is not None:
+            return
+        # 每次启动使用新的停止事件，避免与尚未退出的上一个校对线程混淆
+        stop_event = self._watch_stop = threading.Event()
+
+        if Observer is not None:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_IndexEventHandler(self), str(self.root), recursive=True)
+                self._observer.daemon = True
+                self._observer.start()
+                logger.info("文件索引监听器已启动")
+            except Exception as e:
+                logger.warning(f"文件索引监听器启动失败，仅使用定期校对: {str(e)}")
+                self._observer = None
+        else:
+            logger.info("未安装 watchdog，文件索引仅使用定期校对")
+
+        def reconcile_worker():
+            while not stop_event.is_set() and not self._stop_event.is_set():
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    logger.error(f"文件索引校对失败: {str(e)}")
+                if stop_event.wait(self.reconcile_interval):
+                    break
+
+        self._reconcile_thread = threading.Thread(target=reconcile_worker, daemon=True)
+        self._reconcile_thread.start()
+
+    def stop_watching(self):
+        """停止监听器和定期校对（增量刷新继续运行）"""
+        self._watch_stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+        self._reconcile_thread = None
+
+    def stop(self):
+        """停止所有后台线程"""
+        self._stop_event.set()
+        reconcile_thread = self._reconcile_thread
+        self.stop_watching()
+        if reconcile_thread is not None:
+            reconcile_thread.join(timeout=5)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
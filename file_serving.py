@@ -0,0 +1,462 @@
+import os
+import stat
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
+from urllib.parse import quote
+
+import anyio
+from starlette.responses import Response
+
+logger = logging.getLogger("file_serving")
+
+# 回退路径（线程池读取）每次读取的块大小
+READ_CHUNK_SIZE = 1024 * 1024
+
+# 合并后仍超过该数量的多区间请求将被忽略，直接返回整个文件
+MAX_RANGES = 32
+
+# 文件元数据缓存的条目上限
+STAT_CACHE_SIZE = 4096
+
+
+class RangeNotSatisfiable(Exception):
+    """Range 请求中没有任何可满足的区间"""
+
+    def __init__(self, file_size):
+        super().__init__(f"bytes */{file_size}")
+        self.file_size = file_size
+
+
+def content_disposition(filename, disposition="attachment"):
+    """生成 Content-Disposition 头，非 ASCII 文件名使用 RFC 5987 编码"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+
+def make_etag(stat_result):
+    """根据 inode、大小和修改时间生成强 ETag"""
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def parse_range_header(range_header, file_size):
+    """
+    按 RFC 7233 解析 Range 请求头
+
+    支持 bytes=a-b、bytes=a-、bytes=-n（后缀区间）以及逗号分隔的多区间，
+    重叠或相邻的区间会被合并。
+
+    Args:
+        range_header: Range 请求头的值
+        file_size: 文件大小
+
+    Returns:
+        [(start, end), ...] 闭区间列表；请求头无效或应忽略时返回 None
+
+    Raises:
+        RangeNotSatisfiable: 语法正确但没有任何区间可满足
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start_str, sep, end_str = part.partition("-")
+        start_str, end_str = start_str.strip(), end_str.strip()
+        if not sep or not (start_str or end_str):
+            return None
+        if (start_str and not start_str.isdigit()) or (end_str and not end_str.isdigit()):
+            return None
+
+        if not start_str:
+            # 后缀区间：最后 n 个字节
+            suffix = int(end_str)
+            if suffix == 0 or file_size == 0:
+                continue
+            ranges.append((max(file_size - suffix, 0), file_size - 1))
+            continue
+
+        start = int(start_str)
+        if end_str and int(end_str) < start:
+            return None
+        end = int(end_str) if end_str else file_size - 1
+        if start >= file_size:
+            continue
+        ranges.append((start, min(end, file_size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable(file_size)
+
+    # 合并重叠或相邻的区间
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def if_range_matches(if_range, etag, last_modified):
+    """
+    判断 If-Range 条件是否成立
+
+    Args:
+        if_range: If-Range 请求头的值（ETag 或 HTTP 日期）
+        etag: 当前资源的强 ETag
+        last_modified: 当前资源的修改时间戳（秒）
+    """
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # 只有强 ETag 才能用于 If-Range
+        return not if_range.startswith("W/") and etag is not None and if_range == etag
+    try:
+        return int(parsedate_to_datetime(if_range).timestamp()) == int(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+
+def etag_matches(header, etag):
+    """If-None-Match 比较（弱比较：忽略 W/ 前缀，支持逗号分隔的列表和 *）"""
+    if etag is None:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """
+    按 RFC 7232 判断条件请求是否可以返回 304
+
+    有 If-None-Match 时只比较 ETag，否则比较 If-Modified-Since 与修改时间（秒）
+    """
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= int(parsedate_to_datetime(if_modified_since).timestamp())
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified_response(headers):
+    """304 响应只保留与缓存相关的头"""
+    kept = {k: v for k, v in headers.items()
+            if k.lower() in ("etag", "last-modified", "cache-control", "expires", "vary")}
+    return Response(status_code=304, headers=kept)
+
+
+class FileMeta:
+    """一个文件的状态及由其派生的响应头信息"""
+
+    __slots__ = ("stat", "etag", "last_modified", "content_type")
+
+    def __init__(self, st, content_type):
+        self.stat = st
+        self.etag = make_etag(st)
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        self.content_type = content_type
+
+    @property
+    def size(self):
+        return self.stat.st_size
+
+    @property
+    def mtime(self):
+        return self.stat.st_mtime
+
+
+class StatCache:
+    """
+    经过校验的文件元数据缓存
+
+    每次查询都会 stat 一次文件，inode、大小或修改时间与缓存不一致时重新生成
+    ETag、Last-Modified 等信息，因此文件被替换后不会返回过期的元数据；
+    同一个请求中只需要这一次系统调用。
+    """
+
+    def __init__(self, content_type_func=None, max_size=STAT_CACHE_SIZE):
+        self.content_type_func = content_type_func or (lambda name: "application/octet-stream")
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, path):
+        """
+        Returns:
+            FileMeta；路径不存在或不是普通文件时返回 None
+        """
+        key = os.fspath(path)
+        try:
+            st = os.stat(key)
+        except OSError:
+            with self._lock:
+                self._items.pop(key, None)
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        with self._lock:
+            meta = self._items.get(key)
+            if meta is not None:
+                cached = meta.stat
+                if (cached.st_ino, cached.st_size, cached.st_mtime_ns) == (st.st_ino, st.st_size, st.st_mtime_ns):
+                    self._items.move_to_end(key)
+                    return meta
+
+        meta = FileMeta(st, self.content_type_func(os.path.basename(key)))
+        with self._lock:
+            self._items[key] = meta
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return meta
+
+
+def _read_at(fd, offset, size):
+    """在指定偏移处读取数据（Windows 没有 os.pread 时回退到 lseek + read）"""
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+class RangeFileResponse(Response):
+    """
+    发送文件中一个或多个区间的响应
+
+    多个区间时以 multipart/byteranges 格式发送。每个区间的发送方式按优先级选择：
+    1. 服务器支持 ASGI http.response.zerocopysend 扩展时，把文件描述符和区间交给服务器，
+       由服务器通过 sendfile 直接写入 socket；
+    2. 发送整个文件且服务器支持 http.response.pathsend 扩展时，交由服务器直接发送路径；
+    3. 否则在线程池中按块 pread 读取后发送。
+    """
+
+    def __init__(self, path, ranges=None, file_size=None, status_code=200,
+                 headers=None, media_type=None):
+        self.path = str(path)
+        if file_size is None:
+            file_size = os.stat(self.path).st_size
+        self.file_size = file_size
+        self.ranges = ranges if ranges is not None else [(0, file_size - 1)]
+        self.status_code = status_code
+        self.media_type = media_type or "application/octet-stream"
+        self.background = None
+
+        if len(self.ranges) > 1:
+            # 多区间：Content-Type 改为 multipart/byteranges，并预先生成每段的分隔头
+            self.boundary = uuid.uuid4().hex
+            part_type = self.media_type
+            self.media_type = f"multipart/byteranges; boundary={self.boundary}"
+            self.part_headers = [
+                (
+                    f"--{self.boundary}\r\n"
+                    f"Content-Type: {part_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+                ).encode("latin-1")
+                for start, end in self.ranges
+            ]
+            self.closing = f"--{self.boundary}--\r\n".encode("latin-1")
+        else:
+            self.boundary = None
+
+        self.init_headers(headers)
+        self.headers.setdefault("accept-ranges", "bytes")
+        self.headers["content-length"] = str(self.content_length)
+        if status_code == 206 and self.boundary is None:
+            start, end = self.ranges[0]
+            self.headers["content-range"] = f"bytes {start}-{end}/{file_size}"
+
+    @property
+    def content_length(self):
+        body_length = sum(max(end - start + 1, 0) for start, end in self.ranges)
+        if self.boundary is None:
+            return body_length
+        # 每段之后还有一个 CRLF
+        return (body_length + sum(len(h) + 2 for h in self.part_headers) + len(self.closing))
+
+    async def __call__(self, scope, receive, send):
+        send_header_only = scope["method"].upper() == "HEAD"
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        if send_header_only or self.content_length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        spec_version = tuple(map(int, scope.get("asgi", {}).get("spec_version", "2.0").split(".")))
+        if spec_version >= (2, 4):
+            try:
+                await self._send_body(scope, send)
+            except OSError:
+                logger.info(f"客户端已断开: {self.path}")
+            return
+
+        # 旧版本 ASGI 服务器需要自己监听断开事件，避免继续读取文件
+        async with anyio.create_task_group() as task_group:
+            async def send_and_cancel():
+                await self._send_body(scope, send)
+                task_group.cancel_scope.cancel()
+
+            async def listen_for_disconnect():
+                while True:
+                    message = await receive()
+                    if message["type"] == "http.disconnect":
+                        break
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(send_and_cancel)
+            await listen_for_disconnect()
+
+    async def _send_body(self, scope, send):
+        extensions = scope.get("extensions") or {}
+        zerocopy = "http.response.zerocopysend" in extensions
+
+        if (self.boundary is None and not zerocopy and "http.response.pathsend" in extensions
+                and self.ranges[0] == (0, self.file_size - 1)):
+            await send({"type": "http.response.pathsend", "path": self.path})
+            return
+
+        if zerocopy:
+            with open(self.path, "rb") as f:
+                await self._send_parts(send, partial(self._zerocopy_range, send, f))
+            return
+
+        fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            await self._send_parts(send, partial(self._read_range, send, fd))
+        finally:
+            os.close(fd)
+
+    async def _send_parts(self, send, send_range):
+        """依次发送所有区间；多区间时在每段前后插入 multipart 分隔符"""
+        if self.boundary is None:
+            start, end = self.ranges[0]
+            await send_range(start, end, last=True)
+            return
+
+        for index, (start, end) in enumerate(self.ranges):
+            await send({"type": "http.response.body", "body": self.part_headers[index], "more_body": True})
+            await send_range(start, end, last=False)
+            await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+        await send({"type": "http.response.body", "body": self.closing, "more_body": False})
+
+    async def _zerocopy_range(self, send, f, start, end, last):
+        await send({
+            "type": "http.response.zerocopysend",
+            "file": f,
+            "offset": start,
+            "count": end - start + 1,
+            "more_body": not last,
+        })
+
+    async def _read_range(self, send, fd, start, end, last):
+        position = start
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await anyio.to_thread.run_sync(
+                partial(_read_at, fd, position, min(READ_CHUNK_SIZE, remaining))
+            )
+            if not data:
+                # 文件在发送过程中被截断
+                raise OSError(f"文件在发送过程中被截断: {self.path}")
+            position += len(data)
+            remaining -= len(data)
+            await send({"type": "http.response.body", "body": data, "more_body": remaining > 0 or not last})
+
+
+def serve_file(request, path, media_type=None, filename=None, etag=None, headers=None, stat_result=None,
+               max_bytes=None, cache_control=None):
+    """
+    所有文件下载/播放路由共用的文件响应入口
+
+    处理 Range（单区间、多区间、后缀区间）、If-Range 和 416，
+    没有 Range 请求时返回 200 和整个文件。
+
+    Args:
+        request: 当前请求
+        path: 文件路径
+        media_type: Content-Type
+        filename: 作为附件下载时的文件名（None 表示内联展示）
+        etag: 资源的 ETag，不提供时根据文件状态生成
+        headers: 额外的响应头
+        stat_result: 已获取的文件状态，避免重复 stat
+        max_bytes: 单次响应允许返回的最大字节数，超出时拒绝请求
+        cache_control: Cache-Control 响应头
+
+    If-None-Match / If-Modified-Since 条件成立时返回 304。
+    """
+    st = stat_result or os.stat(path)
+    file_size = st.st_size
+    etag = etag or make_etag(st)
+
+    response_headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+    }
+    if cache_control:
+        response_headers["Cache-Control"] = cache_control
+    if filename:
+        response_headers["Content-Disposition"] = content_disposition(filename)
+    if headers:
+        response_headers.update(headers)
+
+    if is_not_modified(request, etag, st.st_mtime):
+        return not_modified_response(response_headers)
+
+    ranges = None
+    range_header = request.headers.get("range")
+    if range_header and request.method in ("GET", "HEAD"):
+        if_range = request.headers.get("if-range")
+        if if_range is None or if_range_matches(if_range, etag, st.st_mtime):
+            try:
+                ranges = parse_range_header(range_header, file_size)
+            except RangeNotSatisfiable:
+                return Response(
+                    status_code=416,
+                    headers={"Content-Range": f"bytes */{file_size}", "Accept-Ranges": "bytes"}
+                )
+
+    if max_bytes is not None:
+        requested = file_size if ranges is None else sum(end - start + 1 for start, end in ranges)
+        if requested > max_bytes:
+            if ranges is None:
+                return Response(status_code=403, content="请求的数据量超过链接允许的大小")
+            return Response(
+                status_code=416,
+                headers={"Content-Range": f"bytes */{file_size}", "Accept-Ranges": "bytes"}
+            )
+
+    if ranges is None:
+        return RangeFileResponse(path, None, file_size, status_code=200,
+                                 headers=response_headers, media_type=media_type)
+    return RangeFileResponse(path, ranges, file_size, status_code=206,
+                             headers=response_headers, media_type=media_type)
@@ -0,0 +1,402 @@
+import os
+import json
+import math
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+
+logger = logging.getLogger("hls")
+
+# 分段缓存目录
+HLS_CACHE_DIR = Path("./hls_cache")
+
+# 每个分段的目标时长（秒）
+SEGMENT_DURATION = 6
+
+# 同时运行的转码任务（按分段）和转封装任务（按文件）数量上限
+MAX_TRANSCODE_JOBS = 2
+MAX_REMUX_JOBS = 2
+
+# 分段缓存总大小上限（字节），超出后按最近访问时间淘汰整个文件的分段
+HLS_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024
+
+# 可以直接复制到 MPEG-TS 而无需转码的编码
+COPY_VIDEO_CODECS = {"h264"}
+COPY_AUDIO_CODECS = {"aac", "mp3"}
+
+# 等待转封装产出播放列表/分段的最长时间（秒）
+WAIT_TIMEOUT = 30
+
+FFMPEG_PATH = shutil.which("ffmpeg")
+FFPROBE_PATH = shutil.which("ffprobe")
+
+
+class HLSUnavailable(Exception):
+    """服务器未安装 ffmpeg，或文件无法处理"""
+
+
+def media_key(path, st=None):
+    """分段缓存键：由文件路径、大小和修改时间决定，文件变化后旧分段自动失效"""
+    st = st or os.stat(path)
+    raw = f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]
+
+
+class HLSService:
+    """
+    HLS 分段播放
+
+    浏览器无法直接播放的容器（MKV、AVI、FLV、TS 等）转换为 HLS：
+    - 编码可直接复制（H.264 + AAC/MP3）时，后台用一个 ffmpeg 进程把整个文件转封装为分段，
+      只复制数据不重新编码，速度接近磁盘读取速度；
+    - 否则按固定时长生成完整的 VOD 播放列表，每个分段在首次请求时单独转码，
+      可以立即播放和跳转到任意位置。
+    """
+
+    def __init__(self, cache_dir=HLS_CACHE_DIR, max_transcode_jobs=MAX_TRANSCODE_JOBS,
+                 max_remux_jobs=MAX_REMUX_JOBS, max_cache_bytes=HLS_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_cache_bytes = max_cache_bytes
+        self.max_transcode_jobs = max_transcode_jobs
+        self.max_remux_jobs = max_remux_jobs
+        self._transcode_semaphore = None
+        self._remux_semaphore = None
+        self._infos = {}       # key -> 媒体信息
+        self._probes = {}      # key -> 正在进行的探测任务
+        self._segments = {}    # (key, index) -> 正在进行的转码任务
+        self._remuxes = {}     # key -> 正在进行的转封装任务
+        self._processes = set()
+
+    @property
+    def available(self):
+        return bool(FFMPEG_PATH and FFPROBE_PATH)
+
+    def start(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._transcode_semaphore = asyncio.Semaphore(self.max_transcode_jobs)
+        self._remux_semaphore = asyncio.Semaphore(self.max_remux_jobs)
+
+    async def stop(self):
+        for task in list(self._remuxes.values()) + list(self._segments.values()) + list(self._probes.values()):
+            task.cancel()
+        for process in list(self._processes):
+            if process.returncode is None:
+                process.kill()
+
+    # ---------------- 子进程 ----------------
+
+    async def _run(self, *args):
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        self._processes.add(process)
+        try:
+            stdout, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.kill()
+            raise
+        finally:
+            self._processes.discard(process)
+        return process.returncode, stdout, stderr
+
+    # ---------------- 媒体信息 ----------------
+
+    def _media_dir(self, key):
+        return self.cache_dir / key
+
+    def _touch(self, key):
+        try:
+            os.utime(self._media_dir(key))
+        except OSError:
+            pass
+
+    async def _probe(self, key, source):
+        code, stdout, stderr = await self._run(
+            FFPROBE_PATH, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", source
+        )
+        if code != 0:
+            raise HLSUnavailable(f"无法解析媒体文件: {stderr.decode('utf-8', 'ignore').strip()}")
+        data = json.loads(stdout or b"{}")
+        streams = data.get("streams", [])
+        video = next((s for s in streams if s.get("codec_type") == "video"), None)
+        audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+        if video is None:
+            raise HLSUnavailable("文件中没有视频流")
+        try:
+            duration = float(data.get("format", {}).get("duration") or video.get("duration") or 0)
+        except ValueError:
+            duration = 0
+
+        copy = (video.get("codec_name") in COPY_VIDEO_CODECS
+                and (audio is None or audio.get("codec_name") in COPY_AUDIO_CODECS))
+        if not copy and duration <= 0:
+            raise HLSUnavailable("无法获取视频时长")
+
+        info = {
+            "source": source,
+            "mode": "copy" if copy else "transcode",
+            "duration": duration,
+            "video_codec": video.get("codec_name"),
+            "audio_codec": audio.get("codec_name") if audio else None,
+            "has_audio": audio is not None,
+        }
+        media_dir = self._media_dir(key)
+        media_dir.mkdir(parents=True, exist_ok=True)
+        with open(media_dir / "info.json", "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False)
+        return info
+
+    async def _get_info(self, key, source):
+        info = self._infos.get(key)
+        if info is not None:
+            return info
+        info_path = self._media_dir(key) / "info.json"
+        if info_path.exists():
+            with open(info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+        else:
+            # 同一文件的并发请求共享一次探测
+            task = self._probes.get(key)
+            if task is None:
+                task = self._probes[key] = asyncio.create_task(self._probe(key, source))
+                task.add_done_callback(lambda _: self._probes.pop(key, None))
+            info = await asyncio.shield(task)
+        self._infos[key] = info
+        return info
+
+    async def _info_for_key(self, key):
+        """按缓存键取回媒体信息，并确认源文件没有变化"""
+        info = self._infos.get(key)
+        if info is None:
+            info_path = self._media_dir(key) / "info.json"
+            if not info_path.exists():
+                return None
+            with open(info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+        try:
+            if media_key(info["source"]) != key:
+                return None
+        except OSError:
+            return None
+        self._infos[key] = info
+        return info
+
+    # ---------------- 播放列表 ----------------
+
+    async def get_playlist(self, source):
+        """
+        返回文件的 HLS 播放列表内容
+
+        Raises:
+            HLSUnavailable: 未安装 ffmpeg 或文件无法处理
+        """
+        if not self.available:
+            raise HLSUnavailable("服务器未安装 ffmpeg")
+        source = str(source)
+        key = media_key(source)
+        info = await self._get_info(key, source)
+        self._touch(key)
+
+        if info["mode"] == "copy":
+            playlist_path = self._media_dir(key) / "index.m3u8"
+            task = self._ensure_remux(key, info)
+            deadline = time.monotonic() + WAIT_TIMEOUT
+            while not playlist_path.exists():
+                if task is not None and task.done() and (task.cancelled() or not task.result()):
+                    raise HLSUnavailable("转封装失败")
+                if time.monotonic() > deadline:
+                    raise HLSUnavailable("转封装超时")
+                await asyncio.sleep(0.2)
+            with open(playlist_path, "r", encoding="utf-8") as f:
+                return f.read()
+
+        count = max(1, math.ceil(info["duration"] / SEGMENT_DURATION))
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{SEGMENT_DURATION}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:VOD",
+        ]
+        for index in range(count):
+            length = min(SEGMENT_DURATION, info["duration"] - index * SEGMENT_DURATION)
+            lines.append(f"#EXTINF:{length:.3f},")
+            lines.append(f"/hls/segments/{key}/seg_{index:05d}.ts")
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    # ---------------- 转封装（整个文件） ----------------
+
+    def _ensure_remux(self, key, info):
+        """启动转封装（已完成时不做任何事），返回正在进行的任务或 None"""
+        media_dir = self._media_dir(key)
+        if (media_dir / "complete").exists():
+            return None
+        task = self._remuxes.get(key)
+        if task is None or task.done():
+            task = self._remuxes[key] = asyncio.create_task(self._remux(key, info))
+            # 结束后移除，active_keys 只包含正在转封装的文件，缓存清理才能淘汰已完成的结果
+            task.add_done_callback(lambda done: self._remuxes.pop(key) if self._remuxes.get(key) is done else None)
+        return task
+
+    async def _remux(self, key, info):
+        """转封装整个文件，成功返回 True"""
+        media_dir = self._media_dir(key)
+        media_dir.mkdir(parents=True, exist_ok=True)
+        async with self._remux_semaphore:
+            args = [
+                FFMPEG_PATH, "-v", "error", "-y", "-i", info["source"],
+                "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+                "-f", "hls", "-hls_time", str(SEGMENT_DURATION),
+                "-hls_playlist_type", "event", "-hls_flags", "temp_file+independent_segments",
+                "-hls_segment_filename", str(media_dir / "seg_%05d.ts"),
+                "-hls_base_url", f"/hls/segments/{key}/",
+                str(media_dir / "index.m3u8"),
+            ]
+            code, _, stderr = await self._run(*args)
+        if code != 0:
+            logger.error(f"HLS 转封装失败: {info['source']} - {stderr.decode('utf-8', 'ignore').strip()}")
+            return False
+        (media_dir / "complete").touch()
+        logger.info(f"HLS 转封装完成: {info['source']}")
+        return True
+
+    # ---------------- 分段 ----------------
+
+    async def get_segment(self, key, name):
+        """
+        返回分段文件路径，需要时转码生成
+
+        Returns:
+            分段路径；缓存键无效或分段不存在时返回 None
+        """
+        if not name.startswith("seg_") or not name.endswith(".ts"):
+            return None
+        try:
+            index = int(name[4:-3])
+        except ValueError:
+            return None
+        info = await self._info_for_key(key)
+        if info is None:
+            return None
+        self._touch(key)
+        segment_path = self._media_dir(key) / name
+
+        if info["mode"] == "copy":
+            if segment_path.exists():
+                return segment_path
+            # 分段被淘汰或服务重启后重新转封装
+            task = self._ensure_remux(key, info)
+            deadline = time.monotonic() + WAIT_TIMEOUT
+            while not segment_path.exists():
+                if task is None or task.done() or time.monotonic() > deadline:
+                    return segment_path if segment_path.exists() else None
+                await asyncio.sleep(0.2)
+            return segment_path
+
+        count = max(1, math.ceil(info["duration"] / SEGMENT_DURATION))
+        if index < 0 or index >= count:
+            return None
+        await self._transcode_segment(key, info, index)
+        # 顺序播放时下一个分段很快会被请求，提前在后台生成
+        if index + 1 < count:
+            self._schedule_segment(key, info, index + 1)
+        return segment_path if segment_path.exists() else None
+
+    def _schedule_segment(self, key, info, index):
+        segment_key = (key, index)
+        task = self._segments.get(segment_key)
+        if task is None:
+            if (self._media_dir(key) / f"seg_{index:05d}.ts").exists():
+                return None
+            task = self._segments[segment_key] = asyncio.create_task(self._transcode(key, info, index))
+            task.add_done_callback(lambda _: self._segments.pop(segment_key, None))
+        return task
+
+    async def _transcode_segment(self, key, info, index):
+        task = self._schedule_segment(key, info, index)
+        if task is not None:
+            # 请求被取消时不影响其他等待同一分段的请求
+            await asyncio.shield(task)
+
+    async def _transcode(self, key, info, index):
+        media_dir = self._media_dir(key)
+        media_dir.mkdir(parents=True, exist_ok=True)
+        segment_path = media_dir / f"seg_{index:05d}.ts"
+        tmp_path = media_dir / f"seg_{index:05d}.ts.tmp"
+        start = index * SEGMENT_DURATION
+
+        async with self._transcode_semaphore:
+            if segment_path.exists():
+                return
+            args = [
+                FFMPEG_PATH, "-v", "error", "-y",
+                "-ss", str(start), "-i", info["source"], "-t", str(SEGMENT_DURATION),
+                "-map", "0:v:0", "-map", "0:a:0?",
+                "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+                "-vf", "scale='min(1920,iw)':-2",
+                "-c:a", "aac", "-b:a", "160k", "-ac", "2",
+                # 时间戳接续前一个分段，播放器可以无缝拼接
+                "-output_ts_offset", str(start),
+                "-f", "mpegts", str(tmp_path),
+            ]
+            code, _, stderr = await self._run(*args)
+        if code != 0:
+            tmp_path.unlink(missing_ok=True)
+            logger.error(f"HLS 分段转码失败: {info['source']}#{index} - {stderr.decode('utf-8', 'ignore').strip()}")
+            return
+        os.replace(tmp_path, segment_path)
+
+    # ---------------- 缓存淘汰 ----------------
+
+    def active_keys(self):
+        """正在转封装或转码的文件（需在事件循环中调用）"""
+        return set(self._remuxes) | {key for key, _ in self._segments}
+
+    def cleanup(self, active=()):
+        """
+        分段缓存超过上限时，按最近访问时间淘汰整个文件的分段（正在处理的文件除外）
+
+        Args:
+            active: 正在处理、不可淘汰的缓存键（见 active_keys）
+
+        Returns:
+            删除的目录数量
+        """
+        if not self.cache_dir.exists():
+            return 0
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                size = 0
+                for root, _, files in os.walk(entry.path):
+                    for name in files:
+                        try:
+                            size += os.path.getsize(os.path.join(root, name))
+                        except OSError:
+                            pass
+                entries.append((entry.stat().st_mtime, size, entry.name, entry.path))
+                total += size
+
+        if total <= self.max_cache_bytes:
+            return 0
+        target = int(self.max_cache_bytes * 0.9)
+        removed = 0
+        for _, size, key, path in sorted(entries):
+            if total <= target:
+                break
+            if key in active:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            self._infos.pop(key, None)
+            total -= size
+            removed += 1
+        logger.info(f"HLS 缓存清理: 删除 {removed} 个文件的分段，剩余 {total / 1024 / 1024:.0f}MB")
+        return removed
@@ -0,0 +1,415 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import secrets
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from coordination import process_alive
+
+logger = logging.getLogger("jobs")
+
+# 后台任务数据库路径（与 users.db 放在同一目录）
+BASE_DIR = os.environ.get("ZAY_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
+JOBS_DB = os.path.join(BASE_DIR, "jobs.db")
+
+# 每个工作进程同时运行的后台任务数（其余排队），避免大批量操作占满磁盘和线程影响媒体播放
+JOB_WORKERS = 2
+# 进度写入数据库的最小间隔（秒）
+PROGRESS_INTERVAL = 0.5
+# 已结束的任务保留时间（秒）
+JOB_RETENTION = 7 * 86400
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELED = "canceled"
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELED)
+
+
+class JobCanceled(Exception):
+    """任务被取消"""
+
+
+class JobError(Exception):
+    """任务失败，detail 会原样展示给用户"""
+
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class JobContext:
+    """
+    传给任务函数的上下文
+
+    任务函数在后台线程中运行，定期调用 progress 汇报进度，
+    在循环中调用 check_canceled，被取消时抛出 JobCanceled。
+    """
+
+    def __init__(self, manager, job_id, cancel_event):
+        self.manager = manager
+        self.job_id = job_id
+        self._cancel_event = cancel_event
+        self._started = time.monotonic()
+        self._counters = {"files_done": 0, "files_total": None, "bytes_done": 0, "bytes_total": None}
+        self._written_at = 0
+        self._cancel_checked_at = 0
+
+    @property
+    def canceled(self):
+        if self._cancel_event.is_set():
+            return True
+        # 取消请求可能来自其他工作进程，定期查询数据库
+        now = time.monotonic()
+        if now - self._cancel_checked_at >= PROGRESS_INTERVAL:
+            self._cancel_checked_at = now
+            if self.manager.cancel_requested(self.job_id):
+                self._cancel_event.set()
+        return self._cancel_event.is_set()
+
+    def check_canceled(self):
+        if self.canceled:
+            raise JobCanceled()
+
+    def progress(self, force=False, **counters):
+        """
+        更新进度计数（files_done、files_total、bytes_done、bytes_total）
+
+        写入数据库的频率受 PROGRESS_INTERVAL 限制。
+        """
+        self._counters.update(counters)
+        now = time.monotonic()
+        if force or now - self._written_at >= PROGRESS_INTERVAL:
+            self._written_at = now
+            self.manager._update(self.job_id, progress=json.dumps(self.snapshot()))
+
+    def snapshot(self):
+        progress = dict(self._counters)
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        # 有字节数时按字节计算速率和剩余时间，否则按文件数
+        done_key, total_key = ("bytes_done", "bytes_total") if progress["bytes_total"] else ("files_done", "files_total")
+        rate = progress[done_key] / elapsed
+        progress["rate"] = round(rate, 2)
+        progress["rate_unit"] = "bytes" if done_key == "bytes_done" else "files"
+        total = progress[total_key]
+        progress["eta"] = round((total - progress[done_key]) / rate, 1) if total and rate > 0 else None
+        progress["elapsed"] = round(elapsed, 1)
+        return progress
+
+
+class JobManager:
+    """
+    持久化的后台任务队列
+
+    长时间操作（批量映射、删除文件夹、合并上传、WebDAV 下载）由接口提交为任务后立即返回，
+    在专用的小线程池中执行。任务状态和进度保存在 SQLite 中，任何工作进程都可以查询、
+    取消和推送事件；服务重启时未完成的任务标记为失败，可以重试。
+    """
+
+    def __init__(self, db_path=JOBS_DB, workers=JOB_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._handlers = {}          # 任务类型 -> (函数, 完成回调)
+        self._cancel_events = {}     # 本进程中的任务 ID -> Event
+        self._waiters = {}           # 任务 ID -> [Event]
+        self._executor = None
+
+        self._init_schema()
+
+    # ---------------- 数据库 ----------------
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    title TEXT,
+                    owner TEXT,
+                    params TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    updated_at REAL NOT NULL,
+                    seq INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            # 旧版本创建的数据库没有事件序号列
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "seq" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner_updated ON jobs(owner, updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner_seq ON jobs(owner, seq)")
+            # 事件序号计数器：每次写入任务递增，作为事件流的 id（删除旧任务后也不会重复）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_sequence (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    value INTEGER NOT NULL
+                )
+            """)
+            conn.execute("INSERT OR IGNORE INTO job_sequence (id, value) "
+                         "VALUES (0, (SELECT COALESCE(MAX(seq), 0) FROM jobs))")
+
+    @staticmethod
+    def _next_seq(conn):
+        """在当前写事务中取下一个事件序号（多进程共用同一个计数器）"""
+        conn.execute("UPDATE job_sequence SET value = value + 1 WHERE id = 0")
+        return conn.execute("SELECT value FROM job_sequence WHERE id = 0").fetchone()[0]
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute(f"UPDATE jobs SET {columns}, seq = ? WHERE id = ?",
+                         (*fields.values(), self._next_seq(conn), job_id))
+
+    @staticmethod
+    def _to_dict(row):
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "title": row["title"],
+            "state": row["state"],
+            "progress": json.loads(row["progress"]) if row["progress"] else None,
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "cancel_requested": bool(row["cancel_requested"]),
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "updated_at": row["updated_at"],
+            "seq": row["seq"],
+        }
+
+    # ---------------- 查询 ----------------
+
+    def get(self, job_id, owner=None):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (owner is not None and row["owner"] != owner):
+            return None
+        return self._to_dict(row)
+
+    def list(self, owner, active_only=False, limit=100):
+        sql = "SELECT * FROM jobs WHERE owner = ?"
+        if active_only:
+            sql += f" AND state IN ({','.join('?' * len(ACTIVE_STATES))})"
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params = (owner, *(ACTIVE_STATES if active_only else ()), limit)
+        return [self._to_dict(row) for row in self._connect().execute(sql, params)]
+
+    def changed_since(self, owner, since, job_id=None, updated_after=None):
+        """
+        返回事件序号大于 since 的任务，按序号排列（事件流轮询使用）
+
+        Args:
+            updated_after: 只返回 updated_at 晚于该时间的任务（事件流建立时补发最近的变化）
+        """
+        sql = "SELECT * FROM jobs WHERE owner = ? AND seq > ?"
+        params = [owner, since]
+        if job_id is not None:
+            sql += " AND id = ?"
+            params.append(job_id)
+        if updated_after is not None:
+            sql += " AND updated_at > ?"
+            params.append(updated_after)
+        sql += " ORDER BY seq"
+        return [self._to_dict(row) for row in self._connect().execute(sql, params)]
+
+    def latest_seq(self):
+        """当前最大的事件序号"""
+        return self._connect().execute("SELECT value FROM job_sequence WHERE id = 0").fetchone()[0]
+
+    def cancel_requested(self, job_id):
+        row = self._connect().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    # ---------------- 提交和控制 ----------------
+
+    def register(self, kind, func, on_success=None):
+        """
+        注册任务类型
+
+        Args:
+            func: func(ctx, **params) -> 可 JSON 序列化的结果，在后台线程中执行
+            on_success: 任务成功后调用 on_success(params, result)
+        """
+        self._handlers[kind] = (func, on_success)
+
+    def submit(self, kind, params, owner=None, title=None):
+        """提交任务并立即返回任务信息"""
+        if kind not in self._handlers:
+            raise ValueError(f"未知的任务类型: {kind}")
+        job_id = secrets.token_hex(8)
+        now = time.time()
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, title, owner, params, state, worker, created_at, updated_at, seq) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, title, owner, json.dumps(params, ensure_ascii=False), QUEUED,
+                 self.worker_id, now, now, self._next_seq(conn))
+            )
+        self._enqueue(job_id)
+        return self.get(job_id)
+
+    def _enqueue(self, job_id):
+        self._cancel_events[job_id] = threading.Event()
+        self._executor.submit(self._run, job_id)
+
+    def cancel(self, job_id, owner=None):
+        """
+        取消任务：排队中的任务直接取消，运行中的任务在下一次检查时停止
+
+        Returns:
+            任务信息；任务不存在时返回 None
+        """
+        job = self.get(job_id, owner)
+        if job is None:
+            return None
+        if job["state"] == QUEUED:
+            self._update(job_id, state=CANCELED, cancel_requested=1, finished_at=time.time())
+        elif job["state"] == RUNNING:
+            self._update(job_id, cancel_requested=1)
+        event = self._cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+        return self.get(job_id)
+
+    def retry(self, job_id, owner=None):
+        """
+        重新执行失败或已取消的任务（在当前进程中排队）
+
+        Returns:
+            任务信息；任务不存在或仍在执行时返回 None
+        """
+        job = self.get(job_id, owner)
+        if job is None or job["state"] not in (FAILED, CANCELED):
+            return None
+        self._update(job_id, state=QUEUED, error=None, result=None, progress=None, cancel_requested=0,
+                     worker=self.worker_id, started_at=None, finished_at=None)
+        self._enqueue(job_id)
+        return self.get(job_id)
+
+    def wait(self, job_id, timeout=None):
+        """阻塞等待本进程中的任务结束（在线程中调用）"""
+        event = threading.Event()
+        self._waiters.setdefault(job_id, []).append(event)
+        job = self.get(job_id)
+        if job is not None and job["state"] in FINISHED_STATES:
+            return job
+        event.wait(timeout)
+        return self.get(job_id)
+
+    # ---------------- 执行 ----------------
+
+    def _run(self, job_id):
+        cancel_event = self._cancel_events.get(job_id) or threading.Event()
+        try:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["state"] != QUEUED:
+                return
+            func, on_success = self._handlers[row["kind"]]
+            params = json.loads(row["params"])
+            self._update(job_id, state=RUNNING, started_at=time.time(), attempts=row["attempts"] + 1)
+
+            ctx = JobContext(self, job_id, cancel_event)
+            try:
+                ctx.check_canceled()
+                result = func(ctx, **params)
+                if on_success is not None:
+                    on_success(params, result)
+            except JobCanceled:
+                self._update(job_id, state=CANCELED, progress=json.dumps(ctx.snapshot()), finished_at=time.time())
+                logger.info(f"任务已取消: {row['kind']} {job_id}")
+            except JobError as e:
+                self._update(job_id, state=FAILED, error=e.detail, progress=json.dumps(ctx.snapshot()),
+                             finished_at=time.time())
+            except Exception as e:
+                logger.error(f"任务执行失败: {row['kind']} {job_id} - {str(e)}")
+                self._update(job_id, state=FAILED, error=str(e), progress=json.dumps(ctx.snapshot()),
+                             finished_at=time.time())
+            else:
+                self._update(job_id, state=SUCCEEDED, result=json.dumps(result, ensure_ascii=False, default=str),
+                             progress=json.dumps(ctx.snapshot()), finished_at=time.time())
+        except Exception as e:
+            logger.error(f"任务调度失败: {job_id} - {str(e)}")
+        finally:
+            self._cancel_events.pop(job_id, None)
+            for event in self._waiters.pop(job_id, []):
+                event.set()
+
+    def _recover(self):
+        """把已退出进程留下的未完成任务标记为失败（可以重试）"""
+        hostname = socket.gethostname()
+        conn = self._connect()
+        rows = conn.execute(
+            f"SELECT id, worker FROM jobs WHERE state IN ({','.join('?' * len(ACTIVE_STATES))})", ACTIVE_STATES
+        ).fetchall()
+        for job_id, worker in rows:
+            host, _, rest = (worker or "").partition(":")
+            pid = rest.partition(":")[0]
+            if host == hostname and pid.isdigit() and not process_alive(int(pid)):
+                self._update(job_id, state=FAILED, error="服务重启，任务已中断，可以重试", finished_at=time.time())
+
+    def cleanup(self, max_age=JOB_RETENTION):
+        """删除结束时间超过 max_age 的任务记录"""
+        conn = self._connect()
+        with self._write_lock, conn:
+            cursor = conn.execute(
+                f"DELETE FROM jobs WHERE state IN ({','.join('?' * len(FINISHED_STATES))}) AND finished_at < ?",
+                (*FINISHED_STATES, time.time() - max_age)
+            )
+        return cursor.rowcount
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        try:
+            self._recover()
+        except Exception as e:
+            logger.error(f"恢复未完成任务失败: {str(e)}")
+
+    def stop(self):
+        for event in list(self._cancel_events.values()):
+            event.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        # 关闭时仍在排队的任务标记为失败
+        conn = self._connect()
+        rows = conn.execute(
+            f"SELECT id FROM jobs WHERE worker = ? AND state IN ({','.join('?' * len(ACTIVE_STATES))})",
+            (self.worker_id, *ACTIVE_STATES)
+        ).fetchall()
+        for (job_id,) in rows:
+            self._update(job_id, state=FAILED, error="服务重启，任务已中断，可以重试", finished_at=time.time())
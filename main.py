@@ -4,10 +4,10 @@ import webbrowser
 from fastapi import FastAPI, Request, Response, UploadFile, File, Form, HTTPException, Depends, Query
 from fastapi.responses import FileResponse, StreamingResponse, HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
 import mimetypes
 from pathlib import Path
 import logging
+import time
 import uvicorn
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
@@ -20,25 +20,44 @@ import hashlib
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 import json
+import base64
 import platform
 from typing import List
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import FileResponse
 import os
-from view import get_media_thumbnail, start_cleanup_service
+from view import start_cleanup_service, THUMBNAIL_VARIANTS, DEFAULT_VARIANT
+from thumbnail_service import ThumbnailService
+from hls import HLSService, HLSUnavailable
+from media_probe import MediaProbe, PROBERS
 import shutil
 import asyncio
-from functools import lru_cache
 import hashlib
 from webdav import configure_webdav
 from webdav_client import WebDAVConnectionManager, WebDAVConnection
+from file_index import FileIndex, SEARCH_CANDIDATES
+from content_store import ContentStore, CAS_DIR_NAME
+from bulk_mapper import BulkMapper
+from source_index import SourceIndex
+from virtual_mounts import VirtualMounts
+from jobs import JobManager, JobError, ACTIVE_STATES, SUCCEEDED
+from static_assets import StaticAssets
+from api_responses import FastJSONResponse, CompressionMiddleware
+from file_serving import serve_file, StatCache, FileMeta, is_not_modified, not_modified_response
+from uploads import (UploadSessionManager, open_part_file, write_stream_at, iter_upload_file,
+                     hashing_stream, new_hasher, parse_hash_spec)
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
 from pydantic import BaseModel
+from sqlalchemy import event
 from database import engine, SessionLocal, User
+from principals import Principal, PrincipalCache
+from coordination import Coordinator
+from signed_links import LinkSigner, RevocationList, InvalidLink, load_or_create_secret
+from credentials import CredentialHasher, HasherBusy, LoginThrottle
 from database import init_db
 from fastapi.responses import RedirectResponse
 from fastapi.requests import Request
@@ -55,6 +74,16 @@ class LocalFileCheckRequest(BaseModel):
     directory: str
     fileSize: int
     lastModified: Optional[int] = None
+    localPath: Optional[str] = None
+
+
+# 批量检查的文件数上限
+MAX_LOCAL_CHECK_FILES = 5000
+
+
+# 批量检查请求模型（文件夹上传时一次提交全部文件）
+class LocalFileBatchCheckRequest(BaseModel):
+    files: List[LocalFileCheckRequest]
 
 
 # 定义本地映射请求模型
@@ -101,6 +130,59 @@ def save_mapping_sources(sources):
 # 初始化 LOCAL_FILE_SOURCES
 LOCAL_FILE_SOURCES = load_mapping_sources()
 
+# 去重存储配置文件（默认关闭）
+DEDUP_CONFIG = Path("./config/dedup.json")
+# 外部目录（映射源只读挂载）配置文件（默认关闭）
+VIRTUAL_MOUNTS_CONFIG = Path("./config/virtual_mounts.json")
+
+
+# 加载去重设置
+def load_dedup_settings():
+    try:
+        if DEDUP_CONFIG.exists():
+            with open(DEDUP_CONFIG, "r", encoding="utf-8") as f:
+                settings = json.load(f)
+                if isinstance(settings, dict):
+                    return settings
+    except Exception as e:
+        logger.error(f"加载去重设置失败: {str(e)}")
+    return {"enabled": False}
+
+
+# 保存去重设置
+def save_dedup_settings(settings):
+    try:
+        with open(DEDUP_CONFIG, "w", encoding="utf-8") as f:
+            json.dump(settings, f, ensure_ascii=False, indent=2)
+        return True
+    except Exception as e:
+        logger.error(f"保存去重设置失败: {str(e)}")
+        return False
+
+
+# 加载外部目录设置
+def load_virtual_mounts_settings():
+    try:
+        if VIRTUAL_MOUNTS_CONFIG.exists():
+            with open(VIRTUAL_MOUNTS_CONFIG, "r", encoding="utf-8") as f:
+                settings = json.load(f)
+                if isinstance(settings, dict):
+                    return settings
+    except Exception as e:
+        logger.error(f"加载外部目录设置失败: {str(e)}")
+    return {"enabled": False}
+
+
+# 保存外部目录设置
+def save_virtual_mounts_settings(settings):
+    try:
+        with open(VIRTUAL_MOUNTS_CONFIG, "w", encoding="utf-8") as f:
+            json.dump(settings, f, ensure_ascii=False, indent=2)
+        return True
+    except Exception as e:
+        logger.error(f"保存外部目录设置失败: {str(e)}")
+        return False
+
 # 创建线程池
 executor = ThreadPoolExecutor(max_workers=8)
 
@@ -125,41 +207,70 @@ PORTA = 5888
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时执行的代码
+    global event_loop
+    event_loop = asyncio.get_running_loop()
     init_db()
-    start_cleanup_service(interval_minutes=60, max_age_days=7)
-    cleanup_task = asyncio.create_task(cleanup_expired_links())
+    static_assets.build()
+    # 缩略图进程池需在其他后台线程启动之前创建
+    await thumbnail_service.start()
+    hls_service.start()
+    file_index.start(watch=False)
+    media_probe.start()
+    job_manager.start()
+    # 多进程部署时只有主进程运行 WebDAV 服务器、目录监听和定期清理
+    watch_shared_config()
+    coordinator.on_elected(start_leader_services)
+    coordinator.on_demoted(stop_leader_services)
+    coordinator.start()
+    source_index.set_roots(local_search_roots())
+    source_index.start(should_run=lambda: coordinator.is_leader)
+    start_cleanup_service(interval_minutes=60, max_age_days=7, should_run=lambda: coordinator.is_leader)
+    upload_cleanup_task = asyncio.create_task(cleanup_expired_uploads())
+    dedup_cleanup_task = asyncio.create_task(cleanup_content_store())
+    hls_cleanup_task = asyncio.create_task(cleanup_hls_cache())
+    job_cleanup_task = asyncio.create_task(cleanup_finished_jobs())
     local_ip = get_local_ip()
     port = PORTA
     url = f"http://{local_ip}:{port}"
-    logger.info(f"服务启动，自动打开网页: {url}")
-
-    # 启动 WebDAV 服务器
-    if webdav_server:
-        webdav_server.start()
-        webdav_port = webdav_server.port
-        webdav_url = f"http://{local_ip}:{webdav_port}"
-        logger.info(f"WebDAV 服务启动在 {webdav_url}")
-        logger.info(f"WebDAV 凭据 - 用户名: {webdav_server.username}, 密码: {webdav_server.password}")
-
-    webbrowser.open(url)  # 自启动浏览器
+    if coordinator.is_leader:
+        logger.info(f"服务启动，自动打开网页: {url}")
+        webbrowser.open(url)  # 自启动浏览器（多进程部署时只由主进程打开）
     yield
     # 关闭时执行的代码
     logger.info("Shutting down the application")
 
-    # 停止 WebDAV 服务器
-    if webdav_server:
-        webdav_server.stop()
-
-    cleanup_task.cancel()
+    # 释放主进程身份（同时停止 WebDAV 服务器和目录监听），其他进程可立即接管
+    coordinator.stop()
+
+    upload_cleanup_task.cancel()
+    dedup_cleanup_task.cancel()
+    hls_cleanup_task.cancel()
+    job_cleanup_task.cancel()
+    # 等待运行中的任务响应取消后再关闭其他服务
+    await asyncio.get_running_loop().run_in_executor(None, job_manager.stop)
+    await hls_service.stop()
+    await thumbnail_service.stop()
+    media_probe.stop()
+    source_index.stop()
+    file_index.stop()
+    credential_hasher.shutdown()
     executor.shutdown()
 
 
 # 初始化 FastAPI 应用
-app = FastAPI(lifespan=lifespan, title="ZAY-Cloud")
+app = FastAPI(lifespan=lifespan, title="ZAY-Cloud", default_response_class=FastJSONResponse)
+# 按 Accept-Encoding 压缩接口和页面响应（文件和媒体流不压缩）
+app.add_middleware(CompressionMiddleware)
 router = APIRouter()
 
 # 安全设置
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 低于 BCRYPT_ROUNDS 的旧哈希会在用户下次登录时自动升级
+BCRYPT_ROUNDS = 12
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__default_rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS)
+# 密码哈希在专用线程池中执行，不阻塞事件循环
+credential_hasher = CredentialHasher()
+login_throttle = LoginThrottle()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 # JWT 设置
@@ -167,6 +278,9 @@ SECRET_KEY = "your-secret-key-here"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# 已验证令牌的身份缓存
+principal_cache = PrincipalCache()
+
 
 # Pydantic 模型
 class TokenData(BaseModel):
@@ -188,23 +302,56 @@ def get_current_user(request: Request):
     if not token:
         return None
 
+    # 已验证过的令牌直接返回缓存的身份，不再解码和查询数据库
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         scheme, _, token_value = token.partition(" ")
         payload = jwt.decode(token_value, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if not username:
             return None
+    except JWTError:
+        return None
 
+    user_id = payload.get("uid")
+    if user_id is None:
+        # 旧版本签发的令牌不含用户 ID，查询一次数据库后缓存
         db = SessionLocal()
-        user = db.query(User).filter(User.username == username).first()
-        db.close()
-
+        try:
+            user = db.query(User).filter(User.username == username).first()
+        finally:
+            db.close()
         if not user:
             return None
+        user_id = user.id
 
-        return user
-    except JWTError:
+    principal = Principal(user_id, username, issued_at=payload.get("iat", 0), expires_at=payload.get("exp"))
+    if principal_cache.is_revoked(principal):
         return None
+    principal_cache.put(token, principal)
+    return principal
+
+
+# 用户信息变化时使该用户已签发的令牌失效
+def invalidate_user_principals(mapper, connection, target):
+    principal_cache.invalidate(target.username)
+    revoked_at = principal_cache.revocations()[target.username]
+
+    def record(revocations):
+        revocations = revocations or {}
+        revocations[target.username] = max(revocations.get(target.username, 0), revoked_at)
+        return revocations
+
+    # 记录到协调数据库，其他工作进程（以及重启后）同样拒绝旧令牌；
+    # 在同一事务中读写，多个进程同时修改用户时不会覆盖彼此的记录
+    coordinator.update_state("principal_revocations", record)
+
+
+event.listen(User, "after_update", invalidate_user_principals)
+event.listen(User, "after_delete", invalidate_user_principals)
 
 
 # 指定文件存储路径
@@ -212,9 +359,12 @@ FILE_STORAGE_PATH = Path("./storage")
 # 确保路径存在
 FILE_STORAGE_PATH.mkdir(parents=True, exist_ok=True)
 
-# 初始化 WebDAV 服务器
+# 初始化 WebDAV 服务器（只在主进程中启动，见 start_leader_services）
 webdav_server = configure_webdav(FILE_STORAGE_PATH)
 
+# 多进程部署的协调器：主进程选举和进程间共享状态
+coordinator = Coordinator()
+
 # 在文件开头的常量部分添加
 # 背景图片存储路径
 BACKGROUND_DIR = FILE_STORAGE_PATH / "backgrounds"
@@ -228,12 +378,18 @@ BACKGROUND_CONFIG = Path("./config/background.json")
 BASE_DIR = Path(__file__).parent
 templates = Jinja2Templates(directory=BASE_DIR / "templates")
 
-# 挂载静态文件目录
-app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
-app.mount("/storage", StaticFiles(directory=FILE_STORAGE_PATH), name="storage")
+# 静态资源：启动时生成带内容哈希的文件名和预压缩版本，模板通过 static_url() 引用
+static_assets = StaticAssets(BASE_DIR / "static", BASE_DIR / "static_build")
+templates.env.globals["static_url"] = static_assets.url
+# /storage 下的文件由 storage_file 路由提供，与其他文件路由共用条件请求和区间处理
 
-# 存储直链信息的字典 {token: (file_path, expiry_time)}
-direct_links = {}
+# 直链令牌自带签名，任何工作进程都能独立验证；只有被提前撤销的链接需要记录
+# 签名密钥取自 ZAY_LINK_SECRET，未设置时使用首次启动生成并保存在 config/ 下的随机密钥
+LINK_SECRET_FILE = "./config/link_secret"
+link_signer = LinkSigner(os.environ.get("ZAY_LINK_SECRET") or load_or_create_secret(LINK_SECRET_FILE))
+link_revocations = RevocationList("./config/revoked_links.json")
+# 直链最长有效期（秒）
+MAX_LINK_EXPIRES = 365 * 86400
 
 
 # 媒体类型扩展
@@ -334,84 +490,116 @@ def get_content_type(filename: str) -> str:
     return mime_type
 
 
-# 辅助函数：流式传输文件内容（支持 Range 请求，用于视频播放）
-def stream_file(file_path: Path, request: Request):
-    file_size = file_path.stat().st_size
-    content_type = get_content_type(file_path.name)
-    logger.info(f"Streaming file: {file_path.name}, Content-Type: {content_type}")
+# 用户文件可能被原地替换，浏览器每次使用前向服务器验证（未变化时返回 304）
+FILE_CACHE_CONTROL = "private, no-cache"
+# URL 中已包含版本信息的资源（缩略图、HLS 分段）内容不会变化
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# 所有文件路由共用的元数据缓存（每次请求校验 inode、大小和修改时间）
+stat_cache = StatCache(content_type_func=get_content_type)
+
 
+# 辅助函数：流式传输文件内容（支持 Range 请求，用于视频播放和下载）
+def stream_file(file_path: Path, request: Request, filename: Optional[str] = None,
+                meta: Optional[FileMeta] = None, max_bytes: Optional[int] = None):
+    meta = meta or stat_cache.lookup(file_path)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="文件不存在")
     range_header = request.headers.get("Range")
+    logger.info(f"Streaming file: {file_path.name}, Content-Type: {meta.content_type}, Range: {range_header}")
+    return serve_file(
+        request, file_path,
+        media_type=meta.content_type,
+        filename=filename,
+        etag=meta.etag,
+        stat_result=meta.stat,
+        max_bytes=max_bytes,
+        cache_control=FILE_CACHE_CONTROL
+    )
 
-    # 定义文件流生成器
-    def file_iterator(start, end):
-        with open(file_path, "rb") as f:
-            f.seek(start)
-            chunk_size = 512 * 1024  # 512KB 的块大小
-            position = start
-
-            while position <= end:
-                bytes_to_read = min(chunk_size, end - position + 1)
-                data = f.read(bytes_to_read)
-                if not data:
-                    break
-                yield data
-                position += bytes_to_read
-
-    if not range_header:
-        # 如果是媒体文件但没有Range请求，使用206响应并流式传输前几MB
-        if is_video_file(file_path.name) or is_audio_file(file_path.name):
-            initial_chunk = 2 * 1024 * 1024  # 2MB 初始块
-            end = min(initial_chunk - 1, file_size - 1)
-
-            headers = {
-                "Content-Length": str(end + 1),
-                "Content-Type": content_type,
-                "Accept-Ranges": "bytes",
-                "Content-Range": f"bytes 0-{end}/{file_size}"
-            }
-            return StreamingResponse(
-                file_iterator(0, end),
-                status_code=206,
-                headers=headers
-            )
-        # 非媒体文件使用普通流式响应
-        else:
-            headers = {
-                "Content-Length": str(file_size),
-                "Content-Type": content_type,
-                "Accept-Ranges": "bytes",
-            }
-            return StreamingResponse(
-                file_iterator(0, file_size - 1),
-                status_code=200,
-                headers=headers
-            )
 
-    # 处理Range请求
-    start, end = 0, file_size - 1
-    range_str = range_header.replace("bytes=", "")
-    if "-" in range_str:
-        start_str, end_str = range_str.split("-")
-        start = int(start_str) if start_str else 0
-        end = int(end_str) if end_str else file_size - 1
-        end = min(end, file_size - 1)
-
-    # 合理优化块大小 - 现在由生成器控制
-    chunk_size = end - start + 1
-
-    headers = {
-        "Content-Range": f"bytes {start}-{end}/{file_size}",
-        "Accept-Ranges": "bytes",
-        "Content-Length": str(chunk_size),
-        "Content-Type": content_type,
-    }
-    logger.info(f"Range: {start}-{end}, Total size: {file_size}")
+# 存储目录的持久化元数据索引
+file_index = FileIndex(FILE_STORAGE_PATH, media_type_func=get_media_type, exclude=(CAS_DIR_NAME,))
+content_store = ContentStore(FILE_STORAGE_PATH, enabled=bool(load_dedup_settings().get("enabled", False)))
+
+
+thumbnail_service = ThumbnailService()
+hls_service = HLSService()
+media_probe = MediaProbe(FILE_STORAGE_PATH)
+# 批量映射：每对源目录/目标目录保存清单，重复映射时只处理变化的文件
+bulk_mapper = BulkMapper()
+# 映射源（及下载、桌面目录）的文件索引，检查上传文件能否从本地映射时使用
+source_index = SourceIndex()
+# 映射源作为只读文件夹显示在 mounts/ 下，直接读取源目录中的文件
+virtual_mounts = VirtualMounts(media_type_func=get_media_type)
+virtual_mounts.set_sources(LOCAL_FILE_SOURCES, enabled=load_virtual_mounts_settings().get("enabled", False))
+# 长时间操作（批量映射、删除文件夹、合并上传、WebDAV 下载）作为后台任务执行
+job_manager = JobManager()
+
+# 浏览器通常无法直接播放、需要转为 HLS 的视频容器
+HLS_EXTENSIONS = {".mkv", ".avi", ".flv", ".ts", ".3gp"}
+
+
+# 辅助函数：新入库的媒体文件在后台预生成缩略图并探测媒体信息（需在事件循环中调用）
+def schedule_media_processing(path: Path):
+    media_type = get_media_type(path.name)
+    if media_type in (MediaType.VIDEO, MediaType.AUDIO):
+        thumbnail_service.enqueue(str(path), media_type)
+    rel_path = file_index.to_relative(path)
+    if rel_path:
+        media_probe.enqueue(rel_path, media_type)
+
+
+# 应用的事件循环（启动时记录），后台任务线程通过它安排媒体处理
+event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+# 辅助函数：在后台任务线程中安排媒体处理（转回事件循环执行）
+def schedule_media_processing_threadsafe(path: Path):
+    if event_loop is None or event_loop.is_closed():
+        return
+    event_loop.call_soon_threadsafe(schedule_media_processing, path)
+
+
+# 辅助函数：同步刷新索引中的路径（不依赖文件系统监听器）
+def refresh_index(path: Path):
+    try:
+        file_index.update_path(path)
+    except Exception as e:
+        logger.error(f"刷新文件索引失败: {path} - {str(e)}")
+
+
+# 辅助函数：把新入库的文件加入去重存储（未启用时不做任何事），失败不影响入库本身
+def dedup_file(path: Path, digest: Optional[str] = None):
+    if not content_store.enabled:
+        return None
+    try:
+        return content_store.ingest(path, digest)
+    except Exception as e:
+        logger.error(f"去重处理失败: {path} - {str(e)}")
+        return None
+
+
+# 辅助函数：删除文件或文件夹后移除对应的媒体信息
+def forget_media_meta(path: Path):
+    rel_path = file_index.to_relative(path)
+    if rel_path:
+        media_probe.forget(rel_path)
 
-    return StreamingResponse(
-        file_iterator(start, end),
-        status_code=206,
-        headers=headers
-    )
+
+# 辅助函数：把存储相对路径转换为实际文件路径（外部目录下的路径解析到源目录中的文件）
+def resolve_storage_path(path: str) -> Path:
+    if virtual_mounts.is_virtual(path):
+        real_path = virtual_mounts.resolve(path)
+        if real_path is None:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        return real_path
+    return FILE_STORAGE_PATH / path
+
+
+# 辅助函数：外部目录是只读的，拒绝在其中创建、修改或删除文件
+def ensure_writable(path: str):
+    if virtual_mounts.is_virtual(path):
+        raise HTTPException(status_code=403, detail="外部目录为只读，无法修改")
 
 
 # 同步保存文件的函数（在线程池中运行）
@@ -420,55 +608,184 @@ def save_file_sync(file_path: Path, content: bytes):
     file_path.parent.mkdir(parents=True, exist_ok=True)
     with open(file_path, "wb") as f:
         f.write(content)
+    if content_store.enabled:
+        dedup_file(file_path, hashlib.sha256(content).hexdigest())
+    refresh_index(file_path)
     logger.info(f"File saved: {file_path}")
 
 
 # 同步删除文件的函数（在线程池中运行）
 def delete_file_sync(file_path: Path):
     file_path.unlink()
+    content_store.forget(file_path)
+    forget_media_meta(file_path)
+    refresh_index(file_path)
     logger.info(f"File deleted: {file_path}")
 
 
 # 同步创建文件夹的函数（在线程池中运行）
 def create_folder_sync(folder_path: Path):
     folder_path.mkdir(parents=True, exist_ok=True)
+    refresh_index(folder_path)
     logger.info(f"Folder created: {folder_path}")
 
 
-# 同步删除文件夹的函数（在线程池中运行）
-def delete_folder_sync(folder_path: Path):
-    shutil.rmtree(folder_path)
-    logger.info(f"Folder deleted: {folder_path}")
-
+# 后台任务：删除文件夹（逐个删除文件，汇报进度，可以取消）
+def delete_folder_job(ctx, folder_path: str):
+    target_path = FILE_STORAGE_PATH / folder_path
+    if not target_path.is_dir():
+        raise JobError(f"文件夹 '{folder_path}' 不存在")
 
-# 辅助函数: 获取所有文件和文件夹
-def get_files_and_folders(directory_path: Path, relative_to: Path = None):
-    if relative_to is None:
-        relative_to = directory_path
+    total = 0
+    for _, _, files in os.walk(target_path):
+        ctx.check_canceled()
+        total += len(files)
+    ctx.progress(files_total=total, force=True)
 
-    items = []
-    for item_path in directory_path.iterdir():
-        relative_path = item_path.relative_to(relative_to)
-        if item_path.is_dir():
-            items.append({
-                "name": item_path.name,
-                "path": str(relative_path),
-                "type": "folder",
-                "children": get_files_and_folders(item_path, relative_to)
-            })
+    deleted = 0
+    try:
+        for root, dirs, files in os.walk(target_path, topdown=False):
+            for name in files:
+                ctx.check_canceled()
+                os.unlink(os.path.join(root, name))
+                deleted += 1
+                ctx.progress(files_done=deleted)
+            for name in dirs:
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    os.unlink(path)
+                else:
+                    os.rmdir(path)
+        os.rmdir(target_path)
+    except BaseException:
+        # 取消或失败时只同步索引，保留剩余文件的去重和媒体信息
+        refresh_index(target_path)
+        raise
+    content_store.forget(target_path)
+    forget_media_meta(target_path)
+    refresh_index(target_path)
+    logger.info(f"Folder deleted: {target_path}")
+    return {"message": f"文件夹 {folder_path} 删除成功", "deleted": deleted}
+
+
+# 辅助函数：把索引记录转换为文件列表项
+def index_row_to_item(row, readonly=False):
+    path, name, is_dir, size, mtime, media_type = row
+    if is_dir:
+        item = {
+            "name": name,
+            "path": path,
+            "type": "folder",
+            "mtime": mtime,
+            "children": []
+        }
+    else:
+        item = {
+            "name": name,
+            "path": path,
+            "type": "file",
+            "media_type": media_type,
+            "size": size,
+            "mtime": mtime,
+            "is_video": media_type == MediaType.VIDEO,
+            "is_audio": media_type == MediaType.AUDIO,
+            "is_image": media_type == MediaType.IMAGE
+        }
+    if readonly:
+        item["readonly"] = True
+    return item
+
+
+# 辅助函数：为文件列表项附加已探测的媒体信息，尚未探测的文件加入后台队列
+def attach_media_meta(items):
+    files = []
+    for item in items:
+        if item["type"] == "folder":
+            attach_media_meta(item.get("children") or [])
+        elif item.get("readonly"):
+            # 外部目录中的文件不在存储目录内，不探测媒体信息
+            continue
+        elif item.get("media_type") in PROBERS:
+            files.append(item)
+    metas = media_probe.get_many([(item["path"], item["size"], item["mtime"]) for item in files])
+    for item in files:
+        meta = metas.get(item["path"])
+        if meta is not None:
+            item["meta"] = meta
         else:
-            media_type = get_media_type(item_path.name)
-            items.append({
-                "name": item_path.name,
-                "path": str(relative_path),
-                "type": "file",
-                "media_type": media_type,
-                "size": item_path.stat().st_size,
-                "is_video": media_type == MediaType.VIDEO,
-                "is_audio": media_type == MediaType.AUDIO,
-                "is_image": media_type == MediaType.IMAGE
-            })
-    return items
+            media_probe.enqueue(item["path"], item["media_type"])
+
+
+# 辅助函数：列出目录的直接子项（索引首次扫描完成前先浅扫描该目录）
+def list_index_children(rel_path: str):
+    if virtual_mounts.is_virtual(rel_path):
+        return [index_row_to_item(row, readonly=True) for row in virtual_mounts.list_children(rel_path) or []]
+    if not file_index.is_ready():
+        file_index.scan_directory(rel_path, recursive=False)
+    return [index_row_to_item(row) for row in file_index.list_children(rel_path)]
+
+
+# 辅助函数：为文件夹填充子项，depth 为剩余展开层数（小于等于 0 表示不限层数）
+def fill_children(items, depth: int):
+    if depth == 1:
+        return
+    for item in items:
+        if item["type"] == "folder":
+            item["children"] = list_index_children(item["path"])
+            fill_children(item["children"], depth - 1)
+
+
+# 辅助函数：编码/解码列表分页游标
+def encode_list_cursor(row, sort: str) -> str:
+    path, name, is_dir, size, mtime, media_type = row
+    key = {"name": name, "size": size, "mtime": mtime}[sort]
+    raw = json.dumps([sort, is_dir, key, path], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_list_cursor(cursor: str, sort: str):
+    try:
+        cursor_sort, is_dir, key, path = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    if cursor_sort != sort:
+        raise HTTPException(status_code=400, detail="分页游标与排序字段不匹配")
+    return is_dir, key, path
+
+
+# 辅助函数：分页列出目录内容
+def list_directory_page(rel_path: str, depth: int, sort: str, order: str,
+                        media_type: Optional[str], limit: int, cursor: Optional[str]):
+    after = decode_list_cursor(cursor, sort) if cursor else None
+    if virtual_mounts.is_virtual(rel_path):
+        page = virtual_mounts.list_page(
+            rel_path, sort=sort, order=order, media_type=media_type, limit=limit, after=after
+        )
+        if page is None:
+            raise HTTPException(status_code=404, detail=f"目录 '{rel_path}' 不存在")
+        rows, total = page
+        items = [index_row_to_item(row, readonly=True) for row in rows]
+    else:
+        if not file_index.is_ready():
+            file_index.scan_directory(rel_path, recursive=False)
+
+        rows, total = file_index.list_page(
+            rel_path, sort=sort, order=order, media_type=media_type, limit=limit, after=after
+        )
+        items = [index_row_to_item(row) for row in rows]
+        if rel_path == "" and virtual_mounts.enabled and media_type in (None, "folder"):
+            # 外部目录显示在存储根目录的第一页（存储中的同名文件夹被其覆盖）
+            items = [item for item in items if item["path"] != virtual_mounts.dir_name]
+            if cursor is None:
+                items.insert(0, index_row_to_item(virtual_mounts.root_row(), readonly=True))
+                total += 0 if (FILE_STORAGE_PATH / virtual_mounts.dir_name).is_dir() else 1
+    fill_children(items, depth)
+    attach_media_meta(items)
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_list_cursor(rows[-1], sort)
+    return items, total, next_cursor
 
 
 # 路由：主页，显示文件列表
@@ -488,22 +805,36 @@ async def list_files(request: Request):
 
 
 # API路由: 获取文件和文件夹列表
-@app.get("/api/files", response_class=JSONResponse)
+@app.get("/api/files")
 async def api_list_files(
     path: str = "",
+    depth: int = Query(1, description="展开层数，小于等于 0 表示完整递归"),
+    limit: int = Query(500, ge=1, le=5000),
+    cursor: Optional[str] = None,
+    sort: str = Query("name", pattern="^(name|size|mtime)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    media_type: Optional[str] = Query(None, pattern="^(video|audio|image|document|other|folder)$"),
     current_user: dict = Depends(get_current_user)
 ):
     if not current_user:
         raise HTTPException(status_code=401, detail="未授权访问，请先登录")
-    target_path = FILE_STORAGE_PATH / path if path else FILE_STORAGE_PATH
-    if not target_path.exists() or not target_path.is_dir():
-        raise HTTPException(status_code=404, detail=f"目录 '{path}' 不存在")
+    # 外部目录直接列出源目录的内容
+    rel_path = virtual_mounts.relative(path)
+    if rel_path is None:
+        target_path = FILE_STORAGE_PATH / path if path else FILE_STORAGE_PATH
+        if not target_path.exists() or not target_path.is_dir():
+            raise HTTPException(status_code=404, detail=f"目录 '{path}' 不存在")
 
-    # 确保目标路径是FILE_STORAGE_PATH的子目录
-    if not str(target_path).startswith(str(FILE_STORAGE_PATH)):
-        raise HTTPException(status_code=403, detail="无权访问该路径")
+        # 确保目标路径是FILE_STORAGE_PATH的子目录
+        rel_path = file_index.to_relative(target_path)
+        if not str(target_path).startswith(str(FILE_STORAGE_PATH)) or rel_path is None:
+            raise HTTPException(status_code=403, detail="无权访问该路径")
 
-    files_and_folders = get_files_and_folders(target_path, FILE_STORAGE_PATH)
+    loop = asyncio.get_running_loop()
+    files_and_folders, total, next_cursor = await loop.run_in_executor(
+        executor,
+        partial(list_directory_page, rel_path, depth, sort, order, media_type, limit, cursor)
+    )
 
     # 分类信息
     categories = {
@@ -517,23 +848,84 @@ async def api_list_files(
     # 填充分类信息
     for item in files_and_folders:
         if item["type"] == "file":
-            media_type = item.get("media_type", "other")
-            if media_type == MediaType.VIDEO:
+            item_media_type = item.get("media_type", "other")
+            if item_media_type == MediaType.VIDEO:
                 categories["videos"].append(item)
-            elif media_type == MediaType.AUDIO:
+            elif item_media_type == MediaType.AUDIO:
                 categories["audios"].append(item)
-            elif media_type == MediaType.IMAGE:
+            elif item_media_type == MediaType.IMAGE:
                 categories["images"].append(item)
-            elif media_type == MediaType.DOCUMENT:
+            elif item_media_type == MediaType.DOCUMENT:
                 categories["documents"].append(item)
             else:
                 categories["others"].append(item)
 
-    return {
+    # 列表由接口自行构建，直接序列化，跳过 jsonable_encoder
+    return FastJSONResponse({
         "items": files_and_folders,
         "categories": categories,
-        "current_path": path
-    }
+        "current_path": path,
+        "total": total,
+        "next_cursor": next_cursor
+    })
+
+
+# 辅助函数：在索引中搜索文件和文件夹
+def search_index(q: str, media_type: Optional[str], min_size: Optional[int], max_size: Optional[int],
+                 modified_after: Optional[float], modified_before: Optional[float],
+                 path_prefix: str, limit: int, offset: int):
+    rows = file_index.search(
+        q, media_type=media_type, min_size=min_size, max_size=max_size,
+        modified_after=modified_after, modified_before=modified_before,
+        path_prefix=path_prefix, limit=limit + 1, offset=offset
+    )
+    items = [index_row_to_item(row) for row in rows[:limit]]
+    attach_media_meta(items)
+    return items, len(rows) > limit
+
+
+# API路由: 按名称搜索整个存储目录
+@app.get("/api/search")
+async def api_search(
+    q: str = Query(..., min_length=1, max_length=200),
+    path: str = "",
+    media_type: Optional[str] = Query(None, pattern="^(video|audio|image|document|other|folder)$"),
+    min_size: Optional[int] = Query(None, ge=0),
+    max_size: Optional[int] = Query(None, ge=0),
+    modified_after: Optional[float] = None,
+    modified_before: Optional[float] = None,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0, le=SEARCH_CANDIDATES),
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="搜索关键词不能为空")
+
+    path_prefix = ""
+    if path:
+        target_path = FILE_STORAGE_PATH / path
+        path_prefix = file_index.to_relative(target_path)
+        if not str(target_path).startswith(str(FILE_STORAGE_PATH)) or path_prefix is None:
+            raise HTTPException(status_code=403, detail="无权访问该路径")
+
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    items, has_more = await loop.run_in_executor(
+        executor,
+        partial(search_index, q, media_type, min_size, max_size,
+                modified_after, modified_before, path_prefix, limit, offset)
+    )
+    return FastJSONResponse({
+        "items": items,
+        "query": q,
+        "offset": offset,
+        "has_more": has_more,
+        # 索引首次扫描完成前结果可能不完整
+        "complete": file_index.is_ready(),
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
 
 
 # API路由: 创建文件夹
@@ -546,6 +938,7 @@ async def create_folder(
         if not current_user:
             raise HTTPException(status_code=401, detail="未授权访问，请先登录")
         folder_path = folder_path.replace('/+', '/').strip('/')
+        ensure_writable(folder_path)
         target_path = FILE_STORAGE_PATH / folder_path
 
         logger.info(f"收到创建文件夹请求: {folder_path}")
@@ -567,6 +960,8 @@ async def create_folder(
         )
         logger.info(f"文件夹创建成功: {folder_path}")
         return {"message": f"文件夹 {folder_path} 创建成功"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"创建文件夹失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"创建文件夹失败: {str(e)}")
@@ -582,6 +977,7 @@ async def delete_folder(
         if not current_user:
             raise HTTPException(status_code=401, detail="未授权访问，请先登录")
         # 确保路径安全
+        ensure_writable(folder_path)
         target_path = FILE_STORAGE_PATH / folder_path
         if not str(target_path).startswith(str(FILE_STORAGE_PATH)):
             raise HTTPException(status_code=403, detail="无权删除此文件夹")
@@ -589,43 +985,40 @@ async def delete_folder(
         if not target_path.exists() or not target_path.is_dir():
             raise HTTPException(status_code=404, detail=f"文件夹 '{folder_path}' 不存在")
 
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(
-            executor,
-            partial(delete_folder_sync, target_path)
-        )
-        return {"message": f"文件夹 {folder_path} 删除成功"}
+        job = job_manager.submit("delete_folder", {"folder_path": folder_path},
+                                 owner=current_user.username, title=f"删除文件夹 {folder_path}")
+        return FastJSONResponse(status_code=202, content={"message": f"正在删除文件夹 {folder_path}", "job": job})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"删除文件夹失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"删除文件夹失败: {str(e)}")
 
 
 # 路由：下载文件
-@app.get("/download/{file_path:path}")
-async def download_file(file_path: str):
-    target_path = FILE_STORAGE_PATH / file_path
-    if not target_path.exists() or not target_path.is_file():
+@app.api_route("/download/{file_path:path}", methods=["GET", "HEAD"])
+async def download_file(file_path: str, request: Request):
+    target_path = resolve_storage_path(file_path)
+    meta = stat_cache.lookup(target_path)
+    if meta is None:
         return {"error": "文件不存在"}
-    return FileResponse(
-        target_path,
-        media_type=mimetypes.guess_type(target_path)[0] or "application/octet-stream",
-        filename=target_path.name
-    )
+    return stream_file(target_path, request, filename=target_path.name, meta=meta)
 
 
 # 路由：流式播放媒体
-@app.get("/stream/{file_path:path}")
+@app.api_route("/stream/{file_path:path}", methods=["GET", "HEAD"])
 async def stream_media(file_path: str, request: Request):
-    target_path = FILE_STORAGE_PATH / file_path
-    if not target_path.exists() or not target_path.is_file():
+    target_path = resolve_storage_path(file_path)
+    meta = stat_cache.lookup(target_path)
+    if meta is None:
         return {"error": "文件不存在"}
-    return stream_file(target_path, request)
+    return stream_file(target_path, request, meta=meta)
 
 
 # 路由：播放页面（显示媒体播放器）
 @app.get("/play/{file_path:path}", response_class=HTMLResponse)
 async def play_media(request: Request, file_path: str):
-    target_path = FILE_STORAGE_PATH / file_path
+    target_path = resolve_storage_path(file_path)
     if not target_path.exists() or not target_path.is_file():
         return HTMLResponse(content="<h1>文件不存在</h1>", status_code=404)
 
@@ -651,6 +1044,10 @@ async def play_media(request: Request, file_path: str):
 
     # 计算 Content-Type 并传递给模板
     content_type = get_content_type(target_path.name)
+    # 浏览器无法直接播放的格式改用 HLS 分段播放
+    hls_url = None
+    if hls_service.available and target_path.suffix.lower() in HLS_EXTENSIONS:
+        hls_url = f"/hls/playlist/{file_path}"
     return templates.TemplateResponse(
         "play.html",
         {
@@ -658,11 +1055,94 @@ async def play_media(request: Request, file_path: str):
             "file_path": file_path,
             "file_name": target_path.name,
             "content_type": content_type,
+            "hls_url": hls_url,
             "is_audio": media_type == MediaType.AUDIO
         }
     )
 
 
+# 批量媒体信息请求模型
+class MediaMetadataRequest(BaseModel):
+    paths: List[str]
+    probe: bool = False  # 为 True 时立即探测尚无记录的文件（最多 MAX_SYNC_PROBES 个）
+
+
+MAX_METADATA_PATHS = 1000
+MAX_SYNC_PROBES = 50
+
+
+# API路由：批量获取媒体信息（时长、分辨率、编码、码率、标签、EXIF）
+@app.post("/api/media/metadata")
+async def get_media_metadata(
+    request: MediaMetadataRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    if len(request.paths) > MAX_METADATA_PATHS:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {MAX_METADATA_PATHS} 个文件")
+
+    def collect():
+        entries, media_types = [], {}
+        for path in request.paths:
+            rel_path = file_index.to_relative(FILE_STORAGE_PATH / path.strip("/"))
+            if not rel_path:
+                continue
+            try:
+                st = (FILE_STORAGE_PATH / rel_path).stat()
+            except OSError:
+                continue
+            media_types[rel_path] = get_media_type(rel_path)
+            entries.append((rel_path, st.st_size, st.st_mtime))
+        metas = media_probe.get_many(entries)
+
+        probed = 0
+        for rel_path, _, _ in entries:
+            if rel_path in metas:
+                continue
+            if request.probe and probed < MAX_SYNC_PROBES:
+                probed += 1
+                meta = media_probe.probe_now(rel_path, media_types[rel_path])
+                if meta is not None:
+                    metas[rel_path] = meta
+            else:
+                media_probe.enqueue(rel_path, media_types[rel_path])
+        return {rel_path: metas.get(rel_path) for rel_path, _, _ in entries}
+
+    loop = asyncio.get_running_loop()
+    items = await loop.run_in_executor(executor, collect)
+    return {"items": items}
+
+
+# 路由：HLS 播放列表（首次请求时探测编码，决定转封装或按分段转码）
+@app.get("/hls/playlist/{file_path:path}")
+async def hls_playlist(file_path: str):
+    target_path = resolve_storage_path(file_path)
+    if not target_path.exists() or not target_path.is_file():
+        raise HTTPException(status_code=404, detail="文件不存在")
+    if get_media_type(target_path.name) != MediaType.VIDEO:
+        raise HTTPException(status_code=400, detail="不是视频文件")
+    try:
+        playlist = await hls_service.get_playlist(target_path)
+    except HLSUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return Response(
+        content=playlist,
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+# 路由：HLS 分段（需要时转码生成）
+@app.api_route("/hls/segments/{key}/{name}", methods=["GET", "HEAD"])
+async def hls_segment(key: str, name: str, request: Request):
+    segment_path = await hls_service.get_segment(key, name)
+    if segment_path is None:
+        raise HTTPException(status_code=404, detail="分段不存在")
+    # 缓存键包含源文件的大小和修改时间，分段内容不会变化
+    return serve_file(request, segment_path, media_type="video/mp2t", cache_control=IMMUTABLE_CACHE_CONTROL)
+
+
 # 路由：上传文件
 @app.post("/upload")
 async def upload_file(
@@ -673,9 +1153,9 @@ async def upload_file(
     try:
         if not current_user:
             raise HTTPException(status_code=401, detail="未授权访问，请先登录")
-        # 确保上传目标路径是安全的
+        # 确保上传目标路径是安全的（外部目录只读）
         target_dir = FILE_STORAGE_PATH / directory
-        if not str(target_dir).startswith(str(FILE_STORAGE_PATH)):
+        if not str(target_dir).startswith(str(FILE_STORAGE_PATH)) or virtual_mounts.is_virtual(directory):
             return {"error": "无权在此位置上传文件"}
 
         # 确保目录存在
@@ -696,6 +1176,8 @@ async def upload_file(
             partial(save_file_sync, file_path, content)
         )
 
+        schedule_media_processing(file_path)
+
         # 确定媒体类型
         media_type = get_media_type(file.filename)
 
@@ -726,8 +1208,8 @@ async def delete_file(
         if not current_user:
             raise HTTPException(status_code=401, detail="未授权访问，请先登录")
         target_path = FILE_STORAGE_PATH / file_path
-        # 安全检查
-        if not str(target_path).startswith(str(FILE_STORAGE_PATH)):
+        # 安全检查（外部目录只读）
+        if not str(target_path).startswith(str(FILE_STORAGE_PATH)) or virtual_mounts.is_virtual(file_path):
             return {"error": "无权删除此文件"}
 
         if not target_path.exists() or not target_path.is_file():
@@ -746,167 +1228,463 @@ async def delete_file(
 
 # API路由：生成直链下载
 @app.get("/api/direct-link/{file_path:path}")
-async def generate_direct_link(request: Request, file_path: str, expires_in: int = 86400):
-    try:
+async def generate_direct_link(
+    request: Request,
+    file_path: str,
+    expires_in: int = Query(86400, ge=60, le=MAX_LINK_EXPIRES),
+    bind_ip: bool = Query(False, description="只允许当前 IP 使用该链接"),
+    max_bytes: Optional[int] = Query(None, ge=1, description="单次请求允许下载的最大字节数"),
+    disposition: str = Query("attachment", pattern="^(attachment|inline)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    rel_path = virtual_mounts.relative(file_path)
+    if rel_path is not None:
+        target_path = resolve_storage_path(file_path)
+    else:
         target_path = FILE_STORAGE_PATH / file_path
-        if not target_path.exists() or not target_path.is_file():
-            raise HTTPException(status_code=404, detail="文件不存在")
+        rel_path = file_index.to_relative(target_path)
+    if rel_path is None:
+        raise HTTPException(status_code=403, detail="无权访问该路径")
+    if not target_path.is_file():
+        raise HTTPException(status_code=404, detail="文件不存在")
 
-        # 生成唯一令牌
-        token = str(uuid.uuid4())
-        # 设置过期时间
-        expiry_time = datetime.now() + timedelta(seconds=expires_in)
-        # 存储直链信息
-        direct_links[token] = (file_path, expiry_time)
+    expiry_time = datetime.now() + timedelta(seconds=expires_in)
+    token, link_id = link_signer.sign(
+        rel_path,
+        expiry_time.timestamp(),
+        ip=request.client.host if bind_ip and request.client else None,
+        max_bytes=max_bytes,
+        download=disposition == "attachment"
+    )
+    direct_link = f"/dl/{token}"
 
-        # 生成直链URL
-        direct_link = f"/dl/{token}"
+    return {
+        "direct_link": direct_link,
+        "full_link": f"{request.base_url}{direct_link[1:]}",
+        "link_id": link_id,
+        "expires_at": expiry_time.isoformat()
+    }
 
-        return {
-            "direct_link": direct_link,
-            "full_link": f"{request.base_url}{direct_link[1:]}",
-            "expires_at": expiry_time.isoformat()
-        }
-    except Exception as e:
-        logger.error(f"生成直链失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"生成直链失败: {str(e)}")
+
+class RevokeLinkRequest(BaseModel):
+    link: str  # 直链令牌，或包含令牌的完整链接
+
+
+# API路由：提前撤销直链
+@app.post("/api/direct-link/revoke")
+async def revoke_direct_link(req: RevokeLinkRequest, current_user: dict = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    token = req.link.rstrip("/").rsplit("/", 1)[-1]
+    try:
+        claims = link_signer.verify(token)
+    except InvalidLink as e:
+        # 已过期的链接无需撤销
+        if e.status_code == 410:
+            return {"success": True, "message": "链接已过期"}
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, link_revocations.revoke, claims["i"], claims["e"])
+    return {"success": True, "message": "链接已撤销", "link_id": claims["i"]}
 
 
 # 直链下载
-@app.get("/dl/{token}")
-async def direct_link_download(token: str):
-    # 检查token是否存在
-    if token not in direct_links:
-        raise HTTPException(status_code=404, detail="链接不存在或已过期")
+@app.api_route("/dl/{token}", methods=["GET", "HEAD"])
+async def direct_link_download(token: str, request: Request):
+    try:
+        claims = link_signer.verify(token)
+    except InvalidLink as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if link_revocations.is_revoked(claims["i"]):
+        raise HTTPException(status_code=410, detail="链接已被撤销")
+    if "ip" in claims and (not request.client or request.client.host != claims["ip"]):
+        raise HTTPException(status_code=403, detail="该链接不允许在当前网络使用")
+
+    target_path = resolve_storage_path(claims["p"])
+    return stream_file(
+        target_path, request,
+        filename=target_path.name if claims.get("d", 1) else None,
+        max_bytes=claims.get("r")
+    )
 
-    file_path, expiry_time = direct_links[token]
 
-    # 检查链接是否过期
-    if datetime.now() > expiry_time:
-        # 移除过期的链接
-        direct_links.pop(token, None)
-        raise HTTPException(status_code=410, detail="链接已过期")
+# 优化view_file路由
+@app.api_route("/view/{file_path:path}", methods=["GET", "HEAD"])
+async def view_file(request: Request, file_path: str):
+    """
+    提供文件的直接预览，适用于图片、音频和视频等媒体文件
+    """
+    target_path = resolve_storage_path(file_path)
 
-    target_path = FILE_STORAGE_PATH / file_path
-    if not target_path.exists() or not target_path.is_file():
-        direct_links.pop(token, None)
+    # 确保目标路径在存储目录内（外部目录中的路径已由 resolve_storage_path 检查）
+    if not virtual_mounts.is_virtual(file_path) and not str(target_path).startswith(str(FILE_STORAGE_PATH)):
+        raise HTTPException(status_code=403, detail="无权访问此文件")
+
+    # 音频/视频和图片等文件统一走支持条件请求和 Range 的文件响应
+    return stream_file(target_path, request)
+
+
+# 路由：按存储路径直接访问文件（替代原来的静态文件挂载）
+@app.api_route("/storage/{file_path:path}", methods=["GET", "HEAD"])
+async def storage_file(request: Request, file_path: str):
+    target_path = resolve_storage_path(file_path)
+    if not virtual_mounts.is_virtual(file_path) and file_index.to_relative(target_path) is None:
         raise HTTPException(status_code=404, detail="文件不存在")
+    return stream_file(target_path, request)
 
-    return FileResponse(
-        target_path,
-        media_type=mimetypes.guess_type(target_path)[0] or "application/octet-stream",
-        filename=target_path.name
-    )
 
+# 路由：静态资源（按 Accept-Encoding 返回预压缩版本，带哈希的地址永久缓存）
+@app.api_route("/static/{asset_path:path}", methods=["GET", "HEAD"])
+async def static_file(request: Request, asset_path: str):
+    asset = static_assets.resolve(asset_path, request.headers.get("accept-encoding"))
+    if asset is None:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    return serve_file(request, asset.path, media_type=asset.content_type, etag=asset.etag,
+                      headers=asset.headers, cache_control=asset.cache_control)
 
-# 定时清理过期的直链
-async def cleanup_expired_links():
-    while True:
-        try:
-            now = datetime.now()
-            expired_tokens = [
-                token for token, (_, expiry) in direct_links.items()
-                if now > expiry
-            ]
-
-            for token in expired_tokens:
-                direct_links.pop(token, None)
-                logger.info(f"已清理过期直链: {token}")
-
-            # 每小时检查一次
-            await asyncio.sleep(3600)
-        except Exception as e:
-            logger.error(f"清理过期直链时出错: {str(e)}")
-            await asyncio.sleep(3600)
 
+# 存储临时分片的目录
+CHUNK_TEMP_DIR = Path("./temp_chunks")
+CHUNK_TEMP_DIR.mkdir(parents=True, exist_ok=True)
 
-async def cleanup_expired_links():
-    while True:
-        try:
-            now = datetime.now()
-            expired_tokens = [
-                token for token, (_, expiry) in direct_links.items()
-                if now > expiry
-            ]
-
-            for token in expired_tokens:
-                direct_links.pop(token, None)
-                logger.info(f"已清理过期直链: {token}")
-
-            # 每小时检查一次
-            await asyncio.sleep(3600)
-        except Exception as e:
-            logger.error(f"清理过期直链时出错: {str(e)}")
-            await asyncio.sleep(3600)
+
+# 上传会话过期时间（小时），超时未更新的会话及其数据会被清理
+UPLOAD_SESSION_TTL_HOURS = 24
+upload_sessions = UploadSessionManager(CHUNK_TEMP_DIR, ttl_hours=UPLOAD_SESSION_TTL_HOURS)
+
+# 每个上传会话允许同时写入的分片数
+MAX_PARALLEL_CHUNKS_PER_SESSION = 4
+chunk_semaphores: Dict[str, asyncio.Semaphore] = {}
+# 上传会话 ID -> 正在执行的合并任务 ID
+upload_jobs: Dict[str, str] = {}
+
+
+# 定义上传会话请求模型
+class UploadSessionRequest(BaseModel):
+    fileName: str
+    directory: str = ""
+    fileSize: int
+    chunkSize: int
+    sha256: Optional[str] = None  # 可选：整个文件的 SHA-256，完成时校验
+    lastModified: Optional[int] = None  # 可选：客户端文件的修改时间，区分同名同大小的不同文件
+
+
+# 辅助函数：获取会话的分片并发信号量
+def get_chunk_semaphore(session_id: str) -> asyncio.Semaphore:
+    semaphore = chunk_semaphores.get(session_id)
+    if semaphore is None:
+        semaphore = chunk_semaphores[session_id] = asyncio.Semaphore(MAX_PARALLEL_CHUNKS_PER_SESSION)
+    return semaphore
+
+
+# 辅助函数：创建或恢复上传会话（会话属于上传用户，其他用户无法续传或完成）
+async def open_upload_session(owner: str, file_name: str, directory: str, file_size: int, chunk_size: int,
+                              sha256: Optional[str] = None, last_modified: Optional[int] = None):
+    directory = directory.strip().replace('\\', '/')
+    ensure_writable(directory)
+    target_dir = FILE_STORAGE_PATH / directory
+    if not str(target_dir).startswith(str(FILE_STORAGE_PATH)):
+        raise HTTPException(status_code=403, detail="无权在此位置上传文件")
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            executor,
+            partial(upload_sessions.create, owner, file_name, directory, file_size, chunk_size, sha256,
+                    last_modified)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-# 添加缓存装饰器
-@lru_cache(maxsize=32)  # 缓存最多32个文件的元数据
-def get_file_metadata(file_path: str):
-    """获取文件元数据并缓存结果"""
-    path = Path(file_path)
-    if not path.exists():
+# 辅助函数：去重存储中已有相同内容时直接创建文件，无需上传数据（秒传）
+async def link_known_content(file_name: str, directory: str, file_size: int, sha256: str):
+    directory = directory.strip().replace('\\', '/')
+    target_path = FILE_STORAGE_PATH / directory / file_name
+    if (not str(target_path).startswith(str(FILE_STORAGE_PATH)) or target_path.exists()
+            or virtual_mounts.is_virtual(directory)):
+        return None
+
+    def link():
+        if not content_store.link_existing(sha256.lower(), file_size, target_path):
+            return False
+        refresh_index(target_path)
+        return True
+
+    loop = asyncio.get_running_loop()
+    try:
+        if not await loop.run_in_executor(executor, link):
+            return None
+    except Exception as e:
+        logger.error(f"秒传失败: {target_path} - {str(e)}")
         return None
+    schedule_media_processing(target_path)
 
-    stat = path.stat()
+    media_type = get_media_type(file_name)
     return {
-        "size": stat.st_size,
-        "mtime": stat.st_mtime,
-        "content_type": get_content_type(path.name),
-        "media_type": get_media_type(path.name)
+        "session_id": None,
+        "complete": True,
+        "deduplicated": True,
+        "message": f"文件 {file_name} 上传成功",
+        "file": {
+            "name": file_name,
+            "path": f"{directory}/{file_name}" if directory else file_name,
+            "media_type": media_type,
+            "size": file_size,
+            "sha256": sha256.lower(),
+            "is_video": media_type == MediaType.VIDEO,
+            "is_audio": media_type == MediaType.AUDIO,
+            "is_image": media_type == MediaType.IMAGE
+        }
     }
 
 
-# 优化view_file路由
-@app.get("/view/{file_path:path}")
-async def view_file(request: Request, file_path: str):
-    """
-    提供文件的直接预览，适用于图片、音频和视频等媒体文件
-    """
-    target_path = FILE_STORAGE_PATH / file_path
-    full_path = str(target_path)
+# 辅助函数：获取当前用户的上传会话，不存在或属于其他用户时返回 404
+def get_upload_session(session_id: str, owner: str):
+    session = upload_sessions.get(session_id)
+    if session is None or session.owner != owner:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    return session
 
-    # 使用缓存检查文件
-    metadata = get_file_metadata(full_path)
-    if not metadata:
-        raise HTTPException(status_code=404, detail="文件不存在")
 
-    # 确保目标路径在存储目录内
-    if not str(target_path).startswith(str(FILE_STORAGE_PATH)):
-        raise HTTPException(status_code=403, detail="无权访问此文件")
+# 辅助函数：把一个分片的数据流按偏移直接写入会话的 .part 文件
+# 同一会话的多个分片可以并行写入，chunk_hash 为可选的 "算法=摘要" 校验值
+async def receive_chunk(session, chunk_index: int, stream, chunk_hash: Optional[str] = None):
+    if chunk_index < 0 or chunk_index >= session.total_chunks:
+        raise HTTPException(status_code=400, detail=f"无效的分片序号: {chunk_index}/{session.total_chunks}")
 
-    # 获取媒体类型
-    media_type = metadata["media_type"]
+    result = {
+        "message": f"分片 {chunk_index + 1}/{session.total_chunks} 上传成功",
+        "chunk_index": chunk_index,
+        "file_id": session.session_id,
+    }
 
-    # 使用ETag和304缓存机制
-    etag = f"\"{hashlib.md5((full_path + str(metadata['mtime'])).encode()).hexdigest()}\""
-    if_none_match = request.headers.get("if-none-match")
+    # 重试已完成的分片时直接返回，避免覆盖已计入文件摘要的数据
+    if session.has_chunk(chunk_index):
+        return result
+    if chunk_index in session.inflight:
+        raise HTTPException(status_code=409, detail=f"分片 {chunk_index + 1} 正在上传")
 
-    if if_none_match and if_none_match == etag:
-        return Response(status_code=304)
+    chunk_hasher, expected_digest = None, None
+    if chunk_hash:
+        try:
+            algorithm, expected_digest = parse_hash_spec(chunk_hash)
+            chunk_hasher = new_hasher(algorithm)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    offset, expected_size = session.chunk_range(chunk_index)
+    part_path = upload_sessions.part_path(session.session_id)
+    loop = asyncio.get_running_loop()
+
+    async with get_chunk_semaphore(session.session_id):
+        if chunk_index in session.inflight:
+            raise HTTPException(status_code=409, detail=f"分片 {chunk_index + 1} 正在上传")
+        session.inflight.add(chunk_index)
+        try:
+            # 分片正好是文件摘要的下一段时，边写入边计算，无需再读回
+            digest_candidate = session.digest_candidate(chunk_index)
+            hashers = [h for h in (chunk_hasher, digest_candidate) if h is not None]
 
-    # 根据媒体类型处理
-    if media_type == MediaType.VIDEO or media_type == MediaType.AUDIO:
-        # 流式传输音频/视频文件
-        response = stream_file(target_path, request)
-        response.headers["ETag"] = etag
-        return response
-    else:
-        # 直接返回文件（适用于图片和其他可直接预览的文件）
-        response = FileResponse(
-            target_path,
-            media_type=metadata["content_type"]
+            fd = await loop.run_in_executor(executor, open_part_file, part_path, session.file_size)
+            try:
+                written = await write_stream_at(
+                    loop, executor, fd, hashing_stream(stream, *hashers), offset, expected_size
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            finally:
+                os.close(fd)
+
+            if written != expected_size:
+                raise HTTPException(status_code=400, detail=f"分片大小不匹配: 预期 {expected_size} 字节，实际 {written} 字节")
+            if chunk_hasher is not None and chunk_hasher.hexdigest() != expected_digest:
+                raise HTTPException(status_code=400, detail=f"分片 {chunk_index + 1} 校验失败，请重新上传")
+
+            session.commit_digest(chunk_index, digest_candidate)
+            await loop.run_in_executor(executor, upload_sessions.mark_received, session, chunk_index)
+            await loop.run_in_executor(executor, session.advance_digest, part_path)
+        finally:
+            session.inflight.discard(chunk_index)
+
+    logger.info(f"已接收分片 {chunk_index + 1}/{session.total_chunks} - 文件: {session.file_name}")
+    return result
+
+
+# 辅助函数：所有分片到齐后提交合并任务（校验摘要并把 .part 文件原子地移动到目标位置）
+async def finish_upload_session(session, owner):
+    missing = session.missing_chunks()
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail=f"缺少 {len(missing)} 个分片，首个缺失分片: {missing[0] + 1}/{session.total_chunks}"
         )
-        response.headers["ETag"] = etag
-        return response
+
+    if session.inflight:
+        raise HTTPException(status_code=409, detail="仍有分片正在上传")
+
+    # 重复提交时返回正在执行的合并任务
+    job_id = upload_jobs.get(session.session_id)
+    job = job_manager.get(job_id) if job_id else None
+    if job is not None and job["state"] in ACTIVE_STATES:
+        return job
+
+    file_name, directory = session.file_name, session.directory
+    target_path = FILE_STORAGE_PATH / directory / file_name
+
+    # 检查文件是否已存在
+    if target_path.exists():
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, upload_sessions.abort, session.session_id)
+        chunk_semaphores.pop(session.session_id, None)
+        raise HTTPException(status_code=409, detail=f"文件 {file_name} 已存在")
+
+    job = job_manager.submit("finish_upload", {"session_id": session.session_id},
+                             owner=owner, title=f"合并上传 {file_name}")
+    upload_jobs[session.session_id] = job["id"]
+    return job
+
+
+# 后台任务：校验并合并上传的文件
+def finish_upload_job(ctx, session_id: str):
+    try:
+        session = upload_sessions.get(session_id)
+        if session is None:
+            raise JobError("上传会话不存在或已过期")
+        file_name, directory = session.file_name, session.directory
+        target_path = FILE_STORAGE_PATH / directory / file_name
+        ctx.progress(bytes_total=session.file_size, force=True)
+
+        if target_path.exists():
+            upload_sessions.abort(session_id)
+            raise JobError(f"文件 {file_name} 已存在")
+
+        # 整个文件的摘要在接收分片时已增量计算，这里只补齐乱序到达的部分
+        digest = session.file_digest(upload_sessions.part_path(session_id))
+        if session.expected_sha256 and digest != session.expected_sha256:
+            upload_sessions.abort(session_id)
+            raise JobError("文件校验失败，SHA-256 不匹配，请重新上传")
+
+        # 合并开始后不再响应取消
+        ctx.check_canceled()
+        upload_sessions.finalize(session, target_path)
+        dedup_file(target_path, digest)
+        refresh_index(target_path)
+    finally:
+        upload_jobs.pop(session_id, None)
+    chunk_semaphores.pop(session_id, None)
+    logger.info(f"文件 {file_name} 上传完成，总大小: {session.file_size} 字节, SHA-256: {digest}")
+    schedule_media_processing_threadsafe(target_path)
+    ctx.progress(bytes_done=session.file_size, force=True)
+
+    # 确定媒体类型
+    media_type = get_media_type(file_name)
+
+    return {
+        "message": f"文件 {file_name} 上传成功",
+        "file": {
+            "name": file_name,
+            "path": f"{directory}/{file_name}" if directory else file_name,
+            "media_type": media_type,
+            "size": session.file_size,
+            "sha256": digest,
+            "is_video": media_type == MediaType.VIDEO,
+            "is_audio": media_type == MediaType.AUDIO,
+            "is_image": media_type == MediaType.IMAGE
+        }
+    }
+
+
+# API路由：创建（或恢复）上传会话，返回已接收的分片
+@app.post("/api/upload/sessions")
+async def create_upload_session(
+    request: UploadSessionRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    if request.sha256 and content_store.enabled:
+        linked = await link_known_content(request.fileName, request.directory, request.fileSize, request.sha256)
+        if linked:
+            return linked
+    session = await open_upload_session(
+        current_user.username, request.fileName, request.directory, request.fileSize, request.chunkSize,
+        request.sha256, request.lastModified
+    )
+    return session.to_status()
+
+
+# API路由：查询上传会话状态
+@app.get("/api/upload/sessions/{session_id}")
+async def get_upload_session_status(
+    session_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    return get_upload_session(session_id, current_user.username).to_status()
+
+
+# API路由：上传会话的一个分片（请求体即分片数据）
+@app.put("/api/upload/sessions/{session_id}/chunks/{chunk_index}")
+async def upload_session_chunk(
+    session_id: str,
+    chunk_index: int,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    try:
+        if not current_user:
+            raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+        return await receive_chunk(
+            get_upload_session(session_id, current_user.username), chunk_index, request.stream(),
+            request.headers.get("X-Chunk-Hash")
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"分片上传失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"分片上传失败: {str(e)}")
+
+
+# API路由：完成上传会话
+@app.post("/api/upload/sessions/{session_id}/complete")
+async def complete_upload_session(
+    session_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    try:
+        if not current_user:
+            raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+        job = await finish_upload_session(get_upload_session(session_id, current_user.username),
+                                          current_user.username)
+        return FastJSONResponse(status_code=202, content={"message": "正在合并文件", "job": job})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"完成上传请求处理失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"完成上传请求处理失败: {str(e)}")
 
 
-# 存储临时分片的目录
-CHUNK_TEMP_DIR = Path("./temp_chunks")
-CHUNK_TEMP_DIR.mkdir(parents=True, exist_ok=True)
+# API路由：中止上传会话并删除已上传的数据
+@app.delete("/api/upload/sessions/{session_id}")
+async def abort_upload_session(
+    session_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    get_upload_session(session_id, current_user.username)
+    loop = asyncio.get_running_loop()
+    chunk_semaphores.pop(session_id, None)
+    if not await loop.run_in_executor(executor, upload_sessions.abort, session_id):
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    return {"message": "上传已取消"}
 
 
-# API路由：处理文件分片上传
+# API路由：处理文件分片上传（multipart 表单，兼容旧客户端）
 @app.post("/api/upload/chunk")
 async def upload_chunk(
     file: UploadFile = File(...),
@@ -916,48 +1694,53 @@ async def upload_chunk(
     totalChunks: int = Form(...),
     fileSize: int = Form(...),
     chunkSize: int = Form(...),
+    chunkHash: Optional[str] = Form(None),
+    lastModified: Optional[int] = Form(None),
     current_user: dict = Depends(get_current_user)
 ):
     try:
         if not current_user:
             raise HTTPException(status_code=401, detail="未授权访问，请先登录")
-        # 规范化目录路径
-        directory = directory.strip().replace('\\', '/')
-
-        # 创建文件唯一标识，用于关联所有分片
-        file_id = f"{fileName}_{fileSize}_{directory}"
-        file_id_hash = str(hash(file_id))
-
-        # 创建临时存储分片的目录
-        chunk_dir = CHUNK_TEMP_DIR / file_id_hash
-        chunk_dir.mkdir(parents=True, exist_ok=True)
-
-        # 分片文件路径
-        chunk_path = chunk_dir / f"chunk_{chunkIndex}"
+        session = await open_upload_session(current_user.username, fileName, directory, fileSize, chunkSize,
+                                            last_modified=lastModified)
+        return await receive_chunk(session, chunkIndex, iter_upload_file(file), chunkHash)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"分片上传失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"分片上传失败: {str(e)}")
 
-        # 读取分片内容并保存
-        content = await file.read()
 
-        # 使用线程池异步保存分片
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(
-            executor,
-            partial(save_file_sync, chunk_path, content)
+# API路由：处理文件分片上传（请求体即分片数据，参数在查询字符串中，兼容旧客户端）
+@app.put("/api/upload/chunk")
+async def upload_chunk_raw(
+    request: Request,
+    directory: str = Query(""),
+    fileName: str = Query(...),
+    chunkIndex: int = Query(...),
+    totalChunks: int = Query(...),
+    fileSize: int = Query(...),
+    chunkSize: int = Query(...),
+    chunkHash: Optional[str] = Query(None),
+    lastModified: Optional[int] = Query(None),
+    current_user: dict = Depends(get_current_user)
+):
+    try:
+        if not current_user:
+            raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+        session = await open_upload_session(current_user.username, fileName, directory, fileSize, chunkSize,
+                                            last_modified=lastModified)
+        return await receive_chunk(
+            session, chunkIndex, request.stream(), chunkHash or request.headers.get("X-Chunk-Hash")
         )
-
-        logger.info(f"已接收分片 {chunkIndex + 1}/{totalChunks} - 文件: {fileName}")
-
-        return {
-            "message": f"分片 {chunkIndex + 1}/{totalChunks} 上传成功",
-            "chunk_index": chunkIndex,
-            "file_id": file_id_hash,
-        }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"分片上传失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"分片上传失败: {str(e)}")
 
 
-# API路由：完成分片上传，合并所有分片
+# API路由：完成分片上传（兼容旧客户端）
 @app.post("/api/upload/complete")
 async def complete_upload(
     request: Request,
@@ -976,85 +1759,133 @@ async def complete_upload(
         if not all([fileName, totalChunks, fileSize]):
             raise HTTPException(status_code=400, detail="缺少必要参数")
 
-        # 创建文件唯一标识
-        file_id = f"{fileName}_{fileSize}_{directory}"
-        file_id_hash = str(hash(file_id))
+        session_id = UploadSessionManager.make_session_id(
+            current_user.username, fileName, directory, fileSize, data.get("lastModified")
+        )
+        session = upload_sessions.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="找不到相关分片数据")
+        # 旧客户端需要同步返回结果，等待合并任务结束
+        job = await finish_upload_session(session, current_user.username)
+        job = await asyncio.get_running_loop().run_in_executor(None, job_manager.wait, job["id"])
+        if job["state"] != SUCCEEDED:
+            raise HTTPException(status_code=400, detail=job["error"] or "合并文件失败")
+        return job["result"]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"完成上传请求处理失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"完成上传请求处理失败: {str(e)}")
 
-        # 临时分片目录
-        chunk_dir = CHUNK_TEMP_DIR / file_id_hash
 
-        if not chunk_dir.exists():
-            raise HTTPException(status_code=404, detail="找不到相关分片数据")
+# 定时清理过期的上传会话
+async def cleanup_expired_uploads():
+    while True:
+        try:
+            loop = asyncio.get_running_loop()
+            if coordinator.is_leader:
+                cleaned = await loop.run_in_executor(executor, upload_sessions.cleanup_expired)
+                if cleaned:
+                    logger.info(f"已清理 {cleaned} 个过期上传")
+            for session_id in list(chunk_semaphores):
+                if upload_sessions.get(session_id) is None:
+                    chunk_semaphores.pop(session_id, None)
+        except Exception as e:
+            logger.error(f"清理过期上传时出错: {str(e)}")
+        # 每小时检查一次
+        await asyncio.sleep(3600)
 
-        # 目标文件路径
-        target_dir = FILE_STORAGE_PATH / directory
-        target_dir.mkdir(parents=True, exist_ok=True)
-        target_path = target_dir / fileName
 
-        # 检查文件是否已存在
-        if target_path.exists():
-            # 清理临时分片
-            shutil.rmtree(chunk_dir)
-            raise HTTPException(status_code=409, detail=f"文件 {fileName} 已存在")
+# 后台任务：定期清理去重存储中失效的引用和数据块
+async def cleanup_content_store():
+    while True:
+        # 启动后先等待一段时间，避免与索引首次扫描争抢磁盘
+        await asyncio.sleep(3600)
+        if not content_store.enabled or not coordinator.is_leader:
+            continue
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor, content_store.collect_garbage)
+        except Exception as e:
+            logger.error(f"清理去重存储时出错: {str(e)}")
 
-        # 异步合并分片
+
+# 后台任务：HLS 分段缓存超出上限时淘汰最久未播放的文件
+async def cleanup_hls_cache():
+    while True:
+        await asyncio.sleep(3600)
+        # 多进程部署时只由主进程清理（其他进程正在写入的分段目录最近被访问过，不会被淘汰）
+        if not coordinator.is_leader:
+            continue
         try:
-            # 在单独的线程中执行合并操作
-            def merge_chunks():
-                with open(target_path, 'wb') as target_file:
-                    # 按顺序合并所有分片
-                    for i in range(totalChunks):
-                        chunk_path = chunk_dir / f"chunk_{i}"
-                        if not chunk_path.exists():
-                            raise FileNotFoundError(f"分片 {i + 1}/{totalChunks} 不存在")
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor, hls_service.cleanup, hls_service.active_keys())
+        except Exception as e:
+            logger.error(f"清理 HLS 缓存时出错: {str(e)}")
 
-                        with open(chunk_path, 'rb') as chunk_file:
-                            target_file.write(chunk_file.read())
 
-                # 验证文件大小
-                actual_size = target_path.stat().st_size
-                if actual_size != fileSize:
-                    raise ValueError(f"文件大小不匹配: 预期 {fileSize} 字节，实际 {actual_size} 字节")
+# 去重设置模型
+class DedupSettings(BaseModel):
+    enabled: bool
 
-                # 清理临时分片
-                shutil.rmtree(chunk_dir)
 
-                logger.info(f"文件 {fileName} 合并完成，总大小: {actual_size} 字节")
+# API路由：去重统计（节省的空间、副本最多的内容）
+@app.get("/api/dedup/report")
+async def get_dedup_report(current_user: dict = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, content_store.report)
 
-            # 在线程池中执行合并操作
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(executor, merge_chunks)
 
-            # 确定媒体类型
-            media_type = get_media_type(fileName)
+# API路由：启用或关闭去重（只影响之后入库的文件）
+@app.post("/api/dedup/settings")
+async def update_dedup_settings(
+    settings: DedupSettings,
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    if not save_dedup_settings(settings.dict()):
+        raise HTTPException(status_code=500, detail="保存去重设置失败")
+    content_store.enabled = settings.enabled
+    coordinator.notify("dedup_settings")
+    return {"success": True, "enabled": content_store.enabled}
 
-            return {
-                "message": f"文件 {fileName} 上传成功",
-                "file": {
-                    "name": fileName,
-                    "path": f"{directory}/{fileName}" if directory else fileName,
-                    "media_type": media_type,
-                    "size": fileSize,
-                    "is_video": media_type == MediaType.VIDEO,
-                    "is_audio": media_type == MediaType.AUDIO,
-                    "is_image": media_type == MediaType.IMAGE
-                }
-            }
-        except Exception as e:
-            # 出错时尝试清理
-            try:
-                if target_path.exists():
-                    target_path.unlink()
-            except:
-                pass
 
-            logger.error(f"合并文件失败: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"合并文件失败: {str(e)}")
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"完成上传请求处理失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"完成上传请求处理失败: {str(e)}")
+# 外部目录设置模型
+class VirtualMountsSettings(BaseModel):
+    enabled: bool
+
+
+# API路由：外部目录（映射源以只读文件夹显示在 mounts/ 下）
+@app.get("/api/mounts")
+async def get_virtual_mounts(current_user: dict = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    return {
+        "enabled": virtual_mounts.enabled,
+        "folder": virtual_mounts.dir_name,
+        "mounts": [
+            {"name": name, "source": source, "available": os.path.isdir(source)}
+            for name, source in virtual_mounts.mounts().items()
+        ]
+    }
+
+
+# API路由：启用或关闭外部目录
+@app.post("/api/mounts/settings")
+async def update_virtual_mounts_settings(
+    settings: VirtualMountsSettings,
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    if not save_virtual_mounts_settings(settings.dict()):
+        raise HTTPException(status_code=500, detail="保存外部目录设置失败")
+    coordinator.notify("virtual_mounts")
+    reload_virtual_mounts()
+    return {"success": True, "enabled": virtual_mounts.enabled}
 
 
 # 添加获取系统默认路径的API
@@ -1131,7 +1962,7 @@ async def get_system_default_paths():
 @app.get("/api/mapping-sources")
 async def get_mapping_sources():
     """获取当前配置的映射源列表"""
-    return {"sources": LOCAL_FILE_SOURCES}
+    return FastJSONResponse({"sources": LOCAL_FILE_SOURCES})
 
 
 # 添加 API 路由用于更新映射源列表
@@ -1163,8 +1994,11 @@ async def update_mapping_sources(
         # 更新全局变量
         LOCAL_FILE_SOURCES = valid_sources
 
-        # 保存到配置文件
+        # 保存到配置文件，并通知其他工作进程
         save_mapping_sources(valid_sources)
+        coordinator.notify("mapping_sources")
+        source_index.set_roots(local_search_roots())
+        reload_virtual_mounts()
 
         return {
             "success": True,
@@ -1177,97 +2011,100 @@ async def update_mapping_sources(
         raise HTTPException(status_code=500, detail=f"更新映射源失败: {str(e)}")
 
 
-# API路由：检查文件是否可以从本地映射
-@app.post("/api/check-local-file")
-async def check_local_file(request: LocalFileCheckRequest):
+# 辅助函数：本地映射时搜索的目录（系统下载文件夹、桌面和配置的映射源）
+def local_search_roots():
+    roots = []
     try:
-        # 规范化目录路径
-        directory = request.directory.strip().replace('\\', '/')
-        file_name = request.fileName
-        file_size = request.fileSize
-        last_modified = request.lastModified  # 可选的最后修改时间
-
-        logger.info(f"检查文件是否可以本地映射: {file_name}, 大小: {file_size} 字节")
+        import winreg
+        with winreg.OpenKey(winreg.HKEY_CURRENT_USER,
+                            r"Software\Microsoft\Windows\CurrentVersion\Explorer\Shell Folders") as key:
+            downloads_dir = winreg.QueryValueEx(key, "{374DE290-123F-4565-9164-39C4925E467B}")[0]
+            roots.append(Path(downloads_dir))
+    except Exception:
+        # 回退到常见下载路径
+        user_home = Path.home()
+        roots.append(user_home / "Downloads")
+        roots.append(user_home / "Desktop")
+    roots.extend(Path(path) for path in LOCAL_FILE_SOURCES)
+    return roots
+
+
+# 辅助函数：检查一个上传文件能否从本地映射（在线程池中运行）
+def check_local_match(request: LocalFileCheckRequest):
+    directory = request.directory.strip().replace('\\', '/')
+    file_name = request.fileName
+    file_size = request.fileSize
+
+    # 首先检查目标位置是否已存在该文件
+    target_path = FILE_STORAGE_PATH / directory / file_name
+    try:
+        if target_path.is_file() and target_path.stat().st_size == file_size:
+            return {"canMap": False, "reason": "文件已存在于目标位置"}
+    except OSError:
+        pass
 
-        # 首先检查目标位置是否已存在该文件
-        target_path = FILE_STORAGE_PATH / directory / file_name
-        if target_path.exists() and target_path.is_file():
-            if target_path.stat().st_size == file_size:
-                logger.info(f"文件已存在于目标位置: {target_path}")
-                return {"canMap": False, "reason": "文件已存在于目标位置"}
-
-        # 如果用户提供了本地路径，直接检查该路径
-        if hasattr(request, 'localPath') and request.localPath:
-            local_path = Path(request.localPath)
-            if local_path.exists() and local_path.is_file() and local_path.stat().st_size == file_size:
-                logger.info(f"找到匹配的本地文件: {local_path}")
+    # 如果用户提供了本地路径，直接检查该路径
+    if request.localPath:
+        local_path = Path(request.localPath)
+        try:
+            if local_path.is_file() and local_path.stat().st_size == file_size:
                 return {
                     "canMap": True,
                     "localPath": str(local_path),
                     "sourceDirectory": str(local_path.parent)
                 }
+        except OSError:
+            pass
 
-        # 扩展搜索范围 - 包括常见下载目录
-        common_paths = []
-
-        # 添加系统下载文件夹
-        try:
-            import winreg
-            with winreg.OpenKey(winreg.HKEY_CURRENT_USER,
-                                r"Software\Microsoft\Windows\CurrentVersion\Explorer\Shell Folders") as key:
-                downloads_dir = winreg.QueryValueEx(key, "{374DE290-123F-4565-9164-39C4925E467B}")[0]
-                common_paths.append(Path(downloads_dir))
-        except:
-            # 回退到常见下载路径
-            user_home = Path.home()
-            common_paths.append(user_home / "Downloads")
-            common_paths.append(user_home / "Desktop")
-        LOCAL_FILE_SOURCES = load_mapping_sources()
-
-        # 如果设置了LOCAL_FILE_SOURCES，加入搜索范围 - 这里需要修改
-        if LOCAL_FILE_SOURCES:
-            # 将字符串路径转换为Path对象
-            common_paths.extend([Path(path) for path in LOCAL_FILE_SOURCES])
-
-        # 在常见路径中搜索
-        for search_dir in common_paths:
-            if not isinstance(search_dir, Path):
-                search_dir = Path(search_dir)  # 确保是Path对象
-
-            if not search_dir.exists() or not search_dir.is_dir():
-                continue
+    # 在映射源索引中按文件名和大小查找
+    match = source_index.lookup(file_name, file_size, request.lastModified)
+    if match is None:
+        return {"canMap": False, "reason": "未找到匹配的本地文件"}
+    local_path, source_directory = match
+    return {"canMap": True, "localPath": local_path, "sourceDirectory": source_directory}
 
-            # 首先直接在父目录中查找同名文件
-            direct_match = search_dir / file_name
-            if direct_match.exists() and direct_match.is_file() and direct_match.stat().st_size == file_size:
-                logger.info(f"找到匹配的本地文件: {direct_match}")
-                return {
-                    "canMap": True,
-                    "localPath": str(direct_match),
-                    "sourceDirectory": str(search_dir)
-                }
 
-            # 递归搜索 (限制深度为2，避免搜索时间过长)
-            for path in search_dir.glob('*/*'):
-                if path.is_file() and path.name == file_name and path.stat().st_size == file_size:
-                    # 如果提供了lastModified，进一步验证
-                    if last_modified and abs(path.stat().st_mtime * 1000 - last_modified) > 60000:  # 允许1分钟误差
-                        continue
-
-                    logger.info(f"找到匹配的本地文件: {path}")
-                    return {
-                        "canMap": True,
-                        "localPath": str(path),
-                        "sourceDirectory": str(path.parent)
-                    }
-
-        logger.info(f"未找到匹配的本地文件: {file_name}")
-        return {"canMap": False, "reason": "未找到匹配的本地文件"}
+# API路由：检查文件是否可以从本地映射
+@app.post("/api/check-local-file")
+async def check_local_file(request: LocalFileCheckRequest):
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(executor, check_local_match, request)
+        logger.info(f"检查文件是否可以本地映射: {request.fileName}, 大小: {request.fileSize} 字节 - "
+                    f"{result.get('localPath') or result.get('reason')}")
+        return result
     except Exception as e:
         logger.error(f"检查本地文件映射失败: {str(e)}")
         return {"canMap": False, "reason": str(e)}
 
 
+# API路由：批量检查文件是否可以从本地映射（结果与请求中的文件一一对应）
+@app.post("/api/check-local-files")
+async def check_local_files(
+    request: LocalFileBatchCheckRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    if len(request.files) > MAX_LOCAL_CHECK_FILES:
+        raise HTTPException(status_code=400, detail=f"一次最多检查 {MAX_LOCAL_CHECK_FILES} 个文件")
+
+    def check_all():
+        results = []
+        for item in request.files:
+            try:
+                results.append(check_local_match(item))
+            except Exception as e:
+                results.append({"canMap": False, "reason": str(e)})
+        return results
+
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(executor, check_all)
+    matched = sum(1 for result in results if result["canMap"])
+    logger.info(f"批量检查本地映射: {len(results)} 个文件，{matched} 个可以映射")
+    return FastJSONResponse({"results": results})
+
+
 # API路由：映射本地文件到存储
 @app.post("/api/map-local-file")
 async def map_local_file(
@@ -1279,6 +2116,7 @@ async def map_local_file(
             raise HTTPException(status_code=401, detail="未授权访问，请先登录")
         # 规范化路径
         directory = request.directory.strip().replace('\\', '/')
+        ensure_writable(directory)
         file_name = request.fileName  # 保持原始文件名，包括空格
         local_path = Path(request.localPath)
 
@@ -1332,6 +2170,10 @@ async def map_local_file(
             await loop.run_in_executor(executor, copy_file)
             logger.info(f"已复制文件: {local_path} -> {target_path}")
 
+        await loop.run_in_executor(executor, dedup_file, target_path)
+        await loop.run_in_executor(executor, refresh_index, target_path)
+        schedule_media_processing(target_path)
+
         # 确定媒体类型
         media_type = get_media_type(file_name)
         file_size = local_path.stat().st_size
@@ -1568,10 +2410,11 @@ async def reset_background():
 
 
 @app.get("/api/thumbnail/{media_type}/{path:path}")
-async def get_thumbnail(media_type: str, path: str):
-    """获取媒体文件的缩略图"""
-    # 将URL路径转换为系统路径
-    file_path = os.path.join(FILE_STORAGE_PATH, path)  # 根据您的文件存储路径调整
+async def get_thumbnail(request: Request, media_type: str, path: str, variant: str = Query(DEFAULT_VARIANT),
+                        v: Optional[str] = Query(None, description="文件版本（修改时间-大小），带版本的地址可长期缓存")):
+    """获取媒体文件的缩略图，variant 为尺寸规格（list/grid/retina/poster）"""
+    # 将URL路径转换为系统路径（外部目录中的文件解析到源目录）
+    file_path = str(resolve_storage_path(path))
 
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="文件不存在")
@@ -1579,12 +2422,50 @@ async def get_thumbnail(media_type: str, path: str):
     if media_type not in ["video", "audio"]:
         raise HTTPException(status_code=400, detail="不支持的媒体类型")
 
-    thumbnail_path = get_media_thumbnail(file_path, media_type)
+    if variant not in THUMBNAIL_VARIANTS:
+        raise HTTPException(status_code=400, detail="不支持的缩略图尺寸")
 
-    if not thumbnail_path or not os.path.exists(thumbnail_path):
+    # 在缩略图进程池中生成，同一文件的并发请求共享一个任务
+    result = await thumbnail_service.get_thumbnail_data(file_path, media_type, variant)
+    if result is None:
         raise HTTPException(status_code=404, detail="无法生成缩略图")
 
-    return FileResponse(thumbnail_path)
+    # 缓存键包含文件大小和修改时间，可直接作为 ETag
+    key, data = result
+    headers = {"ETag": f'"{key}"', "Cache-Control": IMMUTABLE_CACHE_CONTROL if v else "private, max-age=300"}
+    if is_not_modified(request, headers["ETag"]):
+        return not_modified_response(headers)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+
+# 后台任务：批量映射源文件夹内容到目标目录（只处理上次映射之后新增或变化的文件）
+def map_contents_job(ctx, source_path: str, target_path: str, include_subfolders: bool = True):
+    source_dir = Path(source_path)
+    if not source_dir.is_dir():
+        raise JobError("源文件夹不存在")
+    target_dir = FILE_STORAGE_PATH / target_path
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    result = bulk_mapper.map_tree(
+        source_dir, target_dir, include_subfolders,
+        progress=lambda current: ctx.progress(files_done=current.scanned),
+        should_stop=lambda: ctx.canceled
+    )
+    if result.mapped or result.updated:
+        refresh_index(target_dir)
+    ctx.check_canceled()
+    ctx.progress(files_done=result.scanned, files_total=result.scanned, force=True)
+
+    mapped_count = result.mapped + result.updated
+    skipped_count = result.skipped + result.unchanged
+    return {
+        "message": f"批量映射完成，共映射 {mapped_count} 个文件，跳过 {skipped_count} 个已存在文件",
+        "mappedCount": mapped_count,
+        "skippedCount": skipped_count,
+        "unchangedCount": result.unchanged,
+        "failedCount": result.failed,
+        "elapsed": result.elapsed
+    }
 
 
 # API路由：批量映射源文件夹内容到目标目录
@@ -1598,74 +2479,25 @@ async def map_all_contents(
         if not current_user:
             raise HTTPException(status_code=401, detail="未授权访问，请先登录")
         source_path = Path(request.sourcePath)
-        print(source_path)
         if not source_path.exists() or not source_path.is_dir():
             raise HTTPException(status_code=404, detail="源文件夹不存在")
 
+        ensure_writable(request.targetPath)
         target_dir = FILE_STORAGE_PATH / request.targetPath
-        target_dir.mkdir(parents=True, exist_ok=True)
-
-        # 计数器
-        mapped_count = 0
-        skipped_count = 0
-
-        # 定义映射函数（将在线程池中执行）
-        def map_files_recursive():
-            nonlocal mapped_count, skipped_count
-
-            # 递归函数来处理文件和子目录
-            def process_directory(src_dir, rel_path=""):
-                nonlocal mapped_count, skipped_count
-
-                # 处理当前目录中的所有文件
-                for item in src_dir.iterdir():
-                    # 计算相对路径
-                    item_rel_path = f"{rel_path}/{item.name}" if rel_path else item.name
-
-                    if item.is_file():
-                        # 创建目标路径
-                        dest_path = target_dir / item_rel_path
-
-                        # 如果目标文件已存在，跳过
-                        if dest_path.exists():
-                            skipped_count += 1
-                            continue
-
-                        # 确保父目录存在
-                        dest_path.parent.mkdir(parents=True, exist_ok=True)
-
-                        try:
-                            # 尝试创建硬链接
-                            try:
-                                # Windows和Linux的硬链接创建方式
-                                os.link(str(item), str(dest_path))
-                                mapped_count += 1
-                            except Exception:
-                                # 如果硬链接失败，回退到复制
-                                shutil.copy2(item, dest_path)
-                                mapped_count += 1
-                        except Exception as e:
-                            logger.error(f"映射文件失败: {str(e)}, 源: {item}, 目标: {dest_path}")
-                            skipped_count += 1
-
-                    # 处理子目录（如果includeSubfolders为True）
-                    elif item.is_dir() and request.includeSubfolders:
-                        process_directory(item, item_rel_path)
-
-            # 开始处理根目录
-            process_directory(source_path)
-            return mapped_count, skipped_count
-
-        # 在线程池中执行映射操作
-        loop = asyncio.get_running_loop()
-        mapped_count, skipped_count = await loop.run_in_executor(executor, map_files_recursive)
-
-        return {
+        if file_index.to_relative(target_dir) is None:
+            raise HTTPException(status_code=403, detail="无权访问该路径")
+
+        job = job_manager.submit(
+            "map_contents",
+            {"source_path": str(source_path), "target_path": request.targetPath,
+             "include_subfolders": request.includeSubfolders},
+            owner=current_user.username, title=f"批量映射 {source_path}"
+        )
+        return FastJSONResponse(status_code=202, content={
             "success": True,
-            "message": f"批量映射完成，共映射 {mapped_count} 个文件，跳过 {skipped_count} 个已存在文件",
-            "mappedCount": mapped_count,
-            "skippedCount": skipped_count
-        }
+            "message": "批量映射任务已提交",
+            "job": job
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -1695,8 +2527,7 @@ async def get_webdav_config():
             "auth_enabled": webdav_server.auth_enabled if webdav_server else True,
             "username": webdav_server.username if webdav_server else "admin",
             "password": "*****",  # 不返回真实密码
-            "status": "running" if (webdav_server and webdav_server.server_thread and
-                                    webdav_server.server_thread.is_alive()) else "stopped",
+            "status": "running" if webdav_running() else "stopped",
             "url": f"http://{get_local_ip()}:{webdav_server.port if webdav_server else 5889}" if webdav_server else None
         }
 
@@ -1708,8 +2539,7 @@ async def get_webdav_config():
                 config["password"] = "*****"
 
             # 添加当前状态信息
-            config["status"] = "running" if (webdav_server and webdav_server.server_thread and
-                                             webdav_server.server_thread.is_alive()) else "stopped"
+            config["status"] = "running" if webdav_running() else "stopped"
             if webdav_server:
                 config["url"] = f"http://{get_local_ip()}:{webdav_server.port}"
 
@@ -1722,8 +2552,6 @@ async def get_webdav_config():
 @app.post("/api/webdav/config")
 async def update_webdav_config(config: WebDAVConfig):
     """更新 WebDAV 服务配置"""
-    global webdav_server
-
     try:
         # 保存配置
         config_file = Path("./config/webdav.conf")
@@ -1732,31 +2560,32 @@ async def update_webdav_config(config: WebDAVConfig):
         with open(config_file, "w", encoding="utf-8") as f:
             json.dump(config_dict, f, ensure_ascii=False, indent=2)
 
-        # 如果 WebDAV 服务器正在运行，停止它
-        if webdav_server:
-            webdav_server.stop()
-            webdav_server = None
+        # WebDAV 服务器只在主进程中运行，由主进程按新配置重启
+        if not coordinator.is_leader:
+            coordinator.notify("webdav_config")
+            return {
+                "message": "WebDAV 配置已更新，服务将由主进程重启",
+                "status": "pending"
+            }
 
-        # 如果启用 WebDAV，创建并启动新的服务器
+        # 按新配置重启（同时带上外部目录的只读共享）
+        start_webdav_server()
+        publish_webdav_status()
+        if webdav_server:
+            return {
+                "message": "WebDAV 配置已更新，服务已重启",
+                "status": "running",
+                "url": f"http://{get_local_ip()}:{webdav_server.port}"
+            }
         if config.enabled:
-            webdav_server = configure_webdav(FILE_STORAGE_PATH)
-            if webdav_server:
-                webdav_server.start()
-                return {
-                    "message": "WebDAV 配置已更新，服务已重启",
-                    "status": "running",
-                    "url": f"http://{get_local_ip()}:{webdav_server.port}"
-                }
-            else:
-                return {
-                    "message": "WebDAV 配置已更新，但服务未能启动",
-                    "status": "stopped"
-                }
-        else:
             return {
-                "message": "WebDAV 配置已更新，服务已停止",
+                "message": "WebDAV 配置已更新，但服务未能启动",
                 "status": "stopped"
             }
+        return {
+            "message": "WebDAV 配置已更新，服务已停止",
+            "status": "stopped"
+        }
     except Exception as e:
         logger.error(f"更新 WebDAV 配置失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"更新 WebDAV 配置失败: {str(e)}")
@@ -1765,6 +2594,94 @@ async def update_webdav_config(config: WebDAVConfig):
 # 在应用初始化后添加
 # 初始化 WebDAV 客户端管理器
 webdav_client_manager = WebDAVConnectionManager()
+# 连接配置变化后通知其他工作进程重新加载
+webdav_client_manager.on_change = lambda: coordinator.notify("webdav_connections")
+
+
+# 辅助函数：WebDAV 服务器是否正在运行（非主进程读取主进程发布的状态）
+def webdav_running():
+    if coordinator.is_leader:
+        return bool(webdav_server and webdav_server.server_thread and webdav_server.server_thread.is_alive())
+    return bool((coordinator.get_state("webdav") or {}).get("running"))
+
+
+def publish_webdav_status():
+    coordinator.set_state("webdav", {"running": webdav_running(), "owner": coordinator.worker_id})
+
+
+# 辅助函数：按配置文件（重新）启动 WebDAV 服务器，只在主进程中调用
+def start_webdav_server():
+    global webdav_server
+    if webdav_server and webdav_server.server_thread:
+        webdav_server.stop()
+    webdav_server = configure_webdav(FILE_STORAGE_PATH, mounts_dir=virtual_mounts.dir_name,
+                                     mounts=virtual_mounts.mounts())
+    if webdav_server:
+        webdav_server.start()
+        logger.info(f"WebDAV 服务启动在 http://{get_local_ip()}:{webdav_server.port}")
+        logger.info(f"WebDAV 凭据 - 用户名: {webdav_server.username}, 密码: {webdav_server.password}")
+    publish_webdav_status()
+
+
+def stop_webdav_server():
+    if webdav_server and webdav_server.server_thread:
+        webdav_server.stop()
+    # 只清除自己发布的状态（新的主进程可能已经启动了 WebDAV 服务器）
+    if (coordinator.get_state("webdav") or {}).get("owner") == coordinator.worker_id:
+        coordinator.set_state("webdav", {"running": False, "owner": coordinator.worker_id})
+
+
+# 主进程负责的单例服务：WebDAV 服务器、目录监听和全量校对
+def start_leader_services():
+    file_index.start_watching()
+    start_webdav_server()
+    source_index.refresh_soon()
+
+
+def stop_leader_services():
+    file_index.stop_watching()
+    stop_webdav_server()
+
+
+# 其他工作进程修改配置后，在本进程中重新加载
+def reload_mapping_sources():
+    global LOCAL_FILE_SOURCES
+    LOCAL_FILE_SOURCES = load_mapping_sources()
+    source_index.set_roots(local_search_roots())
+    reload_virtual_mounts()
+
+
+def reload_virtual_mounts():
+    # 挂载表变化后主进程重启 WebDAV 服务器，使共享与之一致
+    previous = virtual_mounts.mounts()
+    virtual_mounts.set_sources(LOCAL_FILE_SOURCES, enabled=load_virtual_mounts_settings().get("enabled", False))
+    if coordinator.is_leader and virtual_mounts.mounts() != previous:
+        start_webdav_server()
+
+
+def reload_dedup_settings():
+    content_store.enabled = bool(load_dedup_settings().get("enabled", False))
+
+
+def reload_webdav_server():
+    if coordinator.is_leader:
+        start_webdav_server()
+
+
+def sync_principal_revocations():
+    for username, revoked_at in (coordinator.get_state("principal_revocations") or {}).items():
+        principal_cache.invalidate(username, revoked_at)
+
+
+def watch_shared_config():
+    coordinator.watch("mapping_sources", reload_mapping_sources)
+    coordinator.watch("dedup_settings", reload_dedup_settings)
+    coordinator.watch("virtual_mounts", reload_virtual_mounts)
+    coordinator.watch("webdav_config", reload_webdav_server)
+    coordinator.watch("webdav_connections", webdav_client_manager.load_connections)
+    coordinator.watch("principal_revocations", sync_principal_revocations)
+    # 其他进程（或重启前）记录的令牌失效时间
+    sync_principal_revocations()
 
 
 # 添加 WebDAV 客户端数据模型
@@ -1917,7 +2834,7 @@ async def list_webdav_files(connection_name: str, path: str = Query("/")):
             raise HTTPException(status_code=404, detail=f"连接 '{connection_name}' 不存在")
 
         files = connection.list_files(path)
-        return files
+        return FastJSONResponse(files)
     except HTTPException:
         raise
     except Exception as e:
@@ -1925,6 +2842,32 @@ async def list_webdav_files(connection_name: str, path: str = Query("/")):
         raise HTTPException(status_code=500, detail=f"列出 WebDAV 文件失败: {str(e)}")
 
 
+# 后台任务：从 WebDAV 下载文件到系统存储（先写入临时文件，完成后再移动到目标位置）
+def webdav_download_job(ctx, connection_name: str, path: str, target_path: str):
+    connection = webdav_client_manager.get_connection(connection_name)
+    if not connection:
+        raise JobError(f"连接 '{connection_name}' 不存在")
+
+    local_path = FILE_STORAGE_PATH / target_path
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = local_path.with_name(f".{local_path.name}.{ctx.job_id}.download")
+
+    def on_progress(current, total):
+        ctx.check_canceled()
+        ctx.progress(bytes_done=min(current, total) if total else current, bytes_total=total)
+
+    try:
+        connection.download_file(path, str(tmp_path), progress=on_progress)
+        os.replace(tmp_path, local_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    dedup_file(local_path)
+    refresh_index(local_path)
+    schedule_media_processing_threadsafe(local_path)
+    return {"message": "文件已下载", "path": target_path}
+
+
 @app.post("/api/webdav-client/{connection_name}/download")
 async def download_from_webdav(
     connection_name: str,
@@ -1944,20 +2887,21 @@ async def download_from_webdav(
         filename = os.path.basename(path)
         target_path = os.path.normpath(os.path.join(target_folder, filename))
         target_path = target_path.replace("\\", "/").lstrip("/")  # 规范化路径
-
-        local_path = FILE_STORAGE_PATH / target_path
-
-        # 确保目标目录存在
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-
-        # 下载文件
-        connection.download_file(path, local_path)
-
-        return {
+        ensure_writable(target_path)
+        if file_index.to_relative(FILE_STORAGE_PATH / target_path) is None:
+            raise HTTPException(status_code=403, detail="无权访问该路径")
+
+        job = job_manager.submit(
+            "webdav_download",
+            {"connection_name": connection_name, "path": path, "target_path": target_path},
+            owner=current_user.username, title=f"从 {connection_name} 下载 {filename}"
+        )
+        return FastJSONResponse(status_code=202, content={
             "success": True,
-            "message": f"文件已下载",
-            "path": target_path
-        }
+            "message": "下载任务已提交",
+            "path": target_path,
+            "job": job
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -1993,15 +2937,58 @@ async def create_webdav_directory(
         raise HTTPException(status_code=500, detail=f"创建目录失败: {str(e)}")
 
 
+# 辅助函数：按 IP 限制登录/注册频率
+def check_login_throttle(request: Request):
+    retry_after = login_throttle.hit(request.client.host if request.client else "")
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail=f"尝试次数过多，请 {retry_after} 秒后重试",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
+# 辅助函数：在哈希线程池中执行密码哈希/校验，队列已满时返回 503
+async def run_credential_task(func, *args):
+    try:
+        return await credential_hasher.run(func, *args)
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="服务器繁忙，请稍后重试", headers={"Retry-After": "1"})
+
+
+# 辅助函数：校验用户名和密码（在哈希线程池中执行），成功时返回用户身份
+def authenticate_user(username: str, password: str):
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+        if not user:
+            return None
+        valid, new_hash = pwd_context.verify_and_update(password, user.password)
+        if not valid:
+            return None
+        principal = Principal(user.id, user.username)
+        if new_hash:
+            # 哈希参数已升级：用批量更新写入，不触发 after_update 事件，该用户的其他会话保持有效
+            db.query(User).filter(User.id == user.id).update(
+                {User.password: new_hash}, synchronize_session=False
+            )
+            db.commit()
+            logger.info(f"用户密码哈希已升级: {username}")
+        return principal
+    finally:
+        db.close()
+
+
 # 注册接口
 @app.post("/register")
-async def register(username: str = Form(...), password: str = Form(...)):
+async def register(request: Request, username: str = Form(...), password: str = Form(...)):
+    check_login_throttle(request)
     db = SessionLocal()
     try:
         if db.query(User).filter(User.username == username).first():
             raise HTTPException(status_code=400, detail="用户名已存在")
 
-        hashed_password = pwd_context.hash(password)
+        hashed_password = await run_credential_task(pwd_context.hash, password)
         new_user = User(username=username, password=hashed_password)
 
         db.add(new_user)
@@ -2016,25 +3003,31 @@ async def register(username: str = Form(...), password: str = Form(...)):
 
 # 登录接口
 @app.post("/login")
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.username == form_data.username).first()
-        if not user or not pwd_context.verify(form_data.password, user.password):
-            raise HTTPException(status_code=400, detail="用户名或密码错误")
-
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = jwt.encode(
-            {"sub": user.username}, SECRET_KEY, algorithm=ALGORITHM
-        )
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    check_login_throttle(request)
+    user = await run_credential_task(authenticate_user, form_data.username, form_data.password)
+    if not user:
+        raise HTTPException(status_code=400, detail="用户名或密码错误")
+    login_throttle.reset(request.client.host if request.client else "")
+
+    # 令牌中携带用户 ID，验证身份时无需查询数据库；iat 精确到毫秒，用于判断令牌是否已失效
+    issued_at = round(time.time(), 3)
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = jwt.encode(
+        {
+            "sub": user.username,
+            "uid": user.id,
+            "iat": issued_at,
+            "exp": int(issued_at + access_token_expires.total_seconds())
+        },
+        SECRET_KEY, algorithm=ALGORITHM
+    )
 
-        # 设置 cookie 并重定向到首页
-        response = RedirectResponse(url="/", status_code=303)
-        response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True, max_age=1800,
-                            expires=1800)
-        return response
-    finally:
-        db.close()
+    # 设置 cookie 并重定向到首页
+    response = RedirectResponse(url="/", status_code=303)
+    response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True, max_age=1800,
+                        expires=1800)
+    return response
 
 
 @app.delete("/api/webdav-client/{connection_name}/delete")
@@ -2059,6 +3052,121 @@ async def delete_webdav_file(connection_name: str, path: str = Query(...)):
         raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
 
 
+# -------------后台任务-----------------------------
+job_manager.register("map_contents", map_contents_job)
+job_manager.register("delete_folder", delete_folder_job)
+job_manager.register("finish_upload", finish_upload_job)
+job_manager.register("webdav_download", webdav_download_job)
+
+# 事件流轮询任务状态的间隔（秒）
+JOB_EVENT_INTERVAL = 0.5
+# 事件流建立时补发最近多长时间内（秒）有变化的任务，避免错过刚刚结束的任务
+JOB_EVENT_BACKLOG = 300
+# 没有任务变化时发送心跳的间隔（秒），防止代理断开空闲连接
+JOB_EVENT_KEEPALIVE = 15
+
+
+@app.get("/api/jobs")
+async def list_jobs(
+    active: bool = False,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    return FastJSONResponse({"jobs": job_manager.list(current_user.username, active_only=active, limit=limit)})
+
+
+# 任务事件流（Server-Sent Events）：每次任务状态或进度变化时推送 event: job
+@app.get("/api/jobs/events")
+async def job_events(
+    request: Request,
+    job_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    owner = current_user.username
+    # 断线重连时从上次收到的事件序号继续；新连接补发最近一段时间内有变化的任务
+    updated_after = None
+    try:
+        since = int(request.headers.get("last-event-id") or "")
+    except ValueError:
+        since = 0
+        updated_after = time.time() - JOB_EVENT_BACKLOG
+
+    async def event_stream():
+        nonlocal since, updated_after
+        yield "retry: 3000\n\n"
+        last_sent = time.monotonic()
+        while not await request.is_disconnected():
+            # 查询在线程中执行，不占用事件循环
+            if updated_after is not None:
+                # 之后只需要取此刻之后的变化
+                latest = await asyncio.to_thread(job_manager.latest_seq)
+                changed = await asyncio.to_thread(job_manager.changed_since, owner, 0, job_id, updated_after)
+                since, updated_after = latest, None
+            else:
+                changed = await asyncio.to_thread(job_manager.changed_since, owner, since, job_id)
+            for job in changed:
+                since = max(since, job["seq"])
+                yield f"id: {job['seq']}\nevent: job\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if changed:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= JOB_EVENT_KEEPALIVE:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            await asyncio.sleep(JOB_EVENT_INTERVAL)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    job = job_manager.get(job_id, owner=current_user.username)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    job = job_manager.cancel(job_id, owner=current_user.username)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@app.post("/api/jobs/{job_id}/retry")
+async def retry_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="未授权访问，请先登录")
+    job = job_manager.retry(job_id, owner=current_user.username)
+    if job is None:
+        raise HTTPException(status_code=409, detail="任务不存在或尚未结束")
+    return job
+
+
+# 后台任务：定期删除已结束的旧任务记录
+async def cleanup_finished_jobs():
+    while True:
+        await asyncio.sleep(3600)
+        if not coordinator.is_leader:
+            continue
+        try:
+            loop = asyncio.get_running_loop()
+            removed = await loop.run_in_executor(executor, job_manager.cleanup)
+            if removed:
+                logger.info(f"已清理 {removed} 条过期任务记录")
+        except Exception as e:
+            logger.error(f"清理任务记录时出错: {str(e)}")
+
+
 @app.get("/login", response_class=HTMLResponse)
 async def show_login(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
@@ -0,0 +1,352 @@
+import os
+import json
+import queue
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+import logging
+from pathlib import Path
+
+logger = logging.getLogger("media_probe")
+
+# 媒体信息数据库路径（与 users.db 放在同一目录）
+BASE_DIR = os.environ.get("ZAY_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
+MEDIA_META_DB = os.path.join(BASE_DIR, "media_meta.db")
+
+# ffprobe 为可选依赖，存在时用于解析视频，否则使用 OpenCV
+FFPROBE_PATH = shutil.which("ffprobe")
+
+# 单个文件的探测超时（秒）
+PROBE_TIMEOUT = 15
+
+# 常用 EXIF 标签
+EXIF_TAGS = {
+    271: "make",
+    272: "model",
+    274: "orientation",
+    306: "datetime",
+}
+EXIF_IFD = 0x8769
+EXIF_SUB_TAGS = {
+    36867: "datetime_original",
+    33434: "exposure_time",
+    33437: "f_number",
+    34855: "iso",
+    37386: "focal_length",
+}
+
+# 音频标签（mutagen easy 模式的键）
+AUDIO_TAGS = ("title", "artist", "album", "albumartist", "date", "genre", "tracknumber")
+
+
+def _exif_value(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "ignore").strip("\x00 ")
+    if isinstance(value, (int, float, str)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _ffprobe_video(path):
+    result = subprocess.run(
+        [FFPROBE_PATH, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        capture_output=True, timeout=PROBE_TIMEOUT
+    )
+    if result.returncode != 0:
+        return None
+    data = json.loads(result.stdout or b"{}")
+    fmt = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+
+    fps = None
+    rate = video.get("avg_frame_rate") or video.get("r_frame_rate")
+    if rate and "/" in rate:
+        num, den = rate.split("/", 1)
+        if float(den or 0):
+            fps = round(float(num) / float(den), 3)
+
+    return {
+        "duration": float(fmt["duration"]) if fmt.get("duration") else None,
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "fps": fps,
+        "video_codec": video.get("codec_name"),
+        "audio_codec": audio.get("codec_name"),
+        "bitrate": int(fmt["bit_rate"]) if fmt.get("bit_rate") else None,
+        "tags": {k.lower(): v for k, v in (fmt.get("tags") or {}).items()},
+    }
+
+
+def _cv2_video(path):
+    import cv2
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        codec = "".join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00 ").lower()
+        duration = frame_count / fps if fps > 0 and frame_count > 0 else None
+        size = os.path.getsize(path)
+        return {
+            "duration": round(duration, 3) if duration else None,
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or None,
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None,
+            "fps": round(fps, 3) if fps > 0 else None,
+            "video_codec": codec or None,
+            "bitrate": int(size * 8 / duration) if duration else None,
+        }
+    finally:
+        cap.release()
+
+
+def probe_video(path):
+    """读取视频的时长、分辨率、帧率、编码和码率"""
+    if FFPROBE_PATH:
+        try:
+            meta = _ffprobe_video(path)
+            if meta:
+                return meta
+        except (subprocess.SubprocessError, OSError, ValueError):
+            pass
+    return _cv2_video(path)
+
+
+def probe_audio(path):
+    """读取音频的时长、码率、采样率、声道和标签"""
+    import mutagen
+    audio = mutagen.File(path, easy=True)
+    if audio is None:
+        return None
+    info = audio.info
+    tags = {}
+    for key in AUDIO_TAGS:
+        try:
+            values = (audio.tags or {}).get(key)
+        except (KeyError, ValueError):
+            values = None
+        if values:
+            tags[key] = values[0] if len(values) == 1 else list(values)
+    return {
+        "duration": round(info.length, 3) if getattr(info, "length", None) else None,
+        "bitrate": getattr(info, "bitrate", None) or None,
+        "sample_rate": getattr(info, "sample_rate", None),
+        "channels": getattr(info, "channels", None),
+        "audio_codec": getattr(info, "codec", None) or type(audio).__name__.lower().replace("easy", ""),
+        "tags": tags,
+    }
+
+
+def probe_image(path):
+    """读取图片的尺寸、格式和常用 EXIF 信息"""
+    from PIL import Image
+    with Image.open(path) as img:
+        meta = {"width": img.width, "height": img.height, "format": img.format}
+        exif = {}
+        try:
+            raw = img.getexif()
+            for tag, name in EXIF_TAGS.items():
+                if tag in raw:
+                    exif[name] = _exif_value(raw[tag])
+            sub = raw.get_ifd(EXIF_IFD)
+            for tag, name in EXIF_SUB_TAGS.items():
+                if tag in sub:
+                    exif[name] = _exif_value(sub[tag])
+        except Exception:
+            pass
+        if exif:
+            meta["exif"] = exif
+    return meta
+
+
+PROBERS = {
+    "video": probe_video,
+    "audio": probe_audio,
+    "image": probe_image,
+}
+
+
+class MediaProbe:
+    """
+    媒体信息探测管道
+
+    后台线程为音视频和图片提取时长、分辨率、编码、码率、标签和 EXIF，
+    按 (路径, 大小, 修改时间) 持久化到 SQLite。文件变化后旧记录自动失效，
+    列表接口只读取已有结果，不在请求中解析文件。
+    """
+
+    def __init__(self, root, db_path=MEDIA_META_DB, workers=2):
+        self.root = Path(root).resolve()
+        self.db_path = db_path
+        self.workers = workers
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+        self._init_schema()
+
+    # ---------------- 数据库 ----------------
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS media_meta (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    media_type TEXT NOT NULL,
+                    data TEXT,
+                    probed_at REAL NOT NULL
+                )
+            """)
+
+    # ---------------- 查询 ----------------
+
+    def get_many(self, entries):
+        """
+        批量读取已探测的媒体信息
+
+        Args:
+            entries: [(相对路径, 大小, 修改时间), ...]
+
+        Returns:
+            {相对路径: 媒体信息}，只包含大小和修改时间都一致的记录
+        """
+        result = {}
+        if not entries:
+            return result
+        wanted = {path: (size, mtime) for path, size, mtime in entries}
+        conn = self._connect()
+        paths = list(wanted)
+        for i in range(0, len(paths), 500):
+            batch = paths[i:i + 500]
+            rows = conn.execute(
+                f"SELECT path, size, mtime, data FROM media_meta WHERE path IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            for path, size, mtime, data in rows:
+                if wanted[path] == (size, mtime) and data:
+                    result[path] = json.loads(data)
+        return result
+
+    def has_current(self, rel_path, st):
+        row = self._connect().execute(
+            "SELECT size, mtime FROM media_meta WHERE path = ?", (rel_path,)
+        ).fetchone()
+        return row is not None and row == (st.st_size, st.st_mtime)
+
+    # ---------------- 探测 ----------------
+
+    def probe_now(self, rel_path, media_type):
+        """
+        立即探测一个文件并保存结果（在线程池中调用）
+
+        Returns:
+            媒体信息；不支持的类型或解析失败时返回 None
+        """
+        prober = PROBERS.get(media_type)
+        if prober is None:
+            return None
+        abs_path = self.root / rel_path
+        try:
+            st = abs_path.stat()
+        except OSError:
+            return None
+
+        try:
+            meta = prober(str(abs_path))
+        except Exception as e:
+            logger.warning(f"媒体信息探测失败: {rel_path} - {str(e)}")
+            meta = None
+        if meta is not None:
+            meta = {k: v for k, v in meta.items() if v not in (None, {}, "")}
+
+        # 解析失败也记录下来（data 为空），文件不变时不再重复尝试
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO media_meta (path, size, mtime, media_type, data, probed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (rel_path, st.st_size, st.st_mtime, media_type,
+                 json.dumps(meta, ensure_ascii=False, default=str) if meta is not None else None, time.time())
+            )
+        return meta
+
+    def enqueue(self, rel_path, media_type):
+        """加入后台探测队列（同一路径排队中时忽略）"""
+        if media_type not in PROBERS:
+            return
+        with self._pending_lock:
+            if rel_path in self._pending:
+                return
+            self._pending.add(rel_path)
+        self._queue.put((rel_path, media_type))
+
+    def forget(self, rel_path):
+        escaped = rel_path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute(
+                "DELETE FROM media_meta WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                (rel_path, escaped + "/%")
+            )
+
+    # ---------------- 后台线程 ----------------
+
+    def _worker(self):
+        while not self._stop_event.is_set():
+            try:
+                rel_path, media_type = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                abs_path = self.root / rel_path
+                st = abs_path.stat()
+                if not self.has_current(rel_path, st):
+                    self.probe_now(rel_path, media_type)
+            except OSError:
+                pass
+            except Exception as e:
+                logger.error(f"媒体信息探测异常: {rel_path} - {str(e)}")
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(rel_path)
+
+    def start(self):
+        self._stop_event.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"media-probe-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "pending": len(self._pending)}
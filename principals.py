@@ -0,0 +1,88 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger("principals")
+
+# 缓存的已验证令牌数量上限
+PRINCIPAL_CACHE_SIZE = 10000
+
+
+class Principal:
+    """
+    已认证的用户身份
+
+    由令牌中的声明构造，不持有数据库会话；模板和接口只需要用户 ID 和用户名。
+    """
+
+    __slots__ = ("id", "username", "issued_at", "expires_at")
+
+    def __init__(self, id, username, issued_at=0, expires_at=None):
+        self.id = id
+        self.username = username
+        self.issued_at = issued_at
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return f"Principal(id={self.id!r}, username={self.username!r})"
+
+
+class PrincipalCache:
+    """
+    令牌 -> 已验证身份的缓存
+
+    令牌验签通过后缓存到过期为止，命中时不再解码 JWT，也不访问用户数据库。
+    用户信息变化（修改、删除）时调用 invalidate，该用户在此之前签发的令牌全部失效。
+    """
+
+    def __init__(self, max_size=PRINCIPAL_CACHE_SIZE):
+        self.max_size = max_size
+        self._items = OrderedDict()   # token -> Principal
+        self._revoked = {}            # username -> 失效时间，早于该时间签发的令牌无效
+        self._lock = threading.Lock()
+
+    def _is_revoked(self, principal):
+        revoked_at = self._revoked.get(principal.username)
+        return revoked_at is not None and principal.issued_at <= revoked_at
+
+    def get(self, token):
+        """返回缓存的身份，未命中、已过期或已失效时返回 None"""
+        now = time.time()
+        with self._lock:
+            principal = self._items.get(token)
+            if principal is None:
+                return None
+            if (principal.expires_at is not None and principal.expires_at <= now) or self._is_revoked(principal):
+                del self._items[token]
+                return None
+            self._items.move_to_end(token)
+            return principal
+
+    def put(self, token, principal):
+        with self._lock:
+            if self._is_revoked(principal):
+                return
+            self._items[token] = principal
+            self._items.move_to_end(token)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def is_revoked(self, principal):
+        with self._lock:
+            return self._is_revoked(principal)
+
+    def invalidate(self, username, revoked_at=None):
+        """使该用户在 revoked_at（默认当前时间）之前签发的令牌全部失效（修改密码、删除用户等情况）"""
+        revoked_at = revoked_at or time.time()
+        with self._lock:
+            if self._revoked.get(username, 0) >= revoked_at:
+                return
+            self._revoked[username] = revoked_at
+            for token in [t for t, p in self._items.items() if p.username == username]:
+                del self._items[token]
+        logger.info(f"用户身份缓存已失效: {username}")
+
+    def revocations(self):
+        with self._lock:
+            return dict(self._revoked)
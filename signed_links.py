@@ -0,0 +1,192 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import threading
+import logging
+
+logger = logging.getLogger("signed_links")
+
+# 撤销列表文件被其他进程修改后，最多经过该时间（秒）生效
+REVOCATION_RELOAD_INTERVAL = 5
+
+
+class InvalidLink(Exception):
+    """直链无效、过期或已被撤销"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def load_or_create_secret(path):
+    """
+    读取直链签名密钥，文件不存在时生成随机密钥并保存（权限 0600）
+
+    多个进程同时首次启动时只有一个能创建成功，其余进程读取它写入的密钥。
+    """
+    try:
+        with open(path, "rb") as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_hex(32).encode("ascii"))
+        # 硬链接到目标路径：已存在时失败，不会覆盖其他进程生成的密钥
+        try:
+            os.link(tmp_path, path)
+            logger.info(f"已生成直链签名密钥: {path}")
+        except FileExistsError:
+            pass
+    finally:
+        os.unlink(tmp_path)
+
+    with open(path, "rb") as f:
+        secret = f.read().strip()
+    if not secret:
+        raise RuntimeError(f"直链签名密钥文件为空: {path}")
+    return secret
+
+
+class LinkSigner:
+    """
+    自验证的直链令牌
+
+    令牌 = base64url(声明 JSON) + "." + base64url(HMAC-SHA256)，声明中包含文件路径、
+    过期时间以及可选的限制条件（绑定 IP、单次请求最大字节数、下载/内联）。
+    验证只需要密钥，任何进程或节点都能独立处理 /dl 请求，重启后链接依然有效。
+    """
+
+    def __init__(self, secret):
+        if isinstance(secret, str):
+            secret = secret.encode("utf-8")
+        # 与登录令牌使用不同的派生密钥，两种令牌不能互相冒用
+        self._key = hmac.new(secret, b"zay-cloud/direct-link", hashlib.sha256).digest()
+
+    def _signature(self, payload: bytes) -> bytes:
+        return hmac.new(self._key, payload, hashlib.sha256).digest()
+
+    def sign(self, path, expires_at, ip=None, max_bytes=None, download=True):
+        """
+        生成直链令牌
+
+        Args:
+            path: 存储目录下的相对路径
+            expires_at: 过期时间戳
+            ip: 只允许该 IP 访问
+            max_bytes: 单次请求允许返回的最大字节数
+            download: True 作为附件下载，False 在浏览器中内联打开
+
+        Returns:
+            (令牌, 链接 ID)
+        """
+        link_id = _b64encode(secrets.token_bytes(9))
+        claims = {"p": path, "e": int(expires_at), "i": link_id}
+        if ip:
+            claims["ip"] = ip
+        if max_bytes:
+            claims["r"] = int(max_bytes)
+        if not download:
+            claims["d"] = 0
+        payload = json.dumps(claims, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return f"{_b64encode(payload)}.{_b64encode(self._signature(payload))}", link_id
+
+    def verify(self, token, now=None):
+        """
+        验证令牌签名和过期时间
+
+        Returns:
+            声明字典
+
+        Raises:
+            InvalidLink: 令牌格式错误、签名不匹配（404）或已过期（410）
+        """
+        try:
+            payload_part, _, signature_part = token.partition(".")
+            payload = _b64decode(payload_part)
+            signature = _b64decode(signature_part)
+        except (ValueError, TypeError):
+            raise InvalidLink(404, "链接不存在或已过期")
+        if not hmac.compare_digest(signature, self._signature(payload)):
+            raise InvalidLink(404, "链接不存在或已过期")
+
+        claims = json.loads(payload)
+        if claims["e"] < (now or time.time()):
+            raise InvalidLink(410, "链接已过期")
+        return claims
+
+
+class RevocationList:
+    """
+    持久化的直链撤销列表
+
+    只保存被提前撤销的链接 ID（到原过期时间为止），正常链接不需要任何记录。
+    多个进程共享同一个文件，每个进程定期检查文件是否变化并重新加载。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._revoked = {}  # 链接 ID -> 过期时间戳
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._reload(force=True)
+
+    def _reload(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < REVOCATION_RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._revoked, self._mtime = {}, None
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._revoked = json.load(f)
+            self._mtime = mtime
+        except (OSError, ValueError) as e:
+            logger.error(f"读取直链撤销列表失败: {str(e)}")
+
+    def is_revoked(self, link_id):
+        with self._lock:
+            self._reload()
+            return link_id in self._revoked
+
+    def revoke(self, link_id, expires_at):
+        """撤销链接，同时清除已过期的记录"""
+        with self._lock:
+            self._reload(force=True)
+            now = time.time()
+            revoked = {k: v for k, v in self._revoked.items() if v >= now}
+            revoked[link_id] = int(expires_at)
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(revoked, f)
+            os.replace(tmp_path, self.path)
+            self._revoked = revoked
+            self._mtime = os.stat(self.path).st_mtime_ns
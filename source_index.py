@@ -0,0 +1,250 @@
+import os
+import stat
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger("source_index")
+
+# 本地映射源索引数据库路径（与 users.db 放在同一目录）
+BASE_DIR = os.environ.get("ZAY_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
+SOURCE_INDEX_DB = os.path.join(BASE_DIR, "source_index.db")
+
+# 索引的最大深度（1 表示只索引源目录下的文件）
+SOURCE_INDEX_MAX_DEPTH = 4
+# 定期重新扫描的间隔（秒）；文件没有变化的目录不会重写记录
+SOURCE_REFRESH_INTERVAL = 600
+# 提供了最后修改时间时允许的误差（毫秒）
+MTIME_TOLERANCE_MS = 60000
+
+
+class SourceIndex:
+    """
+    本地映射源的文件指纹索引
+
+    后台线程扫描映射源（以及下载、桌面等常用目录），按 (文件名, 大小) 保存路径和修改时间。
+    检查上传的文件能否从本地映射时只查询索引，再 stat 一次候选文件确认，
+    不再为每个文件遍历所有映射源。重新扫描时只重写文件有增删或大小、修改时间变化的目录。
+    """
+
+    def __init__(self, db_path=SOURCE_INDEX_DB, max_depth=SOURCE_INDEX_MAX_DEPTH,
+                 refresh_interval=SOURCE_REFRESH_INTERVAL):
+        self.db_path = db_path
+        self.max_depth = max_depth
+        self.refresh_interval = refresh_interval
+
+        self._roots = []
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._refresh_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._should_run = None
+
+        self._init_schema()
+
+    # ---------------- 数据库 ----------------
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with self._write_lock, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS source_files (
+                    path TEXT PRIMARY KEY,
+                    root TEXT NOT NULL,
+                    dir TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    depth INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_source_files_name_size ON source_files(name, size)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_source_files_dir ON source_files(dir)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS source_dirs (
+                    path TEXT PRIMARY KEY,
+                    root TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL
+                )
+            """)
+
+    # ---------------- 扫描 ----------------
+
+    def set_roots(self, roots):
+        """设置要索引的目录（映射源变化时调用），删除不再使用的目录的记录并触发重新扫描"""
+        roots = list(dict.fromkeys(os.path.abspath(str(root)) for root in roots))
+        self._roots = roots
+        self.refresh_soon()
+
+    def refresh_soon(self):
+        """让后台线程立即开始一次扫描"""
+        self._refresh_event.set()
+
+    def _scan_root(self, root):
+        conn = self._connect()
+        known_dirs = dict(conn.execute("SELECT path, mtime_ns FROM source_dirs WHERE root = ?", (root,)))
+        visited = set()
+        rescanned = 0
+
+        stack = [(root, 1)]
+        while stack and not self._stop_event.is_set():
+            dir_path, depth = stack.pop()
+            try:
+                dir_mtime = os.stat(dir_path).st_mtime_ns
+                entries = list(os.scandir(dir_path))
+            except OSError:
+                continue
+            visited.add(dir_path)
+
+            files = []
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if depth < self.max_depth:
+                            stack.append((entry.path, depth + 1))
+                    elif entry.is_file():
+                        files.append(entry)
+                except OSError:
+                    continue
+
+            rows = []
+            for entry in files:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                rows.append((entry.path, root, dir_path, entry.name, st.st_size, st.st_mtime, depth))
+
+            # 目录修改时间只反映文件增删；原地改写或仍在写入的文件只能通过大小和修改时间发现
+            if known_dirs.get(dir_path) == dir_mtime:
+                stored = set(conn.execute("SELECT path, size, mtime FROM source_files WHERE dir = ?", (dir_path,)))
+                if stored == {(row[0], row[4], row[5]) for row in rows}:
+                    continue
+
+            with self._write_lock, conn:
+                conn.execute("DELETE FROM source_files WHERE dir = ?", (dir_path,))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO source_files (path, root, dir, name, size, mtime, depth) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                conn.execute("INSERT OR REPLACE INTO source_dirs (path, root, mtime_ns) VALUES (?, ?, ?)",
+                             (dir_path, root, dir_mtime))
+            rescanned += 1
+
+        if self._stop_event.is_set():
+            return rescanned
+        # 已删除的目录
+        removed = [path for path in known_dirs if path not in visited]
+        if removed:
+            with self._write_lock, conn:
+                for path in removed:
+                    conn.execute("DELETE FROM source_files WHERE dir = ?", (path,))
+                    conn.execute("DELETE FROM source_dirs WHERE path = ?", (path,))
+        return rescanned
+
+    def refresh(self):
+        """扫描所有目录，返回重新扫描的目录数"""
+        started = time.monotonic()
+        roots = list(self._roots)
+        conn = self._connect()
+        placeholders = ",".join("?" * len(roots))
+        with self._write_lock, conn:
+            # 不再配置的目录
+            conn.execute(f"DELETE FROM source_files WHERE root NOT IN ({placeholders})", roots)
+            conn.execute(f"DELETE FROM source_dirs WHERE root NOT IN ({placeholders})", roots)
+
+        rescanned = 0
+        for root in roots:
+            if self._stop_event.is_set():
+                break
+            if os.path.isdir(root):
+                rescanned += self._scan_root(root)
+        if rescanned:
+            logger.info(f"本地映射源索引已更新: 重新扫描 {rescanned} 个目录，用时 {time.monotonic() - started:.2f} 秒")
+        return rescanned
+
+    # ---------------- 查询 ----------------
+
+    def lookup(self, name, size, last_modified=None):
+        """
+        查找与上传文件匹配的本地文件
+
+        Args:
+            name: 文件名
+            size: 文件大小
+            last_modified: 浏览器提供的最后修改时间（毫秒），用于排除子目录中的同名文件
+
+        Returns:
+            (本地路径, 所在目录)；没有匹配时返回 None
+        """
+        if not name or "/" in name or "\\" in name or name in (".", ".."):
+            return None
+
+        # 源目录下的同名文件直接检查，不依赖索引是否已更新
+        for root in self._roots:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode) and st.st_size == size:
+                return path, root
+
+        rows = self._connect().execute(
+            "SELECT path, dir, depth FROM source_files WHERE name = ? AND size = ? ORDER BY depth, path",
+            (name, size)
+        ).fetchall()
+        for path, dir_path, depth in rows:
+            # 索引可能已过期，确认文件仍然存在且大小一致
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_size != size:
+                continue
+            if last_modified and depth > 1 and abs(st.st_mtime * 1000 - last_modified) > MTIME_TOLERANCE_MS:
+                continue
+            return path, dir_path
+        return None
+
+    # ---------------- 后台线程 ----------------
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if self._should_run is None or self._should_run():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"更新本地映射源索引失败: {str(e)}")
+            self._refresh_event.wait(self.refresh_interval)
+            self._refresh_event.clear()
+
+    def start(self, should_run=None):
+        """
+        启动后台扫描线程
+
+        Args:
+            should_run: 返回 False 时跳过本次扫描（多进程部署时只由主进程扫描）
+        """
+        self._should_run = should_run
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="source-index", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._refresh_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
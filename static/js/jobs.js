@@ -0,0 +1,71 @@
+// 后台任务：所有等待中的任务共用一个事件流（/api/jobs/events）
+const jobWaiters = new Map();
+// 事件流中已经结束的任务，等待者晚于事件注册时直接使用
+const finishedJobs = new Map();
+let jobEventSource = null;
+
+const JOB_FINISHED_STATES = ['succeeded', 'failed', 'canceled'];
+
+function settleJob(job) {
+    const waiter = jobWaiters.get(job.id);
+    if (!waiter) {
+        return;
+    }
+    jobWaiters.delete(job.id);
+    if (job.state === 'succeeded') {
+        waiter.resolve(job);
+    } else {
+        const error = new Error(job.error || (job.state === 'canceled' ? '任务已取消' : '任务失败'));
+        error.job = job;
+        waiter.reject(error);
+    }
+    if (jobWaiters.size === 0 && jobEventSource) {
+        jobEventSource.close();
+        jobEventSource = null;
+    }
+}
+
+function openJobEvents() {
+    if (jobEventSource) {
+        return;
+    }
+    jobEventSource = new EventSource('/api/jobs/events');
+    jobEventSource.addEventListener('job', (event) => {
+        const job = JSON.parse(event.data);
+        if (JOB_FINISHED_STATES.includes(job.state)) {
+            finishedJobs.set(job.id, job);
+            if (finishedJobs.size > 200) {
+                finishedJobs.delete(finishedJobs.keys().next().value);
+            }
+        }
+        const waiter = jobWaiters.get(job.id);
+        if (!waiter) {
+            return;
+        }
+        if (waiter.onProgress) {
+            waiter.onProgress(job);
+        }
+        if (JOB_FINISHED_STATES.includes(job.state)) {
+            settleJob(job);
+        }
+    });
+}
+
+// 等待任务结束：成功时 resolve(任务)，失败或取消时 reject
+function waitForJob(job, onProgress) {
+    return new Promise((resolve, reject) => {
+        jobWaiters.set(job.id, { resolve, reject, onProgress });
+        const finished = finishedJobs.get(job.id) || (JOB_FINISHED_STATES.includes(job.state) ? job : null);
+        if (finished) {
+            settleJob(finished);
+            return;
+        }
+        openJobEvents();
+    });
+}
+
+// 取消任务
+async function cancelJob(jobId) {
+    const response = await fetch(`/api/jobs/${jobId}/cancel`, { method: 'POST' });
+    return await response.json();
+}
@@ -24,27 +24,48 @@ const container = document.getElementById("itemsContainer");
 if (container) container.innerHTML = '<p class="text-center"><i class="fas fa-spinner fa-spin"></i> 加载中...</p>';
 
 console.log(`请求路径: ${currentPath}`);
-const response = await fetch(`/api/files?path=${encodeURIComponent(currentPath)}`);
-if (!response.ok) {
-    const errorText = await response.text();
-    throw new Error(`服务器返回错误 (${response.status}): ${errorText}`);
-}
+const requestedPath = currentPath;
+let cursor = null;
+let data = null;
+
+// 分页加载，每加载一页就渲染一次
+do {
+    let url = `/api/files?path=${encodeURIComponent(requestedPath)}`;
+    if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+    const response = await fetch(url);
+    if (!response.ok) {
+        const errorText = await response.text();
+        throw new Error(`服务器返回错误 (${response.status}): ${errorText}`);
+    }
 
-const data = await response.json();
-console.log("API返回数据:", data);
+    const page = await response.json();
+    console.log("API返回数据:", page);
 
-if (!Array.isArray(data.items)) data.items = [];
-if (!data.categories) data.categories = {videos: [], audios: [], images: [], documents: [], others: []};
+    if (!Array.isArray(page.items)) page.items = [];
+    if (!page.categories) page.categories = {videos: [], audios: [], images: [], documents: [], others: []};
 
-// 验证返回的 current_path
-if (data.current_path !== currentPath) {
+    if (data === null) {
+        data = page;
+        // 验证返回的 current_path
+        if (data.current_path !== currentPath) {
 
-    console.warn(`后端返回路径(${data.current_path})与前端预期(${currentPath})不一致`);
-    currentPath = data.current_path || currentPath; // 以后端为准
-}
+            console.warn(`后端返回路径(${data.current_path})与前端预期(${currentPath})不一致`);
+            currentPath = data.current_path || currentPath; // 以后端为准
+        }
+    } else {
+        data.items = data.items.concat(page.items);
+        Object.keys(data.categories).forEach(key => {
+            data.categories[key] = data.categories[key].concat(page.categories[key] || []);
+        });
+    }
+
+    // 用户已切换到其他目录，停止加载
+    if (currentPath !== (data.current_path || requestedPath)) return;
 
-fileListCache = data;
-renderItems(data.items, data.categories);
+    fileListCache = data;
+    renderItems(data.items, data.categories);
+    cursor = page.next_cursor;
+} while (cursor);
 
 updateBreadcrumb(currentPath);
 } catch (error) {
@@ -162,6 +183,8 @@ function renderItems(items, categories) {
         if (isCardView) {
             // 卡片视图模式
             let previewHtml = '';
+            // 缩略图地址带上文件版本，文件未变化时浏览器可直接使用缓存
+            const thumbVersion = `v=${item.mtime}-${item.size}`;
             
             if (item.type === 'file') {
                 if (item.media_type === 'image') {
@@ -174,14 +197,14 @@ function renderItems(items, categories) {
                     // 视频文件显示截图预览
                     previewHtml = `
                         <div class="file-preview" onclick="${itemClickHandler}">
-                            <img src="/api/thumbnail/video/${path}" alt="${item.name}" loading="lazy" 
+                            <img src="/api/thumbnail/video/${path}?${thumbVersion}" srcset="/api/thumbnail/video/${path}?variant=retina&${thumbVersion} 2x" alt="${item.name}" loading="lazy" 
                                  onerror="this.onerror=null; this.src=''; this.parentNode.innerHTML='<i class=\'fas fa-video fa-3x\' style=\'color: rgba(0, 0, 0, 0.4);\'></i>';">
                         </div>`;
                 } else if (item.media_type === 'audio') {
                     // 音频文件显示封面预览
                     previewHtml = `
                         <div class="file-preview" onclick="${itemClickHandler}">
-                            <img src="/api/thumbnail/audio/${path}" alt="${item.name}" loading="lazy" 
+                            <img src="/api/thumbnail/audio/${path}?${thumbVersion}" srcset="/api/thumbnail/audio/${path}?variant=retina&${thumbVersion} 2x" alt="${item.name}" loading="lazy" 
                                  onerror="this.onerror=null; this.src=''; this.parentNode.innerHTML='<i class=\'fas fa-music fa-3x\' style=\'color: rgba(0, 0, 0, 0.4);\'></i>';">
                         </div>`;
                 } else {
@@ -212,7 +235,7 @@ function renderItems(items, categories) {
                     <button class="btn btn-sm btn-info me-1" onclick="generateDirectLink('${path}')" title="获取链接"><i class="fas fa-link"></i></button>
                     <button class="btn btn-sm btn-secondary me-1" onclick="showFileQRCode('${path}')" title="显示二维码"><i class="fas fa-qrcode"></i></button>
                 ` : ""}
-                <button class="btn btn-sm btn-danger" onclick="${item.type === 'folder' ? `deleteFolder('${path}')` : `deleteFile('${path}')`}" title="删除"><i class="fas fa-trash"></i></button>
+                ${item.readonly ? "" : `<button class="btn btn-sm btn-danger" onclick="${item.type === 'folder' ? `deleteFolder('${path}')` : `deleteFile('${path}')`}" title="删除"><i class="fas fa-trash"></i></button>`}
             </div>`;
     } else {
         // 列表视图模式
@@ -229,7 +252,7 @@ function renderItems(items, categories) {
                         <button class="btn btn-sm btn-info me-1" onclick="generateDirectLink('${path}')"><i class="fas fa-link"></i></button>
                         <button class="btn btn-sm btn-secondary me-1" onclick="showFileQRCode('${path}')"><i class="fas fa-qrcode"></i></button>
                     ` : ""}
-                    <button class="btn btn-sm btn-danger" onclick="${item.type === 'folder' ? `deleteFolder('${path}')` : `deleteFile('${path}')`}"><i class="fas fa-trash"></i></button>
+                    ${item.readonly ? "" : `<button class="btn btn-sm btn-danger" onclick="${item.type === 'folder' ? `deleteFolder('${path}')` : `deleteFile('${path}')`}"><i class="fas fa-trash"></i></button>`}
                 </div>
             </div>`;
     }
@@ -609,9 +632,11 @@ async function deleteFolder(folderPath) {
         const result = await response.json();
         if (response.ok) {
             showNotification(result.message, true);
+            const job = await waitForJob(result.job);
+            showNotification(job.result.message, true);
             refreshFileList();
         } else {
-            showNotification(result.error, false);
+            showNotification(result.error || result.detail, false);
         }
     } catch (error) {
         showNotification(`删除失败: ${error}`, false);
@@ -737,6 +762,7 @@ const uploadManager = {
 uploads: [],
 totalUploads: 0,
 completedUploads: 0,
+parallelChunks: 3, // 每个文件同时上传的分片数
 
 // 添加新上传任务
 addUpload: function(file, directory) {
@@ -778,6 +804,8 @@ return false;
 }
 
 try {
+let result = upload.localCheck;
+if (!result) {
 console.log(`检查文件 ${upload.fileName} 是否可映射...`);
 // 调用后端 API 检查文件是否可以直接映射
 const response = await fetch('/api/check-local-file', {
@@ -785,13 +813,7 @@ const response = await fetch('/api/check-local-file', {
     headers: {
         'Content-Type': 'application/json',
     },
-    body: JSON.stringify({
-        fileName: upload.fileName,
-        directory: upload.directory,
-        fileSize: upload.fileSize,
-        // 可以传递一些用于识别本地文件的额外信息
-        lastModified: upload.file.lastModified
-    })
+    body: JSON.stringify(this._localCheckRequest(upload))
 });
 
 if (!response.ok) {
@@ -799,7 +821,8 @@ if (!response.ok) {
     return false; // 不能映射，需要正常上传
 }
 
-const result = await response.json();
+result = await response.json();
+}
 console.log('映射检查结果:', result);
 
 if (result.canMap && result.localPath) {
@@ -850,6 +873,43 @@ console.error('检查本地文件映射失败:', error);
 return false; // 出错时默认使用正常上传
 }
 },
+// 检查本地映射时提交的文件信息
+_localCheckRequest: function(upload) {
+return {
+    fileName: upload.fileName,
+    directory: upload.directory,
+    fileSize: upload.fileSize,
+    // 可以传递一些用于识别本地文件的额外信息
+    lastModified: upload.file.lastModified
+};
+},
+// 批量检查本地映射（每批 1000 个文件），结果保存到 upload.localCheck
+checkLocalFiles: async function(uploads) {
+const batchSize = 1000;
+for (let i = 0; i < uploads.length; i += batchSize) {
+    const batch = uploads.slice(i, i + batchSize);
+    try {
+        const response = await fetch('/api/check-local-files', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ files: batch.map(upload => this._localCheckRequest(upload)) })
+        });
+        if (!response.ok) {
+            console.log('批量检查映射API返回错误，将逐个检查');
+            return;
+        }
+        const data = await response.json();
+        batch.forEach((upload, index) => {
+            upload.localCheck = data.results[index];
+        });
+    } catch (error) {
+        console.error('批量检查本地文件映射失败:', error);
+        return;
+    }
+}
+},
 // 开始上传任务
 // 在现有 startUpload 方法中添加本地映射检查
 startUpload: async function(upload) {
@@ -875,8 +935,11 @@ if (mapped) {
 console.log(`文件 ${upload.fileName} 无法映射，开始正常上传流程`);
 // 如果不能映射，继续原有的上传逻辑
 if (upload.enableChunking) {
-    this._prepareChunks(upload);
-    this._uploadNextChunk(upload);
+    await this._prepareChunks(upload);
+    // 同一文件的多个分片并行上传
+    for (let i = 0; i < this.parallelChunks; i++) {
+        this._uploadNextChunk(upload);
+    }
 } else {
     this._uploadFile(upload);
 }
@@ -888,23 +951,46 @@ this.renderUploads();
 }
 },
 
-// 准备文件分片
-_prepareChunks: function(upload) {
+// 准备文件分片：创建（或恢复）上传会话，跳过服务器已接收的分片
+_prepareChunks: async function(upload) {
 const file = upload.file;
-const chunkSize = upload.chunkSize;
-const totalChunks = Math.ceil(file.size / chunkSize);
 
+const response = await fetch('/api/upload/sessions', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({
+        fileName: file.name,
+        directory: upload.directory,
+        fileSize: file.size,
+        chunkSize: upload.chunkSize,
+        lastModified: file.lastModified
+    })
+});
+if (!response.ok) {
+    const result = await response.json();
+    throw new Error(result.detail || '创建上传会话失败');
+}
+const session = await response.json();
+const missing = new Set(session.missingChunks);
+const chunkSize = session.chunkSize;
+const totalChunks = session.totalChunks;
+
+upload.sessionId = session.session_id;
 upload.totalChunks = totalChunks;
 upload.chunks = Array(totalChunks).fill().map((_, index) => ({
     index: index,
     start: index * chunkSize,
     end: Math.min((index + 1) * chunkSize, file.size),
-    status: 'pending', // pending, uploading, completed, error
+    status: missing.has(index) ? 'pending' : 'completed', // pending, uploading, completed, error
     attempts: 0,
-    progress: 0
+    progress: missing.has(index) ? 0 : 100
 }));
+upload.uploadedBytes = upload.chunks.reduce((total, chunk) => {
+    return total + (chunk.status === 'completed' ? (chunk.end - chunk.start) : 0);
+}, 0);
+upload.lastBytes = upload.uploadedBytes;
 
-console.log(`准备上传文件: ${file.name}, 大小: ${this._formatFileSize(file.size)}, 分片数: ${totalChunks}`);
+console.log(`准备上传文件: ${file.name}, 大小: ${this._formatFileSize(file.size)}, 分片数: ${totalChunks}, 已上传: ${totalChunks - missing.size}`);
 },
 
 // 上传下一个分片
@@ -914,7 +1000,10 @@ if (upload.status !== 'uploading') return;
 // 查找下一个待上传的分片
 const nextChunk = upload.chunks.find(chunk => chunk.status === 'pending');
 if (!nextChunk) {
+    // 其他分片仍在上传时由最后完成的那一路负责合并
+    if (upload.completing || upload.chunks.some(chunk => chunk.status === 'uploading')) return;
     // 所有分片已上传，完成文件
+    upload.completing = true;
     await this._completeMultipartUpload(upload);
     return;
 }
@@ -970,20 +1059,21 @@ try {
 // 上传单个分片
 _uploadChunk: async function(upload, chunk) {
 const file = upload.file;
-const formData = new FormData();
 const blob = file.slice(chunk.start, chunk.end);
+const headers = {'Content-Type': 'application/octet-stream'};
 
-formData.append('file', blob, file.name);
-formData.append('directory', upload.directory);
-formData.append('fileName', file.name);
-formData.append('chunkIndex', chunk.index);
-formData.append('totalChunks', upload.totalChunks);
-formData.append('chunkSize', upload.chunkSize);
-formData.append('fileSize', file.size);
+// 浏览器支持 WebCrypto 时附带分片的 SHA-256，服务器写入时校验
+if (window.crypto && window.crypto.subtle) {
+    const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    const hex = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    headers['X-Chunk-Hash'] = `sha256=${hex}`;
+}
 
-const response = await fetch('/api/upload/chunk', {
-    method: 'POST',
-    body: formData,
+// 分片数据直接作为请求体发送，服务器按偏移写入目标文件
+const response = await fetch(`/api/upload/sessions/${upload.sessionId}/chunks/${chunk.index}`, {
+    method: 'PUT',
+    headers: headers,
+    body: blob,
     signal: upload.controller.signal
 });
 
@@ -1000,17 +1090,8 @@ _completeMultipartUpload: async function(upload) {
 try {
     console.log(`所有分片上传完成，合并文件: ${upload.fileName}`);
     
-    const response = await fetch('/api/upload/complete', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-            fileName: upload.fileName,
-            directory: upload.directory,
-            totalChunks: upload.totalChunks,
-            fileSize: upload.fileSize
-        })
+    const response = await fetch(`/api/upload/sessions/${upload.sessionId}/complete`, {
+        method: 'POST'
     });
     
     if (!response.ok) {
@@ -1018,7 +1099,9 @@ try {
         throw new Error(result.detail || '合并文件失败');
     }
     
-    const result = await response.json();
+    // 合并在后台任务中进行，等待任务结束
+    const { job } = await response.json();
+    await waitForJob(job);
     upload.status = 'completed';
     upload.progress = 100;
     upload.endTime = Date.now();
@@ -1169,6 +1252,10 @@ if (upload && ['uploading', 'paused', 'pending'].includes(upload.status)) {
     if (upload.controller) {
         upload.controller.abort();
     }
+    // 通知服务器删除已上传的分片
+    if (upload.sessionId) {
+        fetch(`/api/upload/sessions/${upload.sessionId}`, { method: 'DELETE' }).catch(() => {});
+    }
     
     this.renderUploads();
     
@@ -1361,7 +1448,7 @@ return "other";
 }
 
 // 开始上传
-function startUpload() {
+async function startUpload() {
     // 判断当前上传类型
     const isFileUpload = document.getElementById('uploadFile').checked;
     const fileInput = isFileUpload ? document.getElementById("fileInput") : document.getElementById("folderInput");
@@ -1408,13 +1495,14 @@ function startUpload() {
     }
 
     // 为每个选中的文件创建上传任务
+    const uploads = [];
     if (isFileUpload) {
         // 单文件上传模式
         Array.from(fileInput.files).forEach(file => {
             const upload = uploadManager.addUpload(file, directory);
             upload.enableChunking = enableChunking && file.size > 5 * 1024 * 1024; // 5MB以上且启用分片
             upload.checkLocalMapping = checkLocalMapping; // 添加本地映射检查选项
-            uploadManager.startUpload(upload);
+            uploads.push(upload);
         });
     } else {
         // 文件夹上传模式
@@ -1441,7 +1529,7 @@ function startUpload() {
             upload.createFolders = true;
             upload.relativePath = relativePath;
             
-            uploadManager.startUpload(upload);
+            uploads.push(upload);
         });
     }
 
@@ -1450,6 +1538,12 @@ function startUpload() {
 
     // 清空文件输入框，以便下次选择相同文件
     fileInput.value = "";
+
+    // 先一次性检查所有文件能否从本地映射，再开始上传
+    if (checkLocalMapping && uploads.length > 1) {
+        await uploadManager.checkLocalFiles(uploads);
+    }
+    uploads.forEach(upload => uploadManager.startUpload(upload));
 }
 
 
@@ -1476,6 +1570,13 @@ try {
     mappingSources = data.sources || [];
     
     renderMappingSources();
+
+    // 外部目录开关
+    const mountsResponse = await fetch('/api/mounts');
+    if (mountsResponse.ok) {
+        const mounts = await mountsResponse.json();
+        document.getElementById('enableVirtualMounts').checked = mounts.enabled;
+    }
 } catch (error) {
     console.error('加载映射源失败:', error);
     showNotification(`加载映射源失败: ${error.message}`, false);
@@ -1563,17 +1664,18 @@ async function mapAllContents(sourcePath) {
             throw new Error(`服务器返回错误 (${response.status})`);
         }
         
-        const result = await response.json();
+        const { job } = await response.json();
+        
+        // 映射在后台任务中进行，关闭模态框后等待任务结束
+        const modal = bootstrap.Modal.getInstance(document.getElementById('mappingSourcesModal'));
+        modal.hide();
+        const finished = await waitForJob(job);
         
         // 显示结果通知
-        showNotification(`批量映射完成，成功导入 ${result.mappedCount || 0} 个文件`, true);
+        showNotification(`批量映射完成，成功导入 ${finished.result.mappedCount || 0} 个文件`, true);
         
         // 刷新文件列表
         refreshFileList();
-        
-        // 关闭模态框
-        const modal = bootstrap.Modal.getInstance(document.getElementById('mappingSourcesModal'));
-        modal.hide();
     } catch (error) {
         console.error('批量映射文件失败:', error);
         showNotification(`批量映射失败: ${error.message}`, false);
@@ -1633,6 +1735,21 @@ try {
     // 更新列表（使用服务器返回的有效路径）
     mappingSources = result.validSources || [];
     renderMappingSources();
+
+    // 保存外部目录开关
+    const mountsResponse = await fetch('/api/mounts/settings', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            enabled: document.getElementById('enableVirtualMounts').checked
+        })
+    });
+    if (!mountsResponse.ok) {
+        throw new Error(`保存外部目录设置失败 (${mountsResponse.status})`);
+    }
+    refreshFileList();
     
     // 显示结果通知
     if (result.invalidSources && result.invalidSources.length > 0) {
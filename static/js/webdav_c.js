@@ -651,8 +651,14 @@ document.addEventListener('DOMContentLoaded', function() {
             })
             .then(response => response.json())
             .then(data => {
+                // 下载在后台任务中进行，等待任务结束
+                if (!data.success || !data.job) {
+                    throw new Error(data.detail || '下载失败');
+                }
+                return waitForJob(data.job);
+            })
+            .then(() => {
                 completed++;
-                if (!data.success) errors++;
                 
                 if (completed === items.length) {
                     // 所有下载完成
@@ -0,0 +1,280 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import logging
+import mimetypes
+import posixpath
+import threading
+from pathlib import Path
+
+logger = logging.getLogger("static_assets")
+
+# brotli 为可选依赖，未安装时只生成 gzip 版本
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 需要生成压缩版本的文件类型（图片、woff2 等本身已压缩）
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".json", ".map", ".svg", ".txt", ".html", ".ttf", ".otf", ".eot", ".ico"}
+# 小于该大小的文件不压缩
+MIN_COMPRESS_SIZE = 1024
+# 文件名中内容哈希的长度
+HASH_LENGTH = 10
+
+# 带哈希的文件名内容不会变化；不带哈希的旧地址每次向服务器验证
+HASHED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+UNHASHED_CACHE_CONTROL = "public, no-cache"
+
+# 压缩版本的扩展名，按优先级排列
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+MANIFEST_NAME = "manifest.json"
+
+# CSS 中的 url(...) 引用（字体、图片）
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def accepted_encodings(header):
+    """解析 Accept-Encoding，返回客户端接受的编码集合（q=0 表示不接受）"""
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(name)
+    if "*" in accepted:
+        accepted.update(encoding for encoding, _ in ENCODINGS)
+    return accepted
+
+
+def _hashed_name(rel_path, digest):
+    stem, ext = posixpath.splitext(rel_path)
+    return f"{stem}.{digest}{ext}"
+
+
+def _write_atomic(path, data):
+    """先写临时文件再替换，多个工作进程同时构建时不会读到写了一半的文件"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class StaticAsset:
+    """一个可以直接发送的静态文件（可能是压缩版本）"""
+
+    __slots__ = ("path", "etag", "content_type", "encoding", "cache_control", "compressible")
+
+    def __init__(self, path, etag, content_type, encoding=None, cache_control=UNHASHED_CACHE_CONTROL,
+                 compressible=False):
+        self.path = path
+        self.etag = etag
+        self.content_type = content_type
+        self.encoding = encoding
+        self.cache_control = cache_control
+        self.compressible = compressible
+
+    @property
+    def headers(self):
+        headers = {}
+        if self.compressible:
+            headers["Vary"] = "Accept-Encoding"
+        if self.encoding:
+            headers["Content-Encoding"] = self.encoding
+        return headers
+
+
+class StaticAssets:
+    """
+    静态资源构建和查找
+
+    启动时为 static 目录下的每个文件生成带内容哈希的副本（如 css/te1.3f2a9c01bd.css）
+    及其 .br/.gz 预压缩版本，写入构建目录并生成清单。CSS 中引用的字体、图片地址
+    会先替换为带哈希的地址再计算 CSS 自身的哈希。模板通过 url() 输出带哈希的地址，
+    浏览器可以永久缓存；内容未变化的文件不会重复压缩。
+    """
+
+    def __init__(self, source_dir, build_dir):
+        self.source_dir = Path(source_dir).resolve()
+        self.build_dir = Path(build_dir).resolve()
+        self._manifest = {}   # 原始相对路径 -> 带哈希的相对路径
+        self._assets = {}     # 原始相对路径 -> (内容哈希, 可用的压缩编码)
+        self._hashed = {}     # 带哈希的相对路径 -> 原始相对路径
+        self._lock = threading.Lock()
+
+    # ---------------- 构建 ----------------
+
+    def _source_files(self):
+        for root, dirs, files in os.walk(self.source_dir):
+            dirs.sort()
+            for name in sorted(files):
+                yield Path(root, name).relative_to(self.source_dir).as_posix()
+
+    def _rewrite_css(self, rel_path, text, manifest):
+        """把 CSS 中的相对 url() 替换为带哈希的地址"""
+        base = posixpath.dirname(rel_path)
+
+        def replace(match):
+            quote, url = match.group(1), match.group(2).strip()
+            if url.startswith(("data:", "http:", "https:", "//", "/", "#")):
+                return match.group(0)
+            # 保留 ?#iefix 之类的后缀
+            parts = re.split(r"([?#])", url, maxsplit=1)
+            target, sep, suffix = parts if len(parts) == 3 else (url, "", "")
+            resolved = posixpath.normpath(posixpath.join(base, target))
+            hashed = manifest.get(resolved)
+            if hashed is None:
+                return match.group(0)
+            new_url = posixpath.relpath(hashed, base or ".") + sep + suffix
+            return f"url({quote}{new_url}{quote})"
+
+        return CSS_URL_RE.sub(replace, text)
+
+    def _write_variants(self, hashed_path, data, compressible):
+        """写入带哈希的文件及其压缩版本（已存在时跳过），返回可用的编码"""
+        target = self.build_dir / hashed_path
+        if not target.exists():
+            _write_atomic(target, data)
+
+        encodings = []
+        if not compressible:
+            return encodings
+        for encoding, suffix in ENCODINGS:
+            variant = target.with_name(target.name + suffix)
+            if variant.exists():
+                encodings.append(encoding)
+                continue
+            if encoding == "br":
+                if brotli is None:
+                    continue
+                compressed = brotli.compress(data, quality=11)
+            else:
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            # 压缩效果不明显时不保留压缩版本
+            if len(compressed) < len(data) * 0.95:
+                _write_atomic(variant, compressed)
+                encodings.append(encoding)
+        return encodings
+
+    def build(self):
+        """
+        构建所有静态资源并写入清单
+
+        Returns:
+            {原始相对路径: 带哈希的相对路径}
+        """
+        files = list(self._source_files())
+        # CSS 引用其他文件，最后处理，使其哈希包含被引用文件的新地址
+        files.sort(key=lambda p: p.endswith(".css"))
+
+        manifest, assets = {}, {}
+        for rel_path in files:
+            try:
+                with open(self.source_dir / rel_path, "rb") as f:
+                    data = f.read()
+                if rel_path.endswith(".css"):
+                    data = self._rewrite_css(rel_path, data.decode("utf-8"), manifest).encode("utf-8")
+                digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+                hashed_path = _hashed_name(rel_path, digest)
+                compressible = posixpath.splitext(rel_path)[1].lower() in COMPRESSIBLE_EXTENSIONS \
+                    and len(data) >= MIN_COMPRESS_SIZE
+                encodings = self._write_variants(hashed_path, data, compressible)
+            except (OSError, UnicodeDecodeError) as e:
+                logger.error(f"构建静态资源失败: {rel_path} - {str(e)}")
+                continue
+            manifest[rel_path] = hashed_path
+            assets[rel_path] = (digest, encodings)
+
+        _write_atomic(
+            self.build_dir / MANIFEST_NAME,
+            json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode("utf-8")
+        )
+        self._remove_stale(manifest)
+
+        with self._lock:
+            self._manifest = manifest
+            self._assets = assets
+            self._hashed = {hashed: rel for rel, hashed in manifest.items()}
+        logger.info(f"静态资源构建完成: {len(manifest)} 个文件" + ("" if brotli else "（未安装 brotli，只生成 gzip）"))
+        return manifest
+
+    def _remove_stale(self, manifest):
+        """删除旧版本的构建结果"""
+        keep = {MANIFEST_NAME}
+        for hashed_path in manifest.values():
+            keep.add(hashed_path)
+            keep.update(hashed_path + suffix for _, suffix in ENCODINGS)
+        for root, _, files in os.walk(self.build_dir):
+            for name in files:
+                path = Path(root, name)
+                rel_path = path.relative_to(self.build_dir).as_posix()
+                if rel_path not in keep and not name.endswith(".tmp"):
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+
+    # ---------------- 查找 ----------------
+
+    def url(self, rel_path):
+        """模板中使用的资源地址：已构建的文件返回带哈希的地址"""
+        rel_path = rel_path.lstrip("/")
+        return "/static/" + self._manifest.get(rel_path, rel_path)
+
+    def resolve(self, request_path, accept_encoding=None):
+        """
+        查找请求的静态文件
+
+        Args:
+            request_path: /static/ 之后的路径（带哈希或原始文件名）
+            accept_encoding: 请求的 Accept-Encoding 头
+
+        Returns:
+            StaticAsset；文件不存在时返回 None
+        """
+        request_path = posixpath.normpath(request_path.lstrip("/"))
+        with self._lock:
+            rel_path = self._hashed.get(request_path)
+            hashed = rel_path is not None
+            rel_path = rel_path or request_path
+            asset = self._assets.get(rel_path)
+            hashed_path = self._manifest.get(rel_path)
+
+        content_type = mimetypes.guess_type(rel_path)[0] or "application/octet-stream"
+        if asset is None:
+            # 构建之后新增的文件，直接从源目录读取
+            source = (self.source_dir / rel_path).resolve()
+            if not source.is_relative_to(self.source_dir) or not source.is_file():
+                return None
+            return StaticAsset(source, None, content_type)
+
+        digest, encodings = asset
+        cache_control = HASHED_CACHE_CONTROL if hashed else UNHASHED_CACHE_CONTROL
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, suffix in ENCODINGS:
+            if encoding in encodings and encoding in accepted:
+                return StaticAsset(self.build_dir / (hashed_path + suffix), f'"{digest}-{encoding}"',
+                                   content_type, encoding, cache_control, compressible=True)
+        return StaticAsset(self.build_dir / hashed_path, f'"{digest}"', content_type,
+                           cache_control=cache_control, compressible=bool(encodings))
+
+
+if __name__ == "__main__":
+    # 部署前单独构建：python static_assets.py
+    logging.basicConfig(level=logging.INFO)
+    base_dir = Path(__file__).parent
+    StaticAssets(base_dir / "static", base_dir / "static_build").build()
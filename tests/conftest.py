@@ -0,0 +1,8 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# 测试创建的数据库不写入程序目录；需在导入被测模块之前设置
+os.environ["ZAY_DATA_DIR"] = tempfile.mkdtemp(prefix="zay-cloud-test-")
+atexit.register(shutil.rmtree, os.environ["ZAY_DATA_DIR"], ignore_errors=True)
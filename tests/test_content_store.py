@@ -0,0 +1,52 @@
+import os
+import time
+
+import content_store
+from content_store import ContentStore, hash_file
+
+DATA = os.urandom(content_store.MIN_DEDUP_SIZE)
+
+
+def make_store(tmp_path):
+    root = tmp_path / "storage"
+    root.mkdir()
+    return ContentStore(root, db_path=str(tmp_path / "content_store.db"), enabled=True), root
+
+
+# 不支持 reflink 时不去重，文件不会与数据块或其他副本共享 inode
+def test_no_dedup_without_reflink(tmp_path, monkeypatch):
+    monkeypatch.setattr(content_store, "reflink_file", lambda src, dst: False)
+    store, root = make_store(tmp_path)
+    (root / "a.bin").write_bytes(DATA)
+    (root / "b.bin").write_bytes(DATA)
+
+    assert store.ingest(root / "a.bin") is None
+    assert store.ingest(root / "b.bin") is None
+    assert not store.blob_path(hash_file(root / "a.bin")).exists()
+    assert os.stat(root / "a.bin").st_nlink == 1
+
+
+# 旧版本硬链接去重的副本在垃圾回收时拆开，写入一个副本不会改写其他副本
+def test_garbage_collection_breaks_legacy_hardlinks(tmp_path):
+    store, root = make_store(tmp_path)
+    a, b = root / "a.bin", root / "b.bin"
+    a.write_bytes(DATA)
+    digest = hash_file(a)
+    blob = store.blob_path(digest)
+    blob.parent.mkdir(parents=True)
+    os.link(a, blob)
+    os.link(a, b)
+    st = a.stat()
+    conn = store._connect()
+    with conn:
+        conn.execute("INSERT INTO blobs VALUES (?, ?, ?, ?)", (digest, st.st_size, st.st_mtime_ns, time.time()))
+        conn.execute("INSERT INTO refs VALUES (?, ?, ?, ?, ?)", ("a.bin", digest, st.st_size, "origin", st.st_mtime_ns))
+        conn.execute("INSERT INTO refs VALUES (?, ?, ?, ?, ?)", ("b.bin", digest, st.st_size, "hardlink", st.st_mtime_ns))
+
+    assert store.collect_garbage() == 1
+    assert not blob.exists()
+    assert a.stat().st_nlink == 1 and b.stat().st_nlink == 1
+
+    with open(b, "r+b") as f:
+        f.write(b"changed")
+    assert a.read_bytes() == DATA
@@ -0,0 +1,28 @@
+import threading
+
+from coordination import Coordinator
+
+
+# 多个进程（各自的连接）同时修改同一个键时，每个修改都要保留
+def test_concurrent_update_state_keeps_every_change(tmp_path):
+    db_path = str(tmp_path / "coordination.db")
+    workers = [Coordinator(db_path=db_path) for _ in range(4)]
+
+    def record(name):
+        def update(revocations):
+            revocations = revocations or {}
+            revocations[name] = len(revocations)
+            return revocations
+        return update
+
+    def run(worker, index):
+        for i in range(25):
+            worker.update_state("principal_revocations", record(f"user-{index}-{i}"))
+
+    threads = [threading.Thread(target=run, args=(worker, index)) for index, worker in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(workers[0].get_state("principal_revocations")) == 100
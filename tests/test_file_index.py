@@ -0,0 +1,61 @@
+from watchdog.events import DirCreatedEvent, DirModifiedEvent, FileClosedEvent, FileOpenedEvent
+
+from file_index import FileIndex, _IndexEventHandler
+
+
+def make_index(tmp_path):
+    root = tmp_path / "storage"
+    (root / "photos" / "2024").mkdir(parents=True)
+    (root / "photos" / "2024" / "a.jpg").write_bytes(b"a")
+    index = FileIndex(root, db_path=str(tmp_path / "file_index.db"))
+    index.reconcile()
+    return index, root
+
+
+def record_scans(index, monkeypatch):
+    calls = []
+    scan = index.scan_directory
+
+    def recording(rel_path="", recursive=True):
+        calls.append((rel_path, recursive))
+        return scan(rel_path, recursive)
+
+    monkeypatch.setattr(index, "scan_directory", recording)
+    return calls
+
+
+# 目录中新增文件产生的修改事件只扫描该目录本身，不遍历子树
+def test_modified_directory_is_scanned_without_recursion(tmp_path, monkeypatch):
+    index, root = make_index(tmp_path)
+    calls = record_scans(index, monkeypatch)
+    handler = _IndexEventHandler(index)
+
+    (root / "photos" / "b.jpg").write_bytes(b"b")
+    handler.on_any_event(DirModifiedEvent(str(root / "photos")))
+    index._flush_pending()
+
+    assert calls == [("photos", False)]
+    assert [row[1] for row in index.list_children("photos")] == ["2024", "b.jpg"]
+
+
+def test_read_events_are_ignored(tmp_path):
+    index, root = make_index(tmp_path)
+    handler = _IndexEventHandler(index)
+
+    handler.on_any_event(FileOpenedEvent(str(root / "photos" / "2024" / "a.jpg")))
+    handler.on_any_event(FileClosedEvent(str(root / "photos" / "2024" / "a.jpg")))
+    assert index._pending == {}
+
+
+# 新建（或移入）的目录需要递归扫描，才能索引其中已有的内容
+def test_created_directory_is_indexed_with_contents(tmp_path):
+    index, root = make_index(tmp_path)
+    handler = _IndexEventHandler(index)
+
+    (root / "music" / "album").mkdir(parents=True)
+    (root / "music" / "album" / "song.mp3").write_bytes(b"s")
+    handler.on_any_event(DirCreatedEvent(str(root / "music")))
+    handler.on_any_event(DirModifiedEvent(str(root)))
+    index._flush_pending()
+
+    assert [row[1] for row in index.list_children("music/album")] == ["song.mp3"]
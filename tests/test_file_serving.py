@@ -0,0 +1,158 @@
+import os
+from email.utils import formatdate
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from file_serving import RangeNotSatisfiable, parse_range_header, serve_file
+
+DATA = bytes(range(256)) * 4  # 1024 字节
+SIZE = len(DATA)
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(DATA)
+    return path
+
+
+@pytest.fixture
+def client(path):
+    async def download(request):
+        max_bytes = request.query_params.get("max_bytes")
+        return serve_file(request, path, media_type="application/octet-stream",
+                          max_bytes=int(max_bytes) if max_bytes else None)
+
+    return TestClient(Starlette(routes=[Route("/file", download, methods=["GET", "HEAD"])]))
+
+
+def get(client, max_bytes=None, **headers):
+    url = f"/file?max_bytes={max_bytes}" if max_bytes is not None else "/file"
+    return client.get(url, headers=headers)
+
+
+# ---------------- Range 解析 ----------------
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=1000-", [(1000, SIZE - 1)]),
+    ("bytes=-100", [(SIZE - 100, SIZE - 1)]),
+    ("bytes=-5000", [(0, SIZE - 1)]),
+    ("bytes=0-10000", [(0, SIZE - 1)]),
+    ("bytes=0-99, 50-149, 150-199", [(0, 199)]),
+    ("bytes=500-599, 0-9", [(0, 9), (500, 599)]),
+    ("bytes=0-9, 2000-", [(0, 9)]),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", ["items=0-9", "bytes=", "bytes=abc", "bytes=9-0", "bytes=-"])
+def test_invalid_range_is_ignored(header):
+    assert parse_range_header(header, SIZE) is None
+
+
+@pytest.mark.parametrize("header, size", [("bytes=2000-", SIZE), ("bytes=-0", SIZE), ("bytes=-10", 0)])
+def test_unsatisfiable_range(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, size)
+
+
+# ---------------- 响应 ----------------
+
+def test_full_file(client):
+    response = get(client)
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=-100", SIZE - 100, SIZE - 1),
+    ("bytes=1000-", 1000, SIZE - 1),
+    ("bytes=10-19", 10, 19),
+])
+def test_single_range(client, header, start, end):
+    response = get(client, Range=header)
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{SIZE}"
+    assert response.content == DATA[start:end + 1]
+
+
+def test_multiple_ranges_are_sent_as_multipart(client):
+    response = get(client, Range="bytes=0-9, 500-509")
+    assert response.status_code == 206
+    content_type = response.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1]
+    assert int(response.headers["content-length"]) == len(response.content)
+
+    parts = response.content.split(f"--{boundary}".encode())
+    assert parts[0] == b"" and parts[-1] == b"--\r\n"
+    bodies = []
+    for part in parts[1:-1]:
+        head, _, body = part.partition(b"\r\n\r\n")
+        bodies.append((head.split(b"Content-Range: ")[1].decode(), body[:-2]))
+    assert bodies == [(f"bytes 0-9/{SIZE}", DATA[0:10]), (f"bytes 500-509/{SIZE}", DATA[500:510])]
+
+
+def test_overlapping_ranges_are_merged(client):
+    response = get(client, Range="bytes=0-99, 50-199")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 0-199/{SIZE}"
+    assert response.content == DATA[:200]
+
+
+@pytest.mark.parametrize("header", ["bytes=2000-", "bytes=2000-3000, 5000-"])
+def test_unsatisfiable_range_returns_416(client, header):
+    response = get(client, Range=header)
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{SIZE}"
+
+
+def test_if_range(client, path):
+    etag = get(client).headers["etag"]
+    last_modified = formatdate(os.stat(path).st_mtime, usegmt=True)
+
+    assert get(client, Range="bytes=0-9", **{"If-Range": etag}).status_code == 206
+    assert get(client, Range="bytes=0-9", **{"If-Range": last_modified}).status_code == 206
+    # 条件不成立时忽略 Range，返回整个文件
+    stale = get(client, Range="bytes=0-9", **{"If-Range": '"stale"'})
+    assert stale.status_code == 200 and stale.content == DATA
+    old_date = formatdate(os.stat(path).st_mtime - 3600, usegmt=True)
+    assert get(client, Range="bytes=0-9", **{"If-Range": old_date}).status_code == 200
+    # 弱 ETag 不能用于 If-Range
+    assert get(client, Range="bytes=0-9", **{"If-Range": f"W/{etag}"}).status_code == 200
+
+
+def test_conditional_requests_return_304(client, path):
+    etag = get(client).headers["etag"]
+    last_modified = formatdate(os.stat(path).st_mtime, usegmt=True)
+
+    response = get(client, **{"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert get(client, **{"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    assert get(client, **{"If-None-Match": "*"}).status_code == 304
+    assert get(client, **{"If-None-Match": '"other"'}).status_code == 200
+    assert get(client, **{"If-Modified-Since": last_modified}).status_code == 304
+    old_date = formatdate(os.stat(path).st_mtime - 3600, usegmt=True)
+    assert get(client, **{"If-Modified-Since": old_date}).status_code == 200
+    # 有 If-None-Match 时忽略 If-Modified-Since
+    assert get(client, **{"If-None-Match": '"other"', "If-Modified-Since": last_modified}).status_code == 200
+
+
+def test_max_bytes(client):
+    assert get(client, max_bytes=SIZE).status_code == 200
+    assert get(client, max_bytes=SIZE - 1).status_code == 403
+
+    response = get(client, max_bytes=100, Range="bytes=0-99")
+    assert response.status_code == 206 and response.content == DATA[:100]
+    response = get(client, max_bytes=100, Range="bytes=0-100")
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{SIZE}"
+    assert get(client, max_bytes=100, Range="bytes=0-49, 500-549").status_code == 206
+    assert get(client, max_bytes=100, Range="bytes=0-49, 500-550").status_code == 416
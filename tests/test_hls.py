@@ -0,0 +1,22 @@
+import asyncio
+
+from hls import HLSService
+
+
+# 转封装结束后不再算作正在处理，缓存清理才能淘汰它的分段
+def test_finished_remux_is_not_active(tmp_path, monkeypatch):
+    service = HLSService(tmp_path / "hls_cache")
+
+    async def remux(key, info):
+        return True
+
+    monkeypatch.setattr(service, "_remux", remux)
+
+    async def run():
+        task = service._ensure_remux("abc", {})
+        assert service.active_keys() == {"abc"}
+        await task
+        await asyncio.sleep(0)
+        return service.active_keys()
+
+    assert asyncio.run(run()) == set()
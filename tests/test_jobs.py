@@ -0,0 +1,53 @@
+import sqlite3
+
+import jobs
+from jobs import JobManager, SUCCEEDED
+
+
+def make_manager(tmp_path):
+    manager = JobManager(db_path=str(tmp_path / "jobs.db"))
+    manager.register("noop", lambda ctx: {"ok": True})
+    manager.start()
+    return manager
+
+
+# 同一时刻更新的两个任务都要推送：事件流按递增的序号而不是 updated_at 续传
+def test_changed_since_does_not_drop_jobs_with_same_timestamp(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs.time, "time", lambda: 1000.0)
+    manager = make_manager(tmp_path)
+    try:
+        first = manager.submit("noop", {}, owner="u")
+        second = manager.submit("noop", {}, owner="u")
+        assert manager.wait(first["id"], timeout=10)["state"] == SUCCEEDED
+        assert manager.wait(second["id"], timeout=10)["state"] == SUCCEEDED
+
+        events = manager.changed_since("u", 0)
+        seqs = [job["seq"] for job in events]
+        assert seqs == sorted(set(seqs))
+        assert {job["id"] for job in events} == {first["id"], second["id"]}
+
+        # 从较早结束的任务之后续传，另一个任务仍然会返回
+        earlier, later = events
+        assert manager.changed_since("u", earlier["seq"]) == [later]
+        assert manager.changed_since("u", manager.latest_seq()) == []
+    finally:
+        manager.stop()
+
+
+# 旧版本的数据库没有 seq 列，启动时自动补上
+def test_existing_database_is_migrated(tmp_path):
+    conn = sqlite3.connect(tmp_path / "jobs.db")
+    conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, title TEXT, owner TEXT, "
+                 "params TEXT NOT NULL, state TEXT NOT NULL, progress TEXT, result TEXT, error TEXT, "
+                 "attempts INTEGER NOT NULL DEFAULT 0, cancel_requested INTEGER NOT NULL DEFAULT 0, worker TEXT, "
+                 "created_at REAL NOT NULL, started_at REAL, finished_at REAL, updated_at REAL NOT NULL)")
+    conn.commit()
+    conn.close()
+
+    manager = make_manager(tmp_path)
+    try:
+        job = manager.submit("noop", {}, owner="u")
+        assert manager.wait(job["id"], timeout=10)["state"] == SUCCEEDED
+        assert manager.changed_since("u", 0)[-1]["id"] == job["id"]
+    finally:
+        manager.stop()
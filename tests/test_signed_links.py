@@ -0,0 +1,21 @@
+import os
+import stat
+
+import pytest
+
+from signed_links import InvalidLink, LinkSigner, load_or_create_secret
+
+
+def test_secret_is_generated_once_and_private(tmp_path):
+    path = tmp_path / "config" / "link_secret"
+    secret = load_or_create_secret(str(path))
+
+    assert len(secret) >= 32
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert load_or_create_secret(str(path)) == secret
+
+
+def test_links_from_another_secret_are_rejected(tmp_path):
+    token, _ = LinkSigner(load_or_create_secret(str(tmp_path / "a"))).sign("video.mp4", 2**40)
+    with pytest.raises(InvalidLink):
+        LinkSigner(load_or_create_secret(str(tmp_path / "b"))).verify(token)
@@ -0,0 +1,23 @@
+from source_index import SourceIndex
+
+
+# 原地追加内容不会改变目录的修改时间，重新扫描后仍应按新大小找到文件
+def test_refresh_picks_up_file_grown_in_place(tmp_path):
+    root = tmp_path / "downloads"
+    (root / "sub").mkdir(parents=True)
+    video = root / "sub" / "v.mp4"
+    video.write_bytes(b"x" * 10)
+
+    index = SourceIndex(db_path=str(tmp_path / "source_index.db"))
+    index.set_roots([root])
+    index.refresh()
+    assert index.lookup("v.mp4", 10) == (str(video), str(root / "sub"))
+
+    with open(video, "ab") as f:
+        f.write(b"y" * 90)
+    index.refresh()
+
+    assert index.lookup("v.mp4", 100) == (str(video), str(root / "sub"))
+    assert index.lookup("v.mp4", 10) is None
+    # 没有变化时不重写任何目录
+    assert index.refresh() == 0
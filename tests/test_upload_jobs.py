@@ -0,0 +1,53 @@
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+from principals import Principal
+
+
+# main 中的存储、配置和临时目录都是相对路径：在临时工作目录中导入并启动应用，
+# 静态资源也生成到该目录；不参与主进程选举（不启动 WebDAV、目录监听和外部目录索引），也不打开浏览器
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as mp:
+        workdir = tmp_path_factory.mktemp("workdir")
+        mp.chdir(workdir)
+        mp.setattr("webbrowser.open", lambda *args, **kwargs: None)
+        main = importlib.import_module("main")
+        mp.setattr(main.static_assets, "build_dir", workdir / "static_build")
+        mp.setattr(main.coordinator, "try_acquire", lambda *args, **kwargs: False)
+        mp.setitem(main.app.dependency_overrides, main.get_current_user, lambda: Principal(1, "tester"))
+        yield main
+
+
+# 应用的线程池在关闭时停止，整个模块共用一个客户端
+@pytest.fixture(scope="module")
+def test_client(main):
+    with TestClient(main.app) as client:
+        yield client
+
+
+def upload_through_job(main, test_client, file_name, content):
+    response = test_client.post("/api/upload/sessions", json={
+        "fileName": file_name, "directory": "uploads", "fileSize": len(content), "chunkSize": len(content)
+    })
+    assert response.status_code == 200, response.text
+    session_id = response.json()["session_id"]
+
+    response = test_client.put(f"/api/upload/sessions/{session_id}/chunks/0", content=content)
+    assert response.status_code == 200, response.text
+
+    response = test_client.post(f"/api/upload/sessions/{session_id}/complete")
+    assert response.status_code == 202, response.text
+    return main.job_manager.wait(response.json()["job"]["id"], timeout=30)
+
+
+# 媒体文件合并完成后在后台任务线程中安排缩略图和媒体信息，任务应正常结束
+@pytest.mark.parametrize("file_name", ["song.mp3", "notes.txt"])
+def test_upload_job_succeeds(main, test_client, file_name):
+    job = upload_through_job(main, test_client, file_name, b"0123456789" * 100)
+
+    assert job["state"] == "succeeded", job.get("error")
+    assert (main.FILE_STORAGE_PATH / "uploads" / file_name).stat().st_size == 1000
+    assert not main.coordinator.is_leader
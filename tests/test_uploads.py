@@ -0,0 +1,38 @@
+from uploads import UploadSessionManager
+
+
+def start(manager, owner="alice", last_modified=1000, sha256=None):
+    return manager.create(owner, "a.bin", "docs", 2048, 1024, sha256, last_modified)
+
+
+def test_same_file_resumes_with_received_chunks(tmp_path):
+    manager = UploadSessionManager(tmp_path)
+    session = start(manager)
+    manager.mark_received(session, 0)
+
+    resumed = start(UploadSessionManager(tmp_path))
+    assert resumed.session_id == session.session_id
+    assert resumed.missing_chunks() == [1]
+
+
+def test_other_file_or_user_gets_its_own_session(tmp_path):
+    manager = UploadSessionManager(tmp_path)
+    session = start(manager)
+    manager.mark_received(session, 0)
+
+    # 同名同大小但修改时间不同的文件、或者其他用户上传，都不能续传到已有的 .part 中
+    other_file = start(manager, last_modified=2000)
+    other_user = start(manager, owner="bob")
+    assert len({session.session_id, other_file.session_id, other_user.session_id}) == 3
+    assert other_file.missing_chunks() == [0, 1]
+    assert other_user.missing_chunks() == [0, 1]
+
+
+def test_mismatched_sha256_restarts_session(tmp_path):
+    manager = UploadSessionManager(tmp_path)
+    session = start(manager, sha256="aa" * 32)
+    manager.mark_received(session, 0)
+
+    restarted = start(manager, sha256="bb" * 32)
+    assert restarted.expected_sha256 == "bb" * 32
+    assert restarted.missing_chunks() == [0, 1]
@@ -0,0 +1,242 @@
+import os
+import asyncio
+import itertools
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from view import get_media_thumbnail, get_cached_thumbnail, thumbnail_cache_key, DEFAULT_VARIANT
+
+logger = logging.getLogger("thumbnail_service")
+
+# 优先级：数值越小越先处理
+PRIORITY_VISIBLE = 0      # 页面上正在显示的缩略图
+PRIORITY_BACKGROUND = 10  # 新上传文件的预生成
+
+# 后台预生成队列的上限，超出后丢弃新的预生成任务（用户访问时仍会按需生成）
+MAX_BACKGROUND_JOBS = 10000
+
+# 内存热缓存上限（字节），保存最近访问的缩略图数据
+HOT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+def _default_workers():
+    return max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class HotCache:
+    """按字节数限制的内存 LRU 缓存"""
+
+    def __init__(self, max_bytes=HOT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        data = self._items.get(key)
+        if data is not None:
+            self._items.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._items[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class ThumbnailService:
+    """
+    缩略图生成服务
+
+    解码视频帧等耗时操作在进程池中执行，不阻塞事件循环，也不受 GIL 限制。
+    任务按优先级排队（页面可见的请求优先于后台预生成），
+    同一文件的并发请求合并为一个任务，共享同一个结果。
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or _default_workers()
+        self._pool = None
+        self._queue = None
+        self._jobs = {}         # (file_path, media_type, variant) -> Future
+        self._priorities = {}   # 任务当前排队的最高优先级
+        self._running = set()
+        self._dispatchers = []
+        self._counter = itertools.count()
+        self._background = set()  # 由后台预生成提交的任务
+        self.hot_cache = HotCache()
+        # 无法生成缩略图的文件（例如没有封面的音频），文件未变化时不再重复尝试
+        self._failed = OrderedDict()
+
+    # ---------------- 生命周期 ----------------
+
+    def _create_pool(self):
+        try:
+            # Linux 上使用 fork，避免 spawn 方式在每个工作进程中重新导入主程序
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+            else:
+                context = multiprocessing.get_context()
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        except (OSError, NotImplementedError, ImportError) as e:
+            logger.warning(f"无法创建进程池，缩略图改用线程池生成: {str(e)}")
+            return ThreadPoolExecutor(max_workers=self.workers)
+
+    async def start(self):
+        """在事件循环中启动调度任务，并预先创建工作进程"""
+        self._queue = asyncio.PriorityQueue()
+        self._pool = self._create_pool()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._pool, _warm_up)
+        except Exception as e:
+            logger.warning(f"缩略图进程池预热失败: {str(e)}")
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        logger.info(f"缩略图服务已启动，工作进程数: {self.workers}")
+
+    async def stop(self):
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._dispatchers = []
+        for future in self._jobs.values():
+            if not future.done():
+                future.cancel()
+        self._jobs.clear()
+        self._priorities.clear()
+        self._background.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # ---------------- 提交任务 ----------------
+
+    def _submit(self, key, priority):
+        future = self._jobs.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._jobs[key] = future
+        elif key in self._running or self._priorities.get(key, priority) <= priority:
+            return future
+
+        # 新任务，或已排队的任务被提升了优先级（旧的队列项出队时会被跳过）
+        self._priorities[key] = priority
+        self._queue.put_nowait((priority, next(self._counter), key))
+        return future
+
+    async def get_thumbnail(self, file_path, media_type, variant=DEFAULT_VARIANT, priority=PRIORITY_VISIBLE):
+        """
+        获取缩略图路径，已缓存时直接返回，否则排队生成
+
+        Returns:
+            缩略图路径，无法生成时返回 None
+        """
+        cached = get_cached_thumbnail(file_path, media_type, variant)
+        if cached:
+            return cached
+        if self._queue is None:
+            # 服务未启动（例如脚本中直接调用）时在线程中生成
+            return await asyncio.to_thread(get_media_thumbnail, file_path, media_type, variant)
+        future = self._submit((file_path, media_type, variant), priority)
+        # 请求被取消时不影响其他等待同一任务的请求
+        return await asyncio.shield(future)
+
+    async def get_thumbnail_data(self, file_path, media_type, variant=DEFAULT_VARIANT, priority=PRIORITY_VISIBLE):
+        """
+        获取缩略图数据，优先从内存热缓存读取
+
+        Returns:
+            (缓存键, 图片数据)，无法生成时返回 None
+        """
+        try:
+            key = thumbnail_cache_key(file_path, media_type, variant)
+        except OSError:
+            return None
+        data = self.hot_cache.get(key)
+        if data is not None:
+            return key, data
+        if key in self._failed:
+            return None
+
+        thumbnail_path = await self.get_thumbnail(file_path, media_type, variant, priority)
+        if not thumbnail_path:
+            self._failed[key] = True
+            if len(self._failed) > MAX_BACKGROUND_JOBS:
+                self._failed.popitem(last=False)
+            return None
+        try:
+            data = await asyncio.to_thread(_read_bytes, thumbnail_path)
+        except OSError:
+            return None
+        self.hot_cache.put(key, data)
+        return key, data
+
+    def enqueue(self, file_path, media_type, variant=DEFAULT_VARIANT):
+        """以后台优先级预生成缩略图，不等待结果"""
+        if self._queue is None or media_type not in ("video", "audio"):
+            return
+        key = (str(file_path), media_type, variant)
+        if key in self._jobs:
+            return
+        if len(self._background) >= MAX_BACKGROUND_JOBS:
+            return
+        self._background.add(key)
+        self._submit(key, PRIORITY_BACKGROUND)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": len(self._running),
+            "pending": len(self._jobs),
+            "hot_cache_bytes": self.hot_cache.size,
+        }
+
+    # ---------------- 调度 ----------------
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, _, key = await self._queue.get()
+            future = self._jobs.get(key)
+            # 已完成、正在运行或已被更高优先级的队列项取代的任务直接跳过
+            if future is None or future.done() or key in self._running or self._priorities.get(key) != priority:
+                continue
+
+            self._running.add(key)
+            result = None
+            pool = self._pool
+            try:
+                result = await loop.run_in_executor(pool, get_media_thumbnail, *key)
+            except BrokenProcessPool:
+                # 某个工作进程崩溃（例如解码损坏的视频），重建进程池（多个调度任务只重建一次）
+                logger.error(f"缩略图工作进程异常退出，重建进程池: {key[0]}")
+                if self._pool is pool:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = self._create_pool()
+            except Exception as e:
+                logger.error(f"生成缩略图失败: {key[0]} - {str(e)}")
+            finally:
+                self._running.discard(key)
+                self._jobs.pop(key, None)
+                self._priorities.pop(key, None)
+                self._background.discard(key)
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,518 @@
+import os
+import json
+import time
+import base64
+import errno
+import shutil
+import hashlib
+import threading
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger("uploads")
+
+# 写入 .part 文件时缓冲的数据量
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# 没有 os.pwrite 的平台（Windows）上，lseek + write 需要串行化
+_seek_write_lock = threading.Lock()
+
+# 多个工作进程写同一会话时用文件锁串行化状态更新（Windows 上没有 fcntl，只支持单进程）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# xxhash 为可选依赖，未安装时只支持 hashlib 提供的算法
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def new_hasher(algorithm: str):
+    """
+    创建哈希对象，支持 hashlib 的算法（sha256、sha1、md5 等）以及安装了 xxhash 时的 xxh64/xxh3_64/xxh3_128
+
+    Raises:
+        ValueError: 不支持的算法
+    """
+    name = algorithm.strip().lower().replace("-", "")
+    if name.startswith("xxh"):
+        if xxhash is None or not hasattr(xxhash, name):
+            raise ValueError(f"不支持的哈希算法: {algorithm}")
+        return getattr(xxhash, name)()
+    if name not in hashlib.algorithms_available:
+        raise ValueError(f"不支持的哈希算法: {algorithm}")
+    return hashlib.new(name)
+
+
+def parse_hash_spec(spec: str):
+    """解析 "算法=十六进制摘要" 或 "算法:十六进制摘要" 格式的哈希声明，返回 (算法, 摘要)"""
+    for sep in ("=", ":"):
+        if sep in spec:
+            algorithm, _, digest = spec.partition(sep)
+            return algorithm.strip(), digest.strip().lower()
+    raise ValueError(f"无效的哈希格式: {spec}")
+
+
+async def hashing_stream(stream, *hashers):
+    """在转发字节流的同时更新哈希对象"""
+    async for piece in stream:
+        for hasher in hashers:
+            hasher.update(piece)
+        yield piece
+
+
+def open_part_file(part_path: Path, file_size: int) -> int:
+    """
+    打开（必要时创建）分片上传的 .part 文件，并预分配到目标大小
+
+    文件通过 ftruncate 扩展为稀疏文件，多个分片可以同时打开并按偏移写入。
+
+    Returns:
+        文件描述符
+    """
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        if os.fstat(fd).st_size != file_size:
+            os.ftruncate(fd, file_size)
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+
+def write_at(fd: int, data, offset: int):
+    """在指定偏移处写入全部数据"""
+    view = memoryview(data)
+    if hasattr(os, "pwrite"):
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+        return
+
+    with _seek_write_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+
+
+async def write_stream_at(loop, executor, fd: int, stream, offset: int, limit: int):
+    """
+    把异步字节流按偏移写入文件，数据缓冲到 WRITE_BUFFER_SIZE 后在线程池中写入
+
+    Args:
+        loop: 事件循环
+        executor: 执行写入的线程池
+        fd: 文件描述符
+        stream: 异步字节块迭代器
+        offset: 起始偏移
+        limit: 允许写入的最大字节数
+
+    Returns:
+        实际写入的字节数
+
+    Raises:
+        ValueError: 数据超过 limit
+    """
+    buffer = bytearray()
+    written = 0
+
+    async for piece in stream:
+        if not piece:
+            continue
+        if written + len(buffer) + len(piece) > limit:
+            raise ValueError(f"分片数据超过预期大小 {limit} 字节")
+        buffer += piece
+        if len(buffer) >= WRITE_BUFFER_SIZE:
+            data, buffer = bytes(buffer), bytearray()
+            await loop.run_in_executor(executor, write_at, fd, data, offset + written)
+            written += len(data)
+
+    if buffer:
+        data = bytes(buffer)
+        await loop.run_in_executor(executor, write_at, fd, data, offset + written)
+        written += len(data)
+
+    return written
+
+
+async def iter_upload_file(upload_file, chunk_size=WRITE_BUFFER_SIZE):
+    """把 UploadFile 转换为异步字节块迭代器，避免一次性读入内存"""
+    while True:
+        data = await upload_file.read(chunk_size)
+        if not data:
+            break
+        yield data
+
+
+def finalize_part(part_path: Path, target_path: Path):
+    """把完成的 .part 文件原子地移动到目标位置（跨文件系统时回退为移动复制）"""
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(part_path, target_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(str(part_path), str(target_path))
+
+
+class UploadSession:
+    """
+    一次可续传的分片上传
+
+    已接收的分片记录在位图中，并与 .part 文件一起持久化到临时目录，
+    服务重启后仍可查询状态并继续上传缺失的分片。
+    """
+
+    def __init__(self, session_id, file_name, directory, file_size, chunk_size,
+                 bitmap=None, created_at=None, updated_at=None, expected_sha256=None,
+                 owner=None, last_modified=None):
+        self.session_id = session_id
+        self.file_name = file_name
+        self.directory = directory
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.total_chunks = max((file_size + chunk_size - 1) // chunk_size, 1)
+        self.bitmap = bitmap if bitmap is not None else bytearray((self.total_chunks + 7) // 8)
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+        self.expected_sha256 = expected_sha256
+        # 会话所属用户和客户端文件的修改时间：只有同一用户上传同一个文件时才能续传
+        self.owner = owner
+        self.last_modified = last_modified
+
+        # 以下状态只保存在内存中：正在写入的分片，以及按顺序累积的整个文件 SHA-256
+        self.inflight = set()
+        self.digest_lock = threading.Lock()
+        self.hasher = hashlib.sha256()
+        self.hashed_chunks = 0
+        # 最近一次读取/写入的状态文件版本 (inode, mtime_ns)，用于发现其他工作进程的更新
+        self.state_version = None
+
+    def to_dict(self):
+        """将会话转换为字典（用于保存）"""
+        return {
+            "session_id": self.session_id,
+            "file_name": self.file_name,
+            "directory": self.directory,
+            "file_size": self.file_size,
+            "chunk_size": self.chunk_size,
+            "bitmap": base64.b64encode(bytes(self.bitmap)).decode("ascii"),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "expected_sha256": self.expected_sha256,
+            "owner": self.owner,
+            "last_modified": self.last_modified,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典创建会话对象"""
+        return cls(
+            session_id=data["session_id"],
+            file_name=data["file_name"],
+            directory=data.get("directory", ""),
+            file_size=data["file_size"],
+            chunk_size=data["chunk_size"],
+            bitmap=bytearray(base64.b64decode(data.get("bitmap", ""))),
+            created_at=data.get("created_at"),
+            updated_at=data.get("updated_at"),
+            expected_sha256=data.get("expected_sha256"),
+            owner=data.get("owner"),
+            last_modified=data.get("last_modified"),
+        )
+
+    def has_chunk(self, index):
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def set_chunk(self, index):
+        self.bitmap[index >> 3] |= 1 << (index & 7)
+
+    def chunk_range(self, index):
+        """分片在文件中的 (偏移, 长度)"""
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.file_size - offset)
+
+    def missing_chunks(self):
+        return [i for i in range(self.total_chunks) if not self.has_chunk(i)]
+
+    def to_status(self):
+        """会话状态（用于接口返回）"""
+        missing = self.missing_chunks()
+        return {
+            "session_id": self.session_id,
+            "fileName": self.file_name,
+            "directory": self.directory,
+            "fileSize": self.file_size,
+            "chunkSize": self.chunk_size,
+            "totalChunks": self.total_chunks,
+            "receivedChunks": self.total_chunks - len(missing),
+            "missingChunks": missing,
+            "bitmap": base64.b64encode(bytes(self.bitmap)).decode("ascii"),
+            "complete": not missing,
+            "inflightChunks": sorted(self.inflight),
+        }
+
+    def digest_candidate(self, index):
+        """
+        如果分片正好是整个文件哈希的下一段，返回当前哈希状态的副本供流式写入时更新，否则返回 None
+        """
+        with self.digest_lock:
+            if self.hashed_chunks == index:
+                return self.hasher.copy()
+        return None
+
+    def commit_digest(self, index, candidate):
+        """分片校验通过后，采用流式计算得到的哈希状态"""
+        with self.digest_lock:
+            if candidate is not None and self.hashed_chunks == index:
+                self.hasher = candidate
+                self.hashed_chunks = index + 1
+
+    def advance_digest(self, part_path, read_size=1024 * 1024):
+        """
+        用 .part 文件中已接收的连续分片推进整个文件的哈希
+
+        只有乱序到达的分片需要从文件读回（刚写入的数据通常仍在页缓存中）。
+        """
+        with self.digest_lock:
+            if self.hashed_chunks >= self.total_chunks or not self.has_chunk(self.hashed_chunks):
+                return
+            with open(part_path, "rb") as f:
+                while self.hashed_chunks < self.total_chunks and self.has_chunk(self.hashed_chunks):
+                    offset, length = self.chunk_range(self.hashed_chunks)
+                    f.seek(offset)
+                    while length > 0:
+                        data = f.read(min(read_size, length))
+                        if not data:
+                            raise IOError(f"分片数据不完整: {self.hashed_chunks}")
+                        self.hasher.update(data)
+                        length -= len(data)
+                    self.hashed_chunks += 1
+
+    def file_digest(self, part_path):
+        """返回整个文件的 SHA-256（必要时补齐尚未计入的分片）"""
+        self.advance_digest(part_path)
+        with self.digest_lock:
+            if self.hashed_chunks < self.total_chunks:
+                raise ValueError("分片尚未全部到达，无法计算文件摘要")
+            return self.hasher.hexdigest()
+
+
+class UploadSessionManager:
+    """上传会话管理器：创建、查询、写入分片、完成与中止会话，并定期清理过期会话"""
+
+    def __init__(self, temp_dir: Path, ttl_hours: float = 24):
+        self.temp_dir = Path(temp_dir)
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_hours * 3600
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_session_id(owner, file_name, directory, file_size, last_modified=None):
+        """根据用户、目标目录、文件名、大小和修改时间生成确定性的会话 ID（与进程无关）"""
+        key = f"{owner}\0{directory}\0{file_name}\0{file_size}\0{last_modified}".encode("utf-8")
+        return hashlib.sha256(key).hexdigest()[:32]
+
+    def part_path(self, session_id):
+        return self.temp_dir / f"{session_id}.part"
+
+    def _state_path(self, session_id):
+        return self.temp_dir / f"{session_id}.json"
+
+    def _save(self, session):
+        """原子地保存会话状态"""
+        state_path = self._state_path(session.session_id)
+        tmp_path = state_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(session.to_dict(), f)
+        os.replace(tmp_path, state_path)
+        session.state_version = self._state_version(session.session_id)
+
+    def _state_version(self, session_id):
+        st = os.stat(self._state_path(session_id))
+        return st.st_ino, st.st_mtime_ns
+
+    @contextmanager
+    def _process_lock(self, session_id):
+        """跨进程锁定会话（锁在 .part 文件上，其 inode 在会话期间不变）"""
+        if fcntl is None:
+            yield
+            return
+        try:
+            fd = os.open(self.part_path(session_id), os.O_RDWR)
+        except FileNotFoundError:
+            yield
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _merge_saved(self, session):
+        """
+        合并其他工作进程保存的分片位图
+
+        Returns:
+            False 表示状态文件已不存在（会话已被其他进程完成或中止）
+        """
+        try:
+            version = self._state_version(session.session_id)
+        except FileNotFoundError:
+            return False
+        if version == session.state_version:
+            return True
+        try:
+            with open(self._state_path(session.session_id), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return True
+        saved = base64.b64decode(data.get("bitmap", ""))
+        for i, byte in enumerate(saved[:len(session.bitmap)]):
+            session.bitmap[i] |= byte
+        session.updated_at = max(session.updated_at, data.get("updated_at") or 0)
+        session.expected_sha256 = data.get("expected_sha256") or session.expected_sha256
+        session.state_version = version
+        return True
+
+    def _remove_files(self, session_id):
+        for path in (self.part_path(session_id), self._state_path(session_id)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def get(self, session_id):
+        """获取会话（内存中没有时从磁盘加载）"""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                # 多进程部署时其他进程可能已写入分片或完成了会话
+                if self._merge_saved(session):
+                    return session
+                self.sessions.pop(session_id, None)
+                return None
+            state_path = self._state_path(session_id)
+            if not state_path.exists():
+                return None
+            try:
+                version = self._state_version(session_id)
+                with open(state_path, "r", encoding="utf-8") as f:
+                    session = UploadSession.from_dict(json.load(f))
+            except Exception as e:
+                logger.error(f"加载上传会话失败: {session_id} - {str(e)}")
+                return None
+            session.state_version = version
+            self.sessions[session_id] = session
+            return session
+
+    def create(self, owner, file_name, directory, file_size, chunk_size, expected_sha256=None,
+               last_modified=None):
+        """
+        创建上传会话；同一用户的同一文件的会话已存在且分片大小一致时直接复用，以便断点续传
+
+        已有会话的所属用户、修改时间或文件摘要与本次请求不一致时，说明是另一个文件，
+        丢弃已上传的分片重新开始，不会把不同文件的数据拼接在一起。
+
+        Args:
+            owner: 上传用户
+            expected_sha256: 客户端提供的整个文件 SHA-256，完成时校验
+            last_modified: 客户端文件的修改时间，用于区分同名同大小的不同文件
+        """
+        if file_size < 0 or chunk_size <= 0:
+            raise ValueError("无效的文件大小或分片大小")
+        session_id = self.make_session_id(owner, file_name, directory, file_size, last_modified)
+        session = self.get(session_id)
+        expected_sha256 = expected_sha256.lower() if expected_sha256 else None
+
+        with self._lock:
+            if session is not None and self._can_resume(session, owner, chunk_size, expected_sha256, last_modified):
+                if expected_sha256 and session.expected_sha256 != expected_sha256:
+                    session.expected_sha256 = expected_sha256
+                    self._save(session)
+                return session
+            if session is not None:
+                logger.info(f"文件信息与已有会话不一致，重新开始上传会话: {session_id}")
+                self._remove_files(session_id)
+
+            session = UploadSession(session_id, file_name, directory, file_size, chunk_size,
+                                    expected_sha256=expected_sha256, owner=owner, last_modified=last_modified)
+            fd = open_part_file(self.part_path(session_id), file_size)
+            os.close(fd)
+            self._save(session)
+            self.sessions[session_id] = session
+            return session
+
+    @staticmethod
+    def _can_resume(session, owner, chunk_size, expected_sha256, last_modified):
+        """已有会话是否属于同一用户的同一个文件"""
+        if session.owner != owner or session.last_modified != last_modified:
+            return False
+        if session.chunk_size != chunk_size:
+            return False
+        return not (expected_sha256 and session.expected_sha256 and session.expected_sha256 != expected_sha256)
+
+    def mark_received(self, session, index):
+        """记录分片已写入并持久化位图"""
+        with self._lock, self._process_lock(session.session_id):
+            self._merge_saved(session)
+            session.set_chunk(index)
+            session.updated_at = time.time()
+            self._save(session)
+
+    def finalize(self, session, target_path: Path):
+        """所有分片到齐后把 .part 文件移动到目标位置并删除会话"""
+        with self._lock:
+            finalize_part(self.part_path(session.session_id), target_path)
+            self._remove_files(session.session_id)
+            self.sessions.pop(session.session_id, None)
+
+    def abort(self, session_id):
+        """中止会话并删除已上传的数据"""
+        with self._lock:
+            self.sessions.pop(session_id, None)
+            existed = self._state_path(session_id).exists()
+            self._remove_files(session_id)
+            return existed
+
+    def cleanup_expired(self):
+        """
+        清理超过 TTL 未更新的会话，以及没有会话记录的残留文件
+
+        Returns:
+            清理的条目数量
+        """
+        now = time.time()
+        cleaned = 0
+        for path in list(self.temp_dir.iterdir()):
+            try:
+                if now - path.stat().st_mtime < self.ttl_seconds:
+                    continue
+                if path.is_dir():
+                    # 旧版本按分片文件存储的临时目录
+                    shutil.rmtree(path)
+                elif path.suffix == ".json":
+                    self.abort(path.stem)
+                else:
+                    with self._lock:
+                        if path.stem in self.sessions:
+                            continue
+                    if not self._state_path(path.stem).exists():
+                        path.unlink()
+                    else:
+                        continue
+                cleaned += 1
+                logger.info(f"已清理过期上传数据: {path.name}")
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.error(f"清理上传数据失败: {path} - {str(e)}")
+        return cleaned
@@ -1,8 +1,11 @@
 import os
 import io
 import uuid
+import hashlib
+import shutil
+import subprocess
 import cv2
-from PIL import Image
+from PIL import Image, ImageStat
 from mutagen.mp3 import MP3
 from mutagen.id3 import ID3
 from mutagen.flac import FLAC
@@ -16,7 +19,212 @@ from typing import Optional
 THUMBNAIL_CACHE_DIR = os.path.join("static", "thumbnails")
 os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
 
-def get_video_thumbnail(video_path, max_size=(320, 240), timestamp=3.0):
+# 缩略图尺寸规格：名称 -> (最大尺寸, JPEG 质量)
+THUMBNAIL_VARIANTS = {
+    "list": ((96, 96), 75),        # 列表视图小图标
+    "grid": ((320, 240), 80),      # 卡片视图
+    "retina": ((640, 480), 80),    # 高分屏卡片视图
+    "poster": ((1280, 720), 85),   # 播放器封面
+}
+DEFAULT_VARIANT = "grid"
+
+# 缩略图磁盘缓存上限（字节），超出后按最近访问时间淘汰
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 命中缓存时刷新访问时间的最小间隔（秒），避免每次访问都写入文件元数据
+ACCESS_TOUCH_INTERVAL = 3600
+
+# ffmpeg/ffprobe 为可选依赖，存在时用关键帧截取视频缩略图
+FFMPEG_PATH = shutil.which("ffmpeg")
+FFPROBE_PATH = shutil.which("ffprobe")
+
+# 生成单个视频缩略图的时间预算（秒）
+THUMBNAIL_TIME_BUDGET = 8.0
+
+# 平均亮度或亮度标准差低于阈值的帧视为黑屏
+BLACK_FRAME_MEAN = 16
+BLACK_FRAME_STDDEV = 6
+
+def thumbnail_cache_key(file_path, media_type, variant=DEFAULT_VARIANT, st=None):
+    """
+    缩略图缓存键：由文件路径、大小、修改时间和尺寸规格决定，
+    文件被替换或修改后自动对应新的缩略图，旧缩略图由 LRU 淘汰
+    """
+    st = st or os.stat(file_path)
+    raw = f"{os.path.abspath(file_path)}\0{st.st_size}\0{st.st_mtime_ns}\0{variant}"
+    return f"{media_type}_{variant}_{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+def thumbnail_cache_path(file_path, media_type, variant=DEFAULT_VARIANT, st=None):
+    """缩略图在缓存目录中的路径"""
+    key = thumbnail_cache_key(file_path, media_type, variant, st)
+    return os.path.join(THUMBNAIL_CACHE_DIR, f"{key}.jpg")
+
+def touch_thumbnail(thumbnail_path):
+    """记录缩略图被访问（修改时间即最近访问时间，用于 LRU 淘汰）"""
+    try:
+        if time.time() - os.path.getmtime(thumbnail_path) > ACCESS_TOUCH_INTERVAL:
+            os.utime(thumbnail_path)
+    except OSError:
+        pass
+
+def get_cached_thumbnail(file_path, media_type, variant=DEFAULT_VARIANT):
+    """
+    返回已生成的缩略图路径，不触发生成（可在事件循环中直接调用）
+    
+    Returns:
+        缩略图路径或None
+    """
+    try:
+        thumbnail_path = thumbnail_cache_path(file_path, media_type, variant)
+    except OSError:
+        return None
+    if not os.path.exists(thumbnail_path):
+        return None
+    touch_thumbnail(thumbnail_path)
+    return thumbnail_path
+
+def save_thumbnail(img, thumbnail_path, quality=80):
+    """先写入临时文件再原子替换，避免并发读取到不完整的图片"""
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    tmp_path = f"{thumbnail_path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        img.save(tmp_path, "JPEG", quality=quality)
+        os.replace(tmp_path, thumbnail_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _probe_duration(video_path, timeout):
+    """用 ffprobe 读取容器记录的时长（秒），失败时返回 None"""
+    if not FFPROBE_PATH:
+        return None
+    try:
+        result = subprocess.run(
+            [FFPROBE_PATH, "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", video_path],
+            capture_output=True, timeout=timeout
+        )
+        return float(result.stdout.strip() or 0) or None
+    except (subprocess.SubprocessError, ValueError, OSError):
+        return None
+
+def _candidate_timestamps(duration, timestamp):
+    """
+    依次尝试的截帧时间点：优先指定时间点，再取视频中段的几个位置，
+    跳过片头黑屏；时长未知时按固定秒数尝试
+    """
+    if not duration or duration <= 0:
+        return [timestamp, timestamp * 4, 0.0]
+    if duration <= timestamp:
+        return [duration / 2, 0.0]
+    candidates = [timestamp] + [duration * ratio for ratio in (0.1, 0.25, 0.5)]
+    # 去掉重复和超出时长的时间点，保持尝试顺序
+    seen, result = set(), []
+    for t in candidates:
+        t = round(min(t, duration * 0.95), 2)
+        if t not in seen:
+            seen.add(t)
+            result.append(t)
+    return result
+
+def _is_black_frame(img):
+    """画面几乎全黑（或单一颜色）的帧不适合作为缩略图"""
+    stat = ImageStat.Stat(img.convert("L").resize((64, 64)))
+    return stat.mean[0] < BLACK_FRAME_MEAN or stat.stddev[0] < BLACK_FRAME_STDDEV
+
+def _ffmpeg_frame(video_path, timestamp, max_size, timeout):
+    """
+    用 ffmpeg 截取 timestamp 附近的关键帧
+
+    -ss 放在 -i 之前按时间跳到最近的关键帧，-skip_frame nokey 只解码关键帧，
+    不需要从头解码；缩放在解码后立即进行，输出单帧 JPEG。
+    """
+    width, height = max_size
+    cmd = [
+        FFMPEG_PATH, "-v", "error", "-threads", "1",
+        "-skip_frame", "nokey", "-ss", f"{timestamp:.2f}", "-i", video_path,
+        "-an", "-sn", "-dn", "-frames:v", "1",
+        "-vf", f"scale=w={width}:h={height}:force_original_aspect_ratio=decrease",
+        "-f", "image2pipe", "-vcodec", "mjpeg", "-",
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    except (subprocess.SubprocessError, OSError):
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    img = Image.open(io.BytesIO(result.stdout))
+    img.load()
+    return img
+
+def _cv2_frame(cap, timestamp):
+    """按时间（而非帧序号）定位，由解码器跳到最近的关键帧后读取一帧"""
+    cap.set(cv2.CAP_PROP_POS_MSEC, timestamp * 1000)
+    success, frame = cap.read()
+    if not success:
+        return None
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+def extract_video_frame(video_path, max_size=(320, 240), timestamp=3.0, time_budget=THUMBNAIL_TIME_BUDGET):
+    """
+    从视频中截取一帧作为缩略图
+    
+    依次尝试多个候选时间点，跳过黑屏帧；所有候选都是黑屏时返回最亮的一帧。
+    超出时间预算后不再尝试新的时间点。安装了 ffmpeg 时使用关键帧截取，
+    否则使用 OpenCV 按时间定位。
+    
+    Args:
+        video_path: 视频完整路径
+        max_size: 目标尺寸（ffmpeg 解码后直接缩放到该尺寸）
+        timestamp: 优先尝试的时间点(秒)
+        time_budget: 单个视频的时间预算(秒)
+    
+    Returns:
+        PIL 图片或None
+    """
+    deadline = time.monotonic() + time_budget
+    best, best_brightness = None, -1.0
+    
+    cap = None
+    if FFMPEG_PATH:
+        duration = _probe_duration(video_path, timeout=max(time_budget / 4, 1.0))
+        grab = lambda t: _ffmpeg_frame(video_path, t, max_size, max(deadline - time.monotonic(), 0.5))
+    else:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return None
+        # 帧数在很多容器中并不可靠，只作为候选时间点的参考
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        duration = frame_count / fps if fps > 0 and frame_count > 0 else None
+        grab = lambda t: _cv2_frame(cap, t)
+    
+    try:
+        for t in _candidate_timestamps(duration, timestamp):
+            if best is not None and time.monotonic() > deadline:
+                break
+            img = grab(t)
+            if img is None:
+                continue
+            if not _is_black_frame(img):
+                return img
+            brightness = ImageStat.Stat(img.convert("L")).mean[0]
+            if brightness > best_brightness:
+                best, best_brightness = img, brightness
+        
+        if best is None and cap is not None:
+            # 所有时间点都定位失败时读取第一帧
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = cap.read()
+            if success:
+                best = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        return best
+    finally:
+        if cap is not None:
+            cap.release()
+
+def get_video_thumbnail(video_path, max_size=(320, 240), timestamp=3.0, variant=DEFAULT_VARIANT, quality=80):
     """
     从视频中提取指定时间点的帧作为缩略图
     
@@ -24,6 +232,8 @@ def get_video_thumbnail(video_path, max_size=(320, 240), timestamp=3.0):
         video_path: 视频完整路径
         max_size: 缩略图最大尺寸
         timestamp: 截取视频的时间点(秒)
+        variant: 尺寸规格名称（用于缓存键）
+        quality: JPEG 质量
     
     Returns:
         缩略图存储路径或None
@@ -32,63 +242,38 @@ def get_video_thumbnail(video_path, max_size=(320, 240), timestamp=3.0):
         return None
     
     # 生成缓存文件名
-    file_hash = str(uuid.uuid5(uuid.NAMESPACE_URL, video_path))
-    thumbnail_path = os.path.join(THUMBNAIL_CACHE_DIR, f"video_{file_hash}.jpg")
+    thumbnail_path = thumbnail_cache_path(video_path, "video", variant)
     
     # 如果缩略图已存在，直接返回
     if os.path.exists(thumbnail_path):
+        touch_thumbnail(thumbnail_path)
         return thumbnail_path
     
     try:
-        # 打开视频文件
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
+        img = extract_video_frame(video_path, max_size, timestamp)
+        if img is None:
             return None
         
-        # 获取视频FPS和总帧数
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = frame_count / fps if fps > 0 else 0
-        
-        # 如果视频太短，取第一帧，否则取指定时间点
-        target_frame = 0 if duration < timestamp else int(timestamp * fps)
-        
-        # 定位到指定帧
-        cap.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
-        success, frame = cap.read()
-        
-        if not success:
-            # 如果指定帧获取失败，尝试获取第一帧
-            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            success, frame = cap.read()
-        
-        cap.release()
-        
-        if not success:
-            return None
-        
-        # 转换为RGB（OpenCV默认是BGR）
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
         # 调整大小
-        img = Image.fromarray(frame)
         img.thumbnail(max_size)
         
         # 保存缩略图
-        img.save(thumbnail_path, "JPEG", quality=80)
+        save_thumbnail(img, thumbnail_path, quality)
         return thumbnail_path
     
     except Exception as e:
         print(f"视频缩略图生成失败: {e}")
         return None
 
-def get_audio_cover(audio_path, max_size=(320, 240)):
+def get_audio_cover(audio_path, max_size=(320, 240), variant=DEFAULT_VARIANT, quality=80):
     """
     从音频文件中提取封面图片
     
     Args:
         audio_path: 音频文件路径
         max_size: 缩略图最大尺寸
+        variant: 尺寸规格名称（用于缓存键）
+        quality: JPEG 质量
     
     Returns:
         缩略图存储路径或None
@@ -97,11 +282,11 @@ def get_audio_cover(audio_path, max_size=(320, 240)):
         return None
     
     # 生成缓存文件名
-    file_hash = str(uuid.uuid5(uuid.NAMESPACE_URL, audio_path))
-    thumbnail_path = os.path.join(THUMBNAIL_CACHE_DIR, f"audio_{file_hash}.jpg")
+    thumbnail_path = thumbnail_cache_path(audio_path, "audio", variant)
     
     # 如果缩略图已存在，直接返回
     if os.path.exists(thumbnail_path):
+        touch_thumbnail(thumbnail_path)
         return thumbnail_path
     
     try:
@@ -142,7 +327,7 @@ def get_audio_cover(audio_path, max_size=(320, 240)):
         if cover_data:
             img = Image.open(io.BytesIO(cover_data))
             img.thumbnail(max_size)
-            img.save(thumbnail_path, "JPEG", quality=80)
+            save_thumbnail(img, thumbnail_path, quality)
             return thumbnail_path
         
         return None
@@ -152,13 +337,14 @@ def get_audio_cover(audio_path, max_size=(320, 240)):
         return None
 
 # 获取任意媒体文件的缩略图
-def get_media_thumbnail(file_path, media_type=None):
+def get_media_thumbnail(file_path, media_type=None, variant=DEFAULT_VARIANT):
     """
     获取媒体文件的缩略图，支持视频和音频
     
     Args:
         file_path: 媒体文件路径
         media_type: 媒体类型(video/audio)，如不提供则自动识别
+        variant: 尺寸规格（list/grid/retina/poster）
     
     Returns:
         缩略图路径或None
@@ -179,23 +365,25 @@ def get_media_thumbnail(file_path, media_type=None):
         else:
             return None
     
+    max_size, quality = THUMBNAIL_VARIANTS.get(variant, THUMBNAIL_VARIANTS[DEFAULT_VARIANT])
+    
     # 根据媒体类型处理
     if media_type == 'video':
-        return get_video_thumbnail(file_path)
+        return get_video_thumbnail(file_path, max_size, variant=variant, quality=quality)
     elif media_type == 'audio':
-        return get_audio_cover(file_path)
+        return get_audio_cover(file_path, max_size, variant=variant, quality=quality)
     
     return None
 
 
 
-def clean_thumbnail_cache(max_age_days: int = 1, batch_size: int = 5):
+def clean_thumbnail_cache(max_age_days: int = 30, max_cache_bytes: int = THUMBNAIL_CACHE_MAX_BYTES):
     """
-    清理长时间未访问的缩略图缓存
+    清理缩略图缓存：删除长时间未访问的缩略图，并在总大小超出上限时按最近访问时间淘汰
     
     Args:
-        max_age_days: 缩略图最大保留天数
-        batch_size: 每次清理的文件数量
+        max_age_days: 缩略图自最近一次访问起的最大保留天数
+        max_cache_bytes: 缓存总大小上限（字节），超出后淘汰到上限的 90%
     
     Returns:
         清理的文件数量
@@ -205,46 +393,61 @@ def clean_thumbnail_cache(max_age_days: int = 1, batch_size: int = 5):
     
     now = time.time()
     max_age_seconds = max_age_days * 24 * 3600
-    cleaned_count = 0
     
-    # 获取所有缩略图文件
-    thumbnail_files = [os.path.join(THUMBNAIL_CACHE_DIR, f) 
-                      for f in os.listdir(THUMBNAIL_CACHE_DIR) 
-                      if os.path.isfile(os.path.join(THUMBNAIL_CACHE_DIR, f))]
+    # 修改时间即最近访问时间（见 touch_thumbnail）
+    entries = []
+    with os.scandir(THUMBNAIL_CACHE_DIR) as it:
+        for entry in it:
+            try:
+                if entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+            except OSError:
+                continue
     
-    # 按照修改时间排序，最旧的在前面
-    thumbnail_files.sort(key=lambda x: os.path.getmtime(x))
+    # 最久未访问的在前面
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+    over_budget = total_size > max_cache_bytes
+    target_size = int(max_cache_bytes * 0.9)
+    cleaned_count = 0
     
-    # 只处理指定批次数量的文件
-    for file_path in thumbnail_files[:batch_size]:
-        file_age = now - os.path.getmtime(file_path)
-        
-        # 如果文件超过最大保留时间，删除它
-        if file_age > max_age_seconds:
-            try:
-                os.remove(file_path)
-                cleaned_count += 1
-                print(f"已清理缩略图: {os.path.basename(file_path)}")
-            except Exception as e:
-                print(f"清理缩略图失败: {e}")
+    for mtime, size, file_path in entries:
+        expired = now - mtime > max_age_seconds
+        # 残留的临时文件（生成过程中进程退出）超过一小时直接删除
+        stale_tmp = file_path.endswith(".tmp") and now - mtime > 3600
+        if not expired and not stale_tmp and (not over_budget or total_size <= target_size):
+            break
+        try:
+            os.remove(file_path)
+            total_size -= size
+            cleaned_count += 1
+        except OSError as e:
+            print(f"清理缩略图失败: {e}")
     
+    if cleaned_count:
+        print(f"已清理 {cleaned_count} 个缩略图，缓存大小: {total_size / 1024 / 1024:.1f}MB")
     return cleaned_count
 
-def start_thumbnail_cleanup_task(interval_minutes: int = 30, max_age_days: int = 7):
+def start_thumbnail_cleanup_task(interval_minutes: int = 30, max_age_days: int = 30,
+                                 max_cache_bytes: int = THUMBNAIL_CACHE_MAX_BYTES, should_run=None):
     """
     启动后台线程，定期清理缩略图缓存
     
     Args:
         interval_minutes: 检查间隔（分钟）
         max_age_days: 缩略图最大保留天数
+        max_cache_bytes: 缓存总大小上限（字节）
+        should_run: 返回 False 时跳过本次清理（多进程部署时只由主进程清理）
     """
     def cleanup_worker():
         while True:
             try:
-                # 每次只清理一个文件，减少系统负载
-                clean_thumbnail_cache(max_age_days=max_age_days, batch_size=1)
                 # 等待指定时间
                 time.sleep(interval_minutes * 60)
+                if should_run is not None and not should_run():
+                    continue
+                clean_thumbnail_cache(max_age_days=max_age_days, max_cache_bytes=max_cache_bytes)
             except Exception as e:
                 print(f"缩略图清理任务异常: {e}")
                 # 发生异常后短暂等待后继续
@@ -253,20 +456,23 @@ def start_thumbnail_cleanup_task(interval_minutes: int = 30, max_age_days: int =
     # 创建守护线程，这样主程序退出时线程也会退出
     cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
     cleanup_thread.start()
-    print(f"缩略图清理任务已启动，间隔: {interval_minutes}分钟, 最大保留时间: {max_age_days}天")
+    print(f"缩略图清理任务已启动，间隔: {interval_minutes}分钟, 最大保留时间: {max_age_days}天, "
+          f"缓存上限: {max_cache_bytes / 1024 / 1024:.0f}MB")
     
     return cleanup_thread
 
 
 # 启动缩略图清理服务
-def start_cleanup_service(interval_minutes=60, max_age_days=7, initial_cleanup=True):
+def start_cleanup_service(interval_minutes=60, max_age_days=30, initial_cleanup=True,
+                          max_cache_bytes=THUMBNAIL_CACHE_MAX_BYTES, should_run=None):
     """启动缩略图清理服务"""
-    if initial_cleanup:
-        # 启动时先执行一次批量清理
-        cleaned_count = clean_thumbnail_cache(max_age_days=0, batch_size=20)
+    if initial_cleanup and (should_run is None or should_run()):
+        # 启动时按同样的规则清理一次（只淘汰过期或超出上限的缩略图）
+        cleaned_count = clean_thumbnail_cache(max_age_days=max_age_days, max_cache_bytes=max_cache_bytes)
         print(f"初始清理完成: 已清理 {cleaned_count} 个缩略图")
     
     # 启动后台定时清理任务
     return start_thumbnail_cleanup_task(interval_minutes=interval_minutes, 
-                                      max_age_days=max_age_days)
-
+                                      max_age_days=max_age_days,
+                                      max_cache_bytes=max_cache_bytes,
+                                      should_run=should_run)
@@ -0,0 +1,207 @@
+import os
+import posixpath
+import threading
+import time
+import logging
+from pathlib import Path
+
+logger = logging.getLogger("virtual_mounts")
+
+# 映射源在存储根目录下显示的虚拟文件夹名（其下每个映射源一个子文件夹）
+MOUNTS_DIR_NAME = "mounts"
+# 目录列表缓存时间（秒）；分页浏览大目录时不必每页都重新遍历
+LISTING_CACHE_TTL = 10
+LISTING_CACHE_SIZE = 64
+
+
+def _sort_key(row, column):
+    path, name, is_dir, size, mtime, media_type = row
+    return {"name": name, "size": size, "mtime": mtime}[column], path
+
+
+class VirtualMounts:
+    """
+    外部目录的只读虚拟挂载
+
+    映射源（LOCAL_FILE_SOURCES）在 mounts/<名称>/ 下显示为只读文件夹，
+    访问时把虚拟路径解析到源目录中的实际文件，不复制文件也不创建链接。
+    目录列表直接读取源目录（短时间缓存），格式与文件索引的记录一致，
+    列表、下载、播放和缩略图接口可以直接复用。
+    """
+
+    def __init__(self, media_type_func=None, dir_name=MOUNTS_DIR_NAME):
+        self.dir_name = dir_name
+        self.media_type_func = media_type_func or (lambda name: "other")
+        self.enabled = False
+
+        self._mounts = {}
+        self._lock = threading.Lock()
+        self._listing_cache = {}
+
+    # ---------------- 配置 ----------------
+
+    def set_sources(self, sources, enabled=None):
+        """按映射源列表重建挂载表，名称取源目录名，重名时加序号"""
+        mounts = {}
+        for source in dict.fromkeys(os.path.abspath(str(source)) for source in sources):
+            base = Path(source).name or Path(source).drive.strip(":\\/") or "root"
+            name, index = base, 2
+            while name in mounts:
+                name = f"{base}-{index}"
+                index += 1
+            mounts[name] = source
+        with self._lock:
+            self._mounts = mounts
+            self._listing_cache.clear()
+        if enabled is not None:
+            self.enabled = bool(enabled)
+
+    def mounts(self):
+        """返回 {挂载名称: 源目录}（未启用时为空）"""
+        return dict(self._mounts) if self.enabled else {}
+
+    # ---------------- 路径解析 ----------------
+
+    def _split(self, path):
+        """拆分存储相对路径，不属于虚拟目录时返回 None"""
+        if not self.enabled or path is None:
+            return None
+        path = posixpath.normpath("/" + str(path).replace("\\", "/")).strip("/")
+        parts = path.split("/") if path else []
+        if not parts or parts[0] != self.dir_name:
+            return None
+        return parts[1:]
+
+    def relative(self, path):
+        """虚拟目录中的路径规范化为 '/' 分隔的相对路径，其他路径返回 None"""
+        parts = self._split(path)
+        if parts is None:
+            return None
+        return "/".join([self.dir_name, *parts])
+
+    def is_virtual(self, path):
+        """路径是否位于虚拟目录中（这些路径都是只读的）"""
+        return self._split(path) is not None
+
+    def is_mounts_root(self, path):
+        return self._split(path) == []
+
+    def resolve(self, path):
+        """
+        把虚拟路径解析为源目录中的实际路径
+
+        Returns:
+            实际路径（Path）；不属于任何挂载、或通过符号链接指向源目录之外时返回 None
+        """
+        parts = self._split(path)
+        if not parts:
+            return None
+        source = self._mounts.get(parts[0])
+        if source is None:
+            return None
+        real_path = os.path.join(source, *parts[1:])
+        try:
+            real_source = os.path.realpath(source)
+            if os.path.commonpath([real_source, os.path.realpath(real_path)]) != real_source:
+                return None
+        except ValueError:
+            return None
+        return Path(real_path)
+
+    # ---------------- 目录列表 ----------------
+
+    def _row(self, rel_path, name, is_dir, st):
+        if is_dir:
+            return (rel_path, name, 1, 0, st.st_mtime, "folder")
+        return (rel_path, name, 0, st.st_size, st.st_mtime, self.media_type_func(name))
+
+    def root_row(self):
+        """存储根目录下的虚拟目录本身"""
+        return (self.dir_name, self.dir_name, 1, 0, time.time(), "folder")
+
+    def _scan(self, rel_path):
+        if self.is_mounts_root(rel_path):
+            rows = []
+            for name, source in self._mounts.items():
+                try:
+                    st = os.stat(source)
+                except OSError:
+                    continue
+                rows.append(self._row(f"{self.dir_name}/{name}", name, True, st))
+            return rows
+
+        real_path = self.resolve(rel_path)
+        if real_path is None:
+            return None
+        prefix = self.relative(rel_path)
+        try:
+            dir_mtime = os.stat(real_path).st_mtime_ns
+        except OSError:
+            return None
+
+        cached = self._listing_cache.get(prefix)
+        if cached is not None and cached[0] == dir_mtime and time.monotonic() - cached[1] < LISTING_CACHE_TTL:
+            return cached[2]
+
+        rows = []
+        try:
+            with os.scandir(real_path) as entries:
+                for entry in entries:
+                    try:
+                        # 不跟随符号链接，避免访问到源目录之外
+                        if entry.is_symlink():
+                            continue
+                        is_dir = entry.is_dir()
+                        if not is_dir and not entry.is_file():
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    rows.append(self._row(f"{prefix}/{entry.name}", entry.name, is_dir, st))
+        except OSError as e:
+            logger.warning(f"读取外部目录失败: {real_path} - {str(e)}")
+            return None
+
+        with self._lock:
+            if len(self._listing_cache) >= LISTING_CACHE_SIZE:
+                self._listing_cache.pop(next(iter(self._listing_cache)))
+            self._listing_cache[prefix] = (dir_mtime, time.monotonic(), rows)
+        return rows
+
+    def list_children(self, rel_path):
+        """列出虚拟目录的直接子项，目录不存在时返回 None"""
+        return self._scan(rel_path)
+
+    def list_page(self, rel_path, sort="name", order="asc", media_type=None, limit=500, after=None):
+        """
+        分页列出虚拟目录的直接子项，参数和返回值与 FileIndex.list_page 相同
+
+        Returns:
+            (记录列表, 符合条件的总数)；目录不存在时返回 None
+        """
+        rows = self._scan(rel_path)
+        if rows is None:
+            return None
+        if media_type == "folder":
+            rows = [row for row in rows if row[2]]
+        elif media_type:
+            rows = [row for row in rows if not row[2] and row[5] == media_type]
+        total = len(rows)
+
+        descending = order == "desc"
+        # 文件夹始终排在文件前面
+        folders = sorted((row for row in rows if row[2]), key=lambda row: _sort_key(row, sort), reverse=descending)
+        files = sorted((row for row in rows if not row[2]), key=lambda row: _sort_key(row, sort), reverse=descending)
+        rows = folders + files
+
+        if after is not None:
+            is_dir, key, path = after
+
+            def is_after(row):
+                if row[2] != is_dir:
+                    return row[2] < is_dir
+                current = _sort_key(row, sort)
+                return current < (key, path) if descending else current > (key, path)
+
+            rows = [row for row in rows if is_after(row)]
+        return rows[:limit], total
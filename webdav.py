@@ -1,15 +1,67 @@
 import os
 from wsgidav.wsgidav_app import WsgiDAVApp
-from wsgidav.fs_dav_provider import FilesystemProvider
+from wsgidav.fs_dav_provider import FilesystemProvider, FolderResource
+from wsgidav.dav_provider import DAVCollection
 from wsgidav.dc.simple_dc import SimpleDomainController
 from pathlib import Path
 import threading
 import logging
 
+# 外部目录（虚拟挂载）的根文件夹：只列出各个挂载，本身不可写
+class MountsCollection(DAVCollection):
+    def __init__(self, path, environ, mounts):
+        super().__init__(path, environ)
+        self.mounts = mounts
+
+    def get_member_names(self):
+        return list(self.mounts)
+
+    def get_member(self, name):
+        source = self.mounts.get(name)
+        if source is None or not os.path.isdir(source):
+            return None
+        # 仅用于列出属性；访问挂载内的路径时由对应的只读共享处理
+        return FolderResource(f"{self.path}/{name}", self.environ, source)
+
+
+# 存储根目录：在列表中额外显示外部目录文件夹
+class StorageRootResource(FolderResource):
+    def __init__(self, path, environ, file_path, mounts_dir):
+        super().__init__(path, environ, file_path)
+        self.mounts_dir = mounts_dir
+
+    def get_member_names(self):
+        names = super().get_member_names()
+        if self.mounts_dir not in names:
+            names.append(self.mounts_dir)
+        return names
+
+
+class StorageProvider(FilesystemProvider):
+    """存储目录的 WebDAV 提供者，根目录下显示只读的外部目录"""
+
+    def __init__(self, root_folder, mounts_dir, mounts, **kwargs):
+        super().__init__(root_folder, **kwargs)
+        self.mounts_dir = mounts_dir
+        self.mounts = mounts
+
+    def get_resource_inst(self, path, environ):
+        if path.strip("/") == self.mounts_dir:
+            return MountsCollection(f"/{self.mounts_dir}", environ, self.mounts)
+        resource = super().get_resource_inst(path, environ)
+        if isinstance(resource, FolderResource) and path.strip("/") == "":
+            return StorageRootResource(path, environ, resource._file_path, self.mounts_dir)
+        return resource
+
+
 # 配置 WebDAV 服务器
 class WebDAVServer:
-    def __init__(self, storage_path, host="0.0.0.0", port=5889, auth_enabled=True, username="admin", password="admin"):
+    def __init__(self, storage_path, host="0.0.0.0", port=5889, auth_enabled=True, username="admin", password="admin",
+                 mounts_dir=None, mounts=None):
         self.storage_path = storage_path
+        # 外部目录：{挂载名称: 源目录}，作为只读共享挂在 /<mounts_dir>/<名称>
+        self.mounts_dir = mounts_dir
+        self.mounts = mounts or {}
         self.host = host
         self.port = port
         self.auth_enabled = auth_enabled
@@ -19,11 +71,20 @@ class WebDAVServer:
         self.server = None
         self.logger = logging.getLogger("webdav")
         
+    def get_provider_mapping(self):
+        if not self.mounts_dir or not self.mounts:
+            return {"/": FilesystemProvider(str(self.storage_path))}
+        provider_mapping = {
+            "/": StorageProvider(str(self.storage_path), self.mounts_dir, self.mounts)
+        }
+        for name, source in self.mounts.items():
+            if os.path.isdir(source):
+                provider_mapping[f"/{self.mounts_dir}/{name}"] = FilesystemProvider(source, readonly=True)
+        return provider_mapping
+
     def get_config(self):
         config = {
-            "provider_mapping": {
-                "/": FilesystemProvider(str(self.storage_path))
-            },
+            "provider_mapping": self.get_provider_mapping(),
             "http_authenticator": {
                 "domain_controller": None,
             },
@@ -88,7 +149,7 @@ class WebDAVServer:
             self.logger.info("WebDAV 服务器线程已停止")
 
 # 配置 WebDAV 服务器函数
-def configure_webdav(storage_path, config_path="./config"):
+def configure_webdav(storage_path, config_path="./config", mounts_dir=None, mounts=None):
     # 确保配置目录存在
     os.makedirs(config_path, exist_ok=True)
     
@@ -130,7 +191,9 @@ def configure_webdav(storage_path, config_path="./config"):
             port=config["port"],
             auth_enabled=config["auth_enabled"],
             username=config["username"],
-            password=config["password"]
+            password=config["password"],
+            mounts_dir=mounts_dir,
+            mounts=mounts
         )
     
     return None
\ No newline at end of file
@@ -122,11 +122,11 @@ class WebDAVConnection:
             logger.error(f"列出WebDAV文件失败: {path} - {str(e)}")
             raise
             
-    def download_file(self, remote_path, local_path):
-        """下载文件到本地路径"""
+    def download_file(self, remote_path, local_path, progress=None):
+        """下载文件到本地路径，progress(已下载字节数, 总字节数) 在每个数据块写入后调用"""
         try:
             client = self.connect()
-            client.download_sync(remote_path=remote_path, local_path=local_path)
+            client.download_sync(remote_path=remote_path, local_path=local_path, progress=progress)
             return True
         except Exception as e:
             logger.error(f"从WebDAV下载文件失败: {remote_path} -> {local_path} - {str(e)}")
@@ -210,6 +210,8 @@ class WebDAVConnection:
 class WebDAVConnectionManager:
     def __init__(self):
         self.connections = {}
+        # 连接配置保存后的回调（多进程部署时用于通知其他进程重新加载）
+        self.on_change = None
         self.load_connections()
         
     def load_connections(self):
@@ -239,6 +241,8 @@ class WebDAVConnectionManager:
             with open(WEBDAV_CONNECTIONS_FILE, 'w', encoding='utf-8') as f:
                 json.dump(connections_data, f, indent=2, ensure_ascii=False)
             logger.info(f"已保存 {len(self.connections)} 个WebDAV连接配置")
+            if self.on_change:
+                self.on_change()
         except Exception as e:
             logger.error(f"保存WebDAV连接配置失败: {str(e)}")
             